@@ -0,0 +1,172 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.metrics import accuracy_score
+
+from data_aggregator import (EuropeanSoccerDatabase,
+                             MatchResultPredictDataAggregator)
+from model_evaluation import SHARED_ARRAY_THRESHOLD, getDefaultClassifiers
+from predict import buildMatchDataset
+
+
+def getSteps(matches, granularity="stage"):
+    # Step number of every match, with steps ordered by season and then by
+    # stage. Returns the step of each row and the keys of every step.
+    keys = ["season", "stage"] if granularity == "stage" else ["season"]
+    matchKeys = matches[keys].astype({"season": str})
+    stepKeys = matchKeys.drop_duplicates().sort_values(keys).reset_index(
+        drop=True)
+    steps = matchKeys.merge(
+        stepKeys.reset_index(), on=keys, how="left")["index"].to_numpy()
+    return steps, stepKeys
+
+
+def getTrainingMasks(steps, dates, firstStep):
+    # Rows a step may train on: earlier steps that also kicked off before
+    # the step started. A step starting before an earlier one, a fixture
+    # brought forward, trains on less than that step did, so the training
+    # sets are not always nested.
+    dates = pd.to_datetime(dates).to_numpy()
+    for step in range(firstStep, steps.max() + 1):
+        testMask = steps == step
+        if not testMask.any():
+            continue
+        yield step, (steps < step) & (dates < dates[testMask].min()), testMask
+
+
+def supportsPartialFit(classifier):
+    return hasattr(classifier, "partial_fit")
+
+
+def supportsWarmStart(classifier):
+    # Only the linear models refit the whole training set from the previous
+    # solution. Ensembles only add estimators on a warm start, with the same
+    # n_estimators they would not fit anything new.
+    return type(classifier).__module__.startswith("sklearn.linear_model") \
+        and "warm_start" in classifier.get_params()
+
+
+def fitStep(classifier, features, labels, trainIndex, testIndex, step):
+    classifier = clone(classifier)
+    start = time.perf_counter()
+    classifier.fit(features[trainIndex], labels[trainIndex])
+    fitSeconds = time.perf_counter() - start
+    return step, classifier.predict(features[testIndex]), fitSeconds
+
+
+def runIndependentSteps(classifier, features, labels, folds, nJobs):
+    # Every step refits from scratch, so the steps run in parallel
+    return Parallel(n_jobs=nJobs or -1, max_nbytes=SHARED_ARRAY_THRESHOLD,
+                    mmap_mode="r")(
+        delayed(fitStep)(classifier, features, labels,
+                         np.flatnonzero(trainMask), np.flatnonzero(testMask),
+                         step)
+        for step, trainMask, testMask in folds
+    )
+
+
+def runIncrementalSteps(classifier, features, labels, folds):
+    # partial_fit only sees the rows that became available since the last
+    # step and starts over when a step trains on rows it has not, warm_start
+    # models refit starting from the previous solution
+    classifier = clone(classifier)
+    usePartialFit = supportsPartialFit(classifier)
+    if not usePartialFit:
+        classifier.set_params(warm_start=True)
+    classes = np.unique(labels)
+    seen = np.zeros(len(labels), dtype=bool)
+    results = []
+    for step, trainMask, testMask in folds:
+        start = time.perf_counter()
+        if usePartialFit:
+            if (seen & ~trainMask).any():
+                classifier = clone(classifier)
+                seen[:] = False
+            newRows = trainMask & ~seen
+            if newRows.any():
+                classifier.partial_fit(
+                    features[newRows], labels[newRows], classes=classes)
+        else:
+            classifier.fit(features[trainMask], labels[trainMask])
+        fitSeconds = time.perf_counter() - start
+        seen |= trainMask
+        results.append(
+            (step, classifier.predict(features[testMask]), fitSeconds))
+    return results
+
+
+def backtest(classifiers, dataset, granularity="stage", firstSeason=1,
+             nJobs=None):
+    # Walk-forward evaluation: every step is predicted by a model trained on
+    # everything before it. dataset holds the feature columns plus
+    # match_api_id, label, season, stage and date. Returns one row per
+    # (classifier, step).
+    metaColumns = ["match_api_id", "label", "season", "stage", "date"]
+    dataset = dataset.sort_values("date", kind="mergesort")
+    features = np.ascontiguousarray(
+        dataset.drop(columns=metaColumns).to_numpy(dtype=np.float64))
+    labels = dataset.label.to_numpy()
+    steps, stepKeys = getSteps(dataset, granularity)
+    seasons = np.sort(stepKeys.season.unique())
+    if len(seasons) <= firstSeason:
+        raise ValueError(
+            "Backtesting from season {} needs at least {} seasons, the "
+            "dataset has {}".format(firstSeason, firstSeason + 1,
+                                    len(seasons)))
+    firstStep = int(np.searchsorted(
+        stepKeys.season.to_numpy(), seasons[firstSeason]))
+
+    rows = []
+    for classifier in classifiers:
+        folds = [(step, trainMask, testMask) for step, trainMask, testMask
+                 in getTrainingMasks(steps, dataset.date, firstStep)
+                 if trainMask.any()]
+        if supportsPartialFit(classifier) or supportsWarmStart(classifier):
+            results = runIncrementalSteps(classifier, features, labels, folds)
+        else:
+            results = runIndependentSteps(
+                classifier, features, labels, folds, nJobs)
+        for (step, trainMask, testMask), (_, predictions, fitSeconds) in zip(
+                folds, results):
+            row = stepKeys.iloc[step].to_dict()
+            row.update({
+                "classifier": classifier.__class__.__name__,
+                "train_rows": int(trainMask.sum()),
+                "test_rows": int(testMask.sum()),
+                "fit_seconds": fitSeconds,
+                "correct": int((predictions == labels[testMask]).sum()),
+                "accuracy": accuracy_score(labels[testMask], predictions),
+            })
+            rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def summarizeBacktest(report, by="classifier"):
+    summary = report.groupby(by, sort=False)[
+        ["correct", "test_rows", "fit_seconds"]].sum()
+    summary["accuracy"] = summary.correct / summary.test_rows
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--granularity", choices=["stage", "season"],
+                        default="stage")
+    parser.add_argument("--jobs", type=int, default=None)
+    args = parser.parse_args()
+
+    dataAggregator = MatchResultPredictDataAggregator(EuropeanSoccerDatabase())
+    dataset = buildMatchDataset(dataAggregator, sampleSize=None)
+    dataset = dataset.merge(
+        dataAggregator.matchData[["match_api_id", "season", "stage", "date"]],
+        on="match_api_id", how="left")
+    start = time.perf_counter()
+    report = backtest(getDefaultClassifiers(), dataset,
+                      granularity=args.granularity, nJobs=args.jobs)
+    print(summarizeBacktest(report))
+    print(summarizeBacktest(report, ["classifier", "season"]))
+    print("Backtest took {:.1f}s".format(time.perf_counter() - start))
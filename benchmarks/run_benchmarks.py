@@ -0,0 +1,327 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import closing
+
+sys.path.append(os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+from benchmarks.synthetic_database import generateDatabase, getScaledShape
+from shared.constants import DATASET_PATH
+
+BENCHMARK_PATH = os.path.join(DATASET_PATH, "benchmarks")
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "baseline.json")
+DEFAULT_SCALES = [0.125, 1.0]
+# The XML event columns are only generated up to this scale, they would
+# dominate the size of larger databases
+EVENTS_MAX_SCALE = 1.0
+# Matches run through the row by row reference implementations
+REFERENCE_SAMPLE = 200
+# A stage is flagged when it is this much slower or larger than the
+# baseline, and by more than the absolute noise floors
+TOLERANCE = 0.25
+SECONDS_NOISE = 0.05
+MEGABYTES_NOISE = 8.0
+TABLES = ["Match", "Country", "League", "Team", "Player", "Player_Attributes"]
+
+
+def getDatabasePath(scale, seed, benchmarkPath=BENCHMARK_PATH):
+    return os.path.join(benchmarkPath, "synthetic_{:g}_{}.sqlite".format(
+        scale, seed))
+
+
+def getPeakMemory():
+    # Peak resident memory in bytes since the last resetPeakMemory, or since
+    # the process started where the peak cannot be reset
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxRss if sys.platform == "darwin" else maxRss * 1024
+
+
+def getCurrentMemory():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return getPeakMemory()
+
+
+def resetPeakMemory():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+class StageRecorder(object):
+    # Times pipeline stages run in sequence and records the peak resident
+    # memory reached during each of them along with how much memory the
+    # stage left allocated
+
+    def __init__(self):
+        self.stages = dict()
+
+    def run(self, name, function, *args, **kwargs):
+        resetPeakMemory()
+        before = getCurrentMemory()
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        self.stages[name] = {
+            "seconds": round(seconds, 4),
+            "peak_rss_mb": round(getPeakMemory() / 2 ** 20, 1),
+            "rss_delta_mb": round((getCurrentMemory() - before) / 2 ** 20, 1),
+        }
+        if isinstance(result, int):
+            self.stages[name]["rows"] = result
+        elif hasattr(result, "__len__"):
+            self.stages[name]["rows"] = len(result)
+        return result
+
+
+def importPipelineModules():
+    # Timed on their own, startup cost is part of the pipeline
+    import data_aggregator  # noqa: F401
+    import elo_ratings  # noqa: F401
+    import feature_engine  # noqa: F401
+    import match_events  # noqa: F401
+    import scoring  # noqa: F401
+    import training_matrix  # noqa: F401
+    import visualization.predictions  # noqa: F401
+
+
+def runReferenceFeatures(matches, sample):
+    from predict import getFeaturesFromMatches
+    return [getFeaturesFromMatches(match, matches)
+            for _, match in matches.head(sample).iterrows()]
+
+
+def runReferenceRatings(ratingHelper, matches, sample):
+    return [ratingHelper.getPlayerRatings(match)
+            for _, match in matches.head(sample).iterrows()]
+
+
+def runStages(databasePath, workPath, classifierName="GaussianNB",
+              referenceSample=REFERENCE_SAMPLE):
+    # Every stage of the pipeline on one database, each timed on its own
+    recorder = StageRecorder()
+
+    recorder.run("import", importPipelineModules)
+    from data_aggregator import (LINEUP_COLUMNS,
+                                 MatchResultPredictDataAggregator)
+    from elo_ratings import getEloFeatures
+    from feature_engine import TeamFormFeatureEngine
+    from match_events import MatchEventExtractor
+    from scoring import loadModel, scoreMatches, trainModel
+    from training_matrix import buildTrainingMatrix
+    from utils.db_helper import PooledSqliteHelper
+    from visualization.predictions import PredictionIndex
+
+    database = PooledSqliteHelper()
+    database.connect(databasePath)
+    dataAggregator = MatchResultPredictDataAggregator(database)
+    recorder.run("load_tables", dataAggregator.loadTables, TABLES)
+    recorder.run("aggregate", dataAggregator.aggregate)
+    matches = dataAggregator.matchData.dropna(subset=LINEUP_COLUMNS)
+    ratingHelper = dataAggregator.playerAttributeDataHelper
+
+    recorder.run("features_reference", runReferenceFeatures, matches,
+                 referenceSample)
+    recorder.run("team_form_features",
+                 lambda: TeamFormFeatureEngine(matches).getFeatures())
+    recorder.run("player_ratings", ratingHelper.getPlayerRatingMatrix,
+                 matches)
+    recorder.run("player_ratings_reference", runReferenceRatings,
+                 ratingHelper, matches, referenceSample)
+    recorder.run("elo_ratings", getEloFeatures, matches)
+    recorder.run("training_matrix",
+                 lambda: buildTrainingMatrix(matches, ratingHelper)[1])
+    if database.runQuery(
+            "SELECT COUNT(*) AS count FROM Match WHERE shoton IS NOT NULL;"
+    )["count"].iloc[0]:
+        recorder.run("match_events",
+                     MatchEventExtractor(dataAggregator).getMatchEvents)
+
+    modelFile = os.path.join(workPath, "model.joblib")
+    schemaFile = os.path.join(workPath, "schema.json")
+    predictionFile = os.path.join(workPath, "prediction.csv")
+    recorder.run("train_model", trainModel, dataAggregator,
+                 classifierName, None, modelFile, schemaFile)
+    classifier, schema = loadModel(modelFile, schemaFile)
+    recorder.run("score_matches", scoreMatches, dataAggregator, classifier,
+                 schema, predictionFile=predictionFile)
+    recorder.run("prediction_index", PredictionIndex.fromCsv, predictionFile)
+    database.closeAll()
+    return recorder.stages
+
+
+def runScale(scale, seed=0, benchmarkPath=BENCHMARK_PATH, regenerate=False,
+             classifierName="GaussianNB", referenceSample=REFERENCE_SAMPLE):
+    # Generates the scale's database once and benchmarks it in a fresh
+    # interpreter, so that peak memory and import time are those of a run
+    # on that database alone
+    databasePath = getDatabasePath(scale, seed, benchmarkPath)
+    result = {"scale": scale, "shape": dict(zip(
+        ["seasons", "teams_per_league"], getScaledShape(scale)))}
+    if regenerate or not os.path.exists(databasePath):
+        start = time.perf_counter()
+        result["tables"] = generateDatabase(
+            databasePath, scale, seed, withEvents=scale <= EVENTS_MAX_SCALE)
+        result["generate_seconds"] = round(time.perf_counter() - start, 2)
+    result["database_mb"] = round(os.path.getsize(databasePath) / 2 ** 20, 1)
+    with closing(sqlite3.connect(databasePath)) as connection:
+        result["matches"] = connection.execute(
+            "SELECT COUNT(*) FROM Match;").fetchone()[0]
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--worker", databasePath,
+         "--classifier", classifierName,
+         "--reference-sample", str(referenceSample)],
+        check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    result["stages"] = json.loads(output.splitlines()[-1])
+    return result
+
+
+def mergeRepeats(results):
+    # Fastest time and largest memory of each stage over repeated runs
+    merged = dict(results[0], stages=dict())
+    for name in results[0]["stages"]:
+        runs = [result["stages"][name] for result in results]
+        stage = dict(runs[0])
+        stage["seconds"] = min(run["seconds"] for run in runs)
+        stage["peak_rss_mb"] = max(run["peak_rss_mb"] for run in runs)
+        stage["rss_delta_mb"] = max(run["rss_delta_mb"] for run in runs)
+        merged["stages"][name] = stage
+    return merged
+
+
+def getEnvironment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compareStage(value, baseline, noise, tolerance):
+    if baseline is None or value is None:
+        return "new"
+    if value > baseline * (1 + tolerance) and value - baseline > noise:
+        return "regression"
+    if value < baseline * (1 - tolerance) and baseline - value > noise:
+        return "improvement"
+    return "ok"
+
+
+def compareResults(results, baseline, tolerance=TOLERANCE):
+    # One row per scale, stage and metric with the ratio to the baseline
+    baselineScales = {"{:g}".format(result["scale"]): result
+                      for result in baseline.get("results", [])}
+    rows = []
+    for result in results:
+        reference = baselineScales.get("{:g}".format(result["scale"]), {})
+        for name, stage in result["stages"].items():
+            referenceStage = reference.get("stages", {}).get(name, {})
+            for metric, noise in [("seconds", SECONDS_NOISE),
+                                  ("peak_rss_mb", MEGABYTES_NOISE)]:
+                value = stage.get(metric)
+                baselineValue = referenceStage.get(metric)
+                rows.append({
+                    "scale": result["scale"],
+                    "stage": name,
+                    "metric": metric,
+                    "value": value,
+                    "baseline": baselineValue,
+                    "ratio": round(value / baselineValue, 2)
+                    if baselineValue else None,
+                    "status": compareStage(value, baselineValue, noise,
+                                           tolerance),
+                })
+    return rows
+
+
+def printComparison(rows):
+    print("{:>7}  {:<26} {:<12} {:>10} {:>10} {:>6}  {}".format(
+        "scale", "stage", "metric", "value", "baseline", "ratio", "status"))
+    for row in rows:
+        print("{:>7g}  {:<26} {:<12} {:>10} {:>10} {:>6}  {}".format(
+            row["scale"], row["stage"], row["metric"], row["value"],
+            "-" if row["baseline"] is None else row["baseline"],
+            "-" if row["ratio"] is None else row["ratio"], row["status"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scales", type=float, nargs="+",
+                        default=DEFAULT_SCALES,
+                        help="Sizes relative to the real database, from "
+                             "0.125 (one season) to 100")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="Runs per scale, the fastest time is kept")
+    parser.add_argument("--classifier", default="GaussianNB")
+    parser.add_argument("--reference-sample", type=int,
+                        default=REFERENCE_SAMPLE)
+    parser.add_argument("--benchmark-path", default=BENCHMARK_PATH,
+                        help="Where the generated databases are kept")
+    parser.add_argument("--regenerate", action="store_true")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--output", help="Also write the results as JSON")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--worker", metavar="DATABASE",
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        with tempfile.TemporaryDirectory() as workPath:
+            stages = runStages(args.worker, workPath, args.classifier,
+                               args.reference_sample)
+        print(json.dumps(stages))
+        sys.exit(0)
+
+    results = []
+    for scale in args.scales:
+        runs = [runScale(scale, args.seed, args.benchmark_path,
+                         args.regenerate and repeat == 0, args.classifier,
+                         args.reference_sample)
+                for repeat in range(args.repeat)]
+        results.append(mergeRepeats(runs))
+    report = {"environment": getEnvironment(), "seed": args.seed,
+              "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    baseline = dict()
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    rows = compareResults(results, baseline, args.tolerance)
+    printComparison(rows)
+    if baseline and baseline.get("environment") != report["environment"]:
+        print("Baseline was recorded on {}, ratios are only indicative"
+              .format(baseline.get("environment")))
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print("Saved baseline to {}".format(args.baseline))
+    if args.fail_on_regression and any(
+            row["status"] == "regression" for row in rows):
+        sys.exit(1)
@@ -0,0 +1,127 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+from benchmarks.run_benchmarks import compareStage, getEnvironment
+
+ROOT_DIR = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+STARTUP_BASELINE_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "startup_baseline.json")
+# What each entry point runs before it can do its work. {snapshot} is a
+# dashboard snapshot built for the run.
+ENTRY_POINTS = {
+    "data_aggregator": "import data_aggregator",
+    "predict": "import predict",
+    "scoring": "import scoring",
+    "prediction_server": "import prediction_server",
+    "sharded_features": "import sharded_features",
+    "chunked_features": "import chunked_features",
+    "dashboard_modules": "import visualization.assets, visualization.charts, "
+                         "visualization.snapshot",
+    "dashboard_state_csv":
+        "from visualization.predictions import PredictionIndex\n"
+        "from visualization.snapshot import PREDICTION_FILE\n"
+        "PredictionIndex.fromCsv(PREDICTION_FILE)",
+    "dashboard_state_snapshot":
+        "from visualization.snapshot import loadDashboardSnapshot\n"
+        "assert loadDashboardSnapshot(path={snapshot!r}) is not None",
+}
+TOP_IMPORTS = 5
+TOLERANCE = 0.25
+MILLISECONDS_NOISE = 30.0
+
+
+def parseImportTime(stderr):
+    # Total import time and the time spent in each top level package, in
+    # milliseconds, from the output of python -X importtime
+    total = 0.0
+    packages = dict()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        selfTime, _, name = line[len("import time:"):].split("|")
+        package = name.strip().split(".")[0]
+        total += int(selfTime) / 1000.0
+        packages[package] = packages.get(package, 0.0) + \
+            int(selfTime) / 1000.0
+    return total, packages
+
+
+def measureEntryPoint(code, repeat=3):
+    # Fastest of repeat runs in fresh interpreters
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code], cwd=ROOT_DIR,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            universal_newlines=True)
+        wallTime = 1000.0 * (time.perf_counter() - start)
+        if process.returncode:
+            raise RuntimeError("{} failed:\n{}".format(
+                code, process.stderr[-2000:]))
+        importTime, packages = parseImportTime(process.stderr)
+        if best is None or wallTime < best["wall_ms"]:
+            heaviest = sorted(packages.items(), key=lambda item: -item[1])
+            best = {
+                "wall_ms": round(wallTime, 1),
+                "import_ms": round(importTime, 1),
+                "heaviest_imports": {name: round(milliseconds, 1)
+                                     for name, milliseconds in
+                                     heaviest[:TOP_IMPORTS]},
+            }
+    return best
+
+
+def measureStartup(repeat=3, entryPoints=None):
+    with tempfile.TemporaryDirectory() as workPath:
+        from visualization.snapshot import saveDashboardSnapshot
+        snapshotPath = os.path.join(workPath, "dashboard_snapshot.pkl")
+        saveDashboardSnapshot(path=snapshotPath, prerender=False)
+        return {name: measureEntryPoint(
+            ENTRY_POINTS[name].format(snapshot=snapshotPath), repeat)
+            for name in entryPoints or ENTRY_POINTS}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("entry_points", nargs="*", choices=[[]] + list(
+        ENTRY_POINTS), help="All of them by default")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline", default=STARTUP_BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    results = measureStartup(args.repeat, args.entry_points)
+    baseline = dict()
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = 0
+    print("{:<26} {:>9} {:>9} {:>9}  {:<12} {}".format(
+        "entry point", "wall ms", "import ms", "baseline", "status",
+        "heaviest imports"))
+    for name, result in results.items():
+        reference = baseline.get("results", {}).get(name, {}).get("wall_ms")
+        status = compareStage(result["wall_ms"], reference,
+                              MILLISECONDS_NOISE, args.tolerance)
+        regressions += status == "regression"
+        print("{:<26} {:>9} {:>9} {:>9}  {:<12} {}".format(
+            name, result["wall_ms"], result["import_ms"],
+            "-" if reference is None else reference, status,
+            ", ".join("{} {:.0f}".format(module, milliseconds)
+                      for module, milliseconds in
+                      result["heaviest_imports"].items())))
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"environment": getEnvironment(), "results": results},
+                      f, indent=2)
+        print("Saved baseline to {}".format(args.baseline))
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,281 @@
+import argparse
+import os
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+LEAGUES = [
+    (1, "Belgium", "Belgium Jupiler League"),
+    (1729, "England", "England Premier League"),
+    (4769, "France", "France Ligue 1"),
+    (7809, "Germany", "Germany 1. Bundesliga"),
+    (10257, "Italy", "Italy Serie A"),
+    (13274, "Netherlands", "Netherlands Eredivisie"),
+    (15722, "Poland", "Poland Ekstraklasa"),
+    (17642, "Portugal", "Portugal Liga ZON Sagres"),
+    (19694, "Scotland", "Scotland Premier League"),
+    (21518, "Spain", "Spain LIGA BBVA"),
+    (24558, "Switzerland", "Switzerland Super League"),
+]
+# Bookmaker prefixes of the odds columns of the original Match table
+BOOKMAKERS = ["B365", "BW", "IW", "LB", "PS", "WH", "SJ", "VC", "GB", "BS"]
+EVENT_COLUMNS = ["goal", "shoton", "shotoff", "foulcommit", "card", "cross",
+                 "corner", "possession"]
+# Shape of the real database: 8 seasons of 11 leagues, ~26k matches
+REAL_SEASONS = 8
+REAL_TEAMS_PER_LEAGUE = 18
+SQUAD_SIZE = 18
+FIRST_YEAR = 2008
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def getPlayerSlotColumns():
+    columns = []
+    for axis in ["X", "Y", ""]:
+        for teamType in ["home", "away"]:
+            for i in range(1, 12):
+                columns.append("{}_player_{}{}".format(teamType, axis, i))
+    return columns
+
+
+def getMatchColumns():
+    columns = [
+        "id", "country_id", "league_id", "season", "stage", "date",
+        "match_api_id", "home_team_api_id", "away_team_api_id",
+        "home_team_goal", "away_team_goal",
+    ]
+    columns.extend(getPlayerSlotColumns())
+    columns.extend(EVENT_COLUMNS)
+    for bookmaker in BOOKMAKERS:
+        for outcome in ["H", "D", "A"]:
+            columns.append("{}{}".format(bookmaker, outcome))
+    return columns
+
+
+TABLE_COLUMNS = {
+    "Country": [("id", "INTEGER"), ("name", "TEXT")],
+    "League": [("id", "INTEGER"), ("country_id", "INTEGER"), ("name", "TEXT")],
+    "Team": [("id", "INTEGER"), ("team_api_id", "INTEGER"),
+             ("team_fifa_api_id", "INTEGER"), ("team_long_name", "TEXT"),
+             ("team_short_name", "TEXT")],
+    "Player": [("id", "INTEGER"), ("player_api_id", "INTEGER"),
+               ("player_name", "TEXT"), ("player_fifa_api_id", "INTEGER"),
+               ("birthday", "TEXT"), ("height", "REAL"), ("weight", "INTEGER")],
+    "Player_Attributes": [("id", "INTEGER"), ("player_fifa_api_id", "INTEGER"),
+                          ("player_api_id", "INTEGER"), ("date", "TEXT"),
+                          ("overall_rating", "INTEGER"),
+                          ("potential", "INTEGER")],
+    # Column types of the original Match table
+    "Match": [(column, "TEXT" if column in ["season", "date"] +
+               EVENT_COLUMNS else "REAL" if column[-1] in "HDA" and
+               column[:-1] in BOOKMAKERS else "INTEGER")
+              for column in getMatchColumns()],
+}
+
+
+def getScaledShape(scale):
+    # Below one the number of seasons shrinks, down to a single season.
+    # Above one the seasons grow up to 10x, then the teams per league grow
+    # so that the number of matches keeps growing linearly with scale.
+    if scale <= 1:
+        seasons = max(1, int(round(REAL_SEASONS * scale)))
+        return seasons, REAL_TEAMS_PER_LEAGUE
+    seasons = int(round(REAL_SEASONS * min(scale, 10)))
+    teams = int(round(REAL_TEAMS_PER_LEAGUE * np.sqrt(max(scale / 10, 1))))
+    return seasons, teams
+
+
+def createTables(connection):
+    for table, columns in TABLE_COLUMNS.items():
+        connection.execute("CREATE TABLE {} ({});".format(table, ", ".join(
+            '"{}" {}'.format(column, kind) for column, kind in columns)))
+
+
+def insertRows(connection, table, rows):
+    connection.executemany("INSERT INTO {} VALUES ({});".format(
+        table, ", ".join("?" * len(TABLE_COLUMNS[table]))), rows)
+
+
+def buildEventXml(rng, eventType, homeTeamId, awayTeamId, count):
+    values = []
+    for n in range(count):
+        team = homeTeamId if rng.random() < 0.5 else awayTeamId
+        if eventType == "possession":
+            homePossession = int(rng.integers(30, 71))
+            values.append(
+                "<value><comment>{0}</comment><elapsed>{1}</elapsed>"
+                "<subtype>possession</subtype><awaypos>{2}</awaypos>"
+                "<homepos>{0}</homepos><n>{3}</n><type>special</type>"
+                "</value>".format(homePossession, 45 * (n + 1),
+                                  100 - homePossession, n))
+        elif eventType == "card":
+            values.append(
+                "<value><comment>y</comment><elapsed>{}</elapsed>"
+                "<card_type>y</card_type><team>{}</team><n>{}</n>"
+                "<type>card</type></value>".format(
+                    int(rng.integers(1, 91)), team, n))
+        else:
+            values.append(
+                "<value><elapsed>{}</elapsed><team>{}</team><n>{}</n>"
+                "<type>{}</type></value>".format(
+                    int(rng.integers(1, 91)), team, n, eventType))
+    return "<{0}>{1}</{0}>".format(eventType, "".join(values))
+
+
+def getRoundRobin(rng, teamCount):
+    # Double round robin by the circle method, as (home, away) pairs of
+    # team positions per stage
+    ids = list(rng.permutation(teamCount)) + ([None] if teamCount % 2 else [])
+    half = len(ids) // 2
+    rounds = []
+    for _ in range(len(ids) - 1):
+        rounds.append([(ids[i], ids[-i - 1]) for i in range(half)
+                       if ids[i] is not None and ids[-i - 1] is not None])
+        ids = [ids[0], ids[-1]] + ids[1:-1]
+    return rounds + [[(away, home) for home, away in pairs]
+                     for pairs in rounds]
+
+
+def generateDatabase(path, scale=1.0, seed=0, missingLineupRate=0.05,
+                     withEvents=True):
+    # Writes a database with the tables and columns of the European Soccer
+    # Database read by this project and returns the row count of every
+    # table. Matches and player attributes are generated and inserted one
+    # league season at a time, so memory stays flat at any scale.
+    rng = np.random.default_rng(seed)
+    seasons, teamsPerLeague = getScaledShape(scale)
+    if os.path.exists(path):
+        os.remove(path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode = OFF;")
+    connection.execute("PRAGMA synchronous = OFF;")
+    createTables(connection)
+    counts = dict.fromkeys(TABLE_COLUMNS, 0)
+
+    def insert(table, rows):
+        insertRows(connection, table, rows)
+        counts[table] += len(rows)
+
+    insert("Country", [(leagueId, country) for leagueId, country, _ in LEAGUES])
+    insert("League", [(leagueId, leagueId, name)
+                      for leagueId, _, name in LEAGUES])
+    squads = dict()
+    teamRows = []
+    playerRows = []
+    for l, (leagueId, country, _) in enumerate(LEAGUES):
+        squads[leagueId] = []
+        for t in range(teamsPerLeague):
+            teamApiId = 8000 + l * teamsPerLeague + t
+            teamRows.append((len(teamRows) + 1, teamApiId, teamApiId + 100000,
+                             "{} Club {}".format(country, t + 1),
+                             "{}{}".format(country[:2].upper(), t + 1)))
+            firstPlayer = 30000 + len(playerRows)
+            squad = np.arange(firstPlayer, firstPlayer + SQUAD_SIZE)
+            squads[leagueId].append((teamApiId, squad))
+            playerRows.extend((
+                len(playerRows) + i + 1, int(playerApiId),
+                "Player {}".format(playerApiId), int(playerApiId) + 100000,
+                "1990-01-01 00:00:00", 180.0, 170)
+                for i, playerApiId in enumerate(squad))
+    insert("Team", teamRows)
+    insert("Player", playerRows)
+
+    # Two rating updates a year per player, a random walk starting a year
+    # before the first season
+    playerIds = np.array([row[1] for row in playerRows], dtype=np.int64)
+    ratings = rng.integers(55, 85, len(playerIds))
+    for year in range(FIRST_YEAR - 1, FIRST_YEAR + seasons):
+        for month in (2, 9):
+            ratings = np.clip(ratings + rng.integers(-3, 4, len(ratings)),
+                              40, 95)
+            days = rng.integers(1, 28, len(ratings))
+            insert("Player_Attributes", [
+                (counts["Player_Attributes"] + i + 1, playerId + 100000,
+                 playerId, "{:04d}-{:02d}-{:02d} 00:00:00".format(
+                     year, month, day), rating, min(rating + 5, 99))
+                for i, (playerId, rating, day) in enumerate(zip(
+                    playerIds.tolist(), ratings.tolist(), days.tolist()))])
+
+    matchColumns = getMatchColumns()
+    columnPositions = {column: i for i, column in enumerate(matchColumns)}
+    nextMatchApiId = 400000
+    for s in range(seasons):
+        year = FIRST_YEAR + s
+        season = "{}/{}".format(year, year + 1)
+        seasonStart = pd.Timestamp(year=year, month=8, day=1)
+        for leagueId, _, _ in LEAGUES:
+            squad = squads[leagueId]
+            matchRows = []
+            for stage, pairs in enumerate(
+                    getRoundRobin(rng, len(squad)), start=1):
+                stageDate = seasonStart + pd.Timedelta(days=7 * (stage - 1))
+                for home, away in pairs:
+                    homeTeamId, homeSquad = squad[home]
+                    awayTeamId, awaySquad = squad[away]
+                    date = stageDate + pd.Timedelta(
+                        days=int(rng.integers(0, 3)))
+                    homeGoals = int(rng.poisson(1.5))
+                    awayGoals = int(rng.poisson(1.1))
+                    row = [None] * len(matchColumns)
+                    row[:11] = [
+                        counts["Match"] + len(matchRows) + 1, leagueId,
+                        leagueId, season, stage, date.strftime(DATE_FORMAT),
+                        nextMatchApiId, homeTeamId, awayTeamId, homeGoals,
+                        awayGoals]
+                    nextMatchApiId += 1
+                    for teamType, teamSquad in [("home", homeSquad),
+                                                ("away", awaySquad)]:
+                        lineup = rng.choice(teamSquad, 11, replace=False)
+                        missing = rng.random(11) < missingLineupRate / 11
+                        for i in range(1, 12):
+                            row[columnPositions["{}_player_X{}".format(
+                                teamType, i)]] = i
+                            row[columnPositions["{}_player_Y{}".format(
+                                teamType, i)]] = i
+                            if not missing[i - 1]:
+                                row[columnPositions["{}_player_{}".format(
+                                    teamType, i)]] = int(lineup[i - 1])
+                    if withEvents:
+                        row[columnPositions["goal"]] = buildEventXml(
+                            rng, "goal", homeTeamId, awayTeamId,
+                            homeGoals + awayGoals)
+                        for eventType in EVENT_COLUMNS[1:-1]:
+                            row[columnPositions[eventType]] = buildEventXml(
+                                rng, eventType, homeTeamId, awayTeamId,
+                                int(rng.integers(0, 12)))
+                        row[columnPositions["possession"]] = buildEventXml(
+                            rng, "possession", homeTeamId, awayTeamId, 2)
+                    odds = np.round(rng.uniform(
+                        [1.2, 2.5, 1.2], [5, 4.5, 8],
+                        (len(BOOKMAKERS), 3)), 2)
+                    row[-3 * len(BOOKMAKERS):] = odds.ravel().tolist()
+                    matchRows.append(row)
+            insert("Match", matchRows)
+        connection.commit()
+    connection.commit()
+    connection.close()
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", help="SQLite file to write, replaced if any")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="Size relative to the real database, 0.125 is "
+                             "a single season")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--missing-lineup-rate", type=float, default=0.05)
+    parser.add_argument("--no-events", action="store_true",
+                        help="Leave the XML event columns NULL")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    counts = generateDatabase(args.path, args.scale, args.seed,
+                              args.missing_lineup_rate, not args.no_events)
+    print("Generated {} in {:.1f}s".format(
+        args.path, time.perf_counter() - start))
+    for table, count in counts.items():
+        print("{:>18} {:>10} rows".format(table, count))
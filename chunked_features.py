@@ -0,0 +1,249 @@
+import argparse
+import json
+import os
+import resource
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_aggregator import (LINEUP_COLUMNS, PREDICT_SCHEMA, RATING_COLUMNS,
+                             EuropeanSoccerDatabase,
+                             MatchResultPredictDataAggregator)
+from elo_ratings import ELO_COLUMNS
+from incremental_features import IncrementalFeatureUpdater
+from shared.constants import FEATURE_STORE_PATH
+from training_matrix import (FORM_COLUMNS, TRAINING_COLUMNS, getColumnSlice,
+                             getLabelCodes, writeLeagueColumns)
+from utils.db_helper import SqliteHelper
+from utils.instrumentation import instrumented
+
+CHUNKED_MATRIX_PATH = os.path.join(FEATURE_STORE_PATH, "chunked_matrix")
+# Rough peak bytes per match of a chunk being folded: the compacted frame,
+# its records and the Python feature rows of the incremental updater
+CHUNK_ROW_BYTES = 8 * 2 ** 10
+FETCH_ROWS = 10000
+MATRIX_FILES = {
+    "features": ("features.f32", np.float32),
+    "labels": ("labels.i8", np.int8),
+    "match_ids": ("match_ids.i64", np.int64),
+}
+
+
+def getChunkRows(memoryBudget):
+    return max(1, int(memoryBudget // CHUNK_ROW_BYTES))
+
+
+def compactFrame(data, table):
+    for column, kind in PREDICT_SCHEMA[table].items():
+        data[column] = MatchResultPredictDataAggregator.compactColumn(
+            data[column], kind)
+    return data
+
+
+def iterTable(database, table, fetchRows=FETCH_ROWS):
+    # The table's PREDICT_SCHEMA columns in date order, fetchRows at a time.
+    # SQLite sorts through its temporary files, not in memory.
+    columns = ", ".join('"{}"'.format(column)
+                        for column in PREDICT_SCHEMA[table])
+    return database.iterQuery(
+        "SELECT {} FROM {} ORDER BY date, rowid;".format(columns, table),
+        chunkSize=fetchRows)
+
+
+def iterMatchChunks(database, maxRows, fetchRows=FETCH_ROWS):
+    # Matches in date order, cut at the first match of every season and
+    # whenever a chunk reaches maxRows. Cuts only fall between two dates, so
+    # matches of the same day always share a chunk.
+    pending = []
+    pendingRows = 0
+    seasons = set()
+    lastDate = None
+    for rows in iterTable(database, "Match", fetchRows):
+        dates = rows.date.to_numpy()
+        newDates = np.append(lastDate is None or dates[0] != lastDate,
+                             dates[1:] != dates[:-1])
+        lastDate = dates[-1]
+        newSeasons = ~rows.season.duplicated().to_numpy() & \
+            ~rows.season.isin(seasons).to_numpy()
+        seasons.update(rows.season[newSeasons])
+        start = 0
+        for cut in np.flatnonzero(newDates):
+            full = pendingRows + cut - start >= maxRows
+            if (full or newSeasons[cut]) and pendingRows + cut - start:
+                pending.append(rows.iloc[start:cut])
+                yield compactFrame(pd.concat(pending), "Match")
+                pending = []
+                pendingRows = 0
+                start = cut
+        pending.append(rows.iloc[start:])
+        pendingRows += len(rows) - start
+    if pendingRows:
+        yield compactFrame(pd.concat(pending), "Match")
+
+
+class AttributeStream(object):
+    # Player_Attributes in date order, handed out up to a date
+
+    def __init__(self, database, fetchRows=FETCH_ROWS):
+        self.rows = iterTable(database, "Player_Attributes", fetchRows)
+        self.pending = None
+
+    def readUntil(self, date):
+        # Every row not handed out yet dated up to date
+        parts = []
+        while True:
+            if self.pending is None:
+                self.pending = next(self.rows, None)
+                if self.pending is None:
+                    break
+                self.pending = compactFrame(self.pending, "Player_Attributes")
+            count = int(np.searchsorted(
+                self.pending.date.to_numpy(), np.datetime64(date), "right"))
+            parts.append(self.pending.iloc[:count])
+            if count < len(self.pending):
+                self.pending = self.pending.iloc[count:]
+                break
+            self.pending = None
+        if not parts:
+            return compactFrame(pd.DataFrame(
+                columns=list(PREDICT_SCHEMA["Player_Attributes"])),
+                "Player_Attributes")
+        return pd.concat(parts)
+
+
+class ChunkedMatrixWriter(object):
+    # Appends feature rows, label codes and match ids to raw files under
+    # path. metadata.json, only written by commit once every chunk is in,
+    # records the row count and columns; readers only trust rows it covers.
+
+    def __init__(self, path=CHUNKED_MATRIX_PATH, columns=TRAINING_COLUMNS):
+        self.path = path
+        self.columns = list(columns)
+        self.rows = 0
+        os.makedirs(path, exist_ok=True)
+        metadataPath = os.path.join(path, "metadata.json")
+        if os.path.exists(metadataPath):
+            os.remove(metadataPath)
+        self.files = {name: open(os.path.join(path, fileName), "wb")
+                      for name, (fileName, _) in MATRIX_FILES.items()}
+
+    def append(self, features, labels, matchIds):
+        for name, values in [("features", features), ("labels", labels),
+                             ("match_ids", matchIds)]:
+            self.files[name].write(np.ascontiguousarray(
+                values, dtype=MATRIX_FILES[name][1]).tobytes())
+        self.rows += len(matchIds)
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+    def abort(self):
+        # A failed build leaves neither metadata nor partial files behind
+        self.close()
+        for fileName, _ in MATRIX_FILES.values():
+            path = os.path.join(self.path, fileName)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def commit(self):
+        self.close()
+        temporaryPath = os.path.join(self.path, "metadata.json.tmp")
+        with open(temporaryPath, "w") as f:
+            json.dump({"rows": self.rows, "columns": self.columns}, f)
+        os.replace(temporaryPath, os.path.join(self.path, "metadata.json"))
+
+
+def loadChunkedMatrix(path=CHUNKED_MATRIX_PATH, mmapMode="r"):
+    # Memory maps of the features, labels and match ids written by
+    # ChunkedMatrixWriter
+    with open(os.path.join(path, "metadata.json")) as f:
+        metadata = json.load(f)
+    rows = metadata["rows"]
+    arrays = []
+    for name, (fileName, dtype) in MATRIX_FILES.items():
+        shape = (rows, len(metadata["columns"])) if name == "features" \
+            else (rows,)
+        if rows == 0:
+            arrays.append(np.empty(shape, dtype=dtype))
+            continue
+        arrays.append(np.memmap(os.path.join(path, fileName), dtype=dtype,
+                                mode=mmapMode, shape=shape))
+    return tuple(arrays)
+
+
+def getChunkMatrix(matches, features):
+    # The updater's features of a chunk in the TRAINING_COLUMNS layout,
+    # rows with a missing value dropped like in buildTrainingMatrix
+    out = np.empty((len(matches), len(TRAINING_COLUMNS)), dtype=np.float32)
+    out[:, getColumnSlice(FORM_COLUMNS)] = features[FORM_COLUMNS].to_numpy()
+    out[:, getColumnSlice(ELO_COLUMNS)] = features[ELO_COLUMNS].to_numpy()
+    writeLeagueColumns(out, matches.league_id)
+    out[:, getColumnSlice(RATING_COLUMNS)] = \
+        features[RATING_COLUMNS].to_numpy()
+    labels = getLabelCodes(matches)
+    matchIds = matches.match_api_id.to_numpy(dtype=np.int64)
+    complete = ~np.isnan(out).any(axis=1)
+    return out[complete], labels[complete], matchIds[complete]
+
+
+def iterChunkFeatures(database, memoryBudget):
+    # Every complete match of the database with its features, in the date
+    # ordered chunks of iterMatchChunks sized by memoryBudget. Yields the
+    # (matches, features) of every chunk; the state carried across chunks
+    # stays bounded.
+    updater = IncrementalFeatureUpdater()
+    attributes = AttributeStream(database)
+    for matches in iterMatchChunks(database, getChunkRows(memoryBudget)):
+        playerAttributes = attributes.readUntil(matches.date.max())
+        matches = matches.dropna(subset=LINEUP_COLUMNS)
+        yield matches, updater.update(matches, playerAttributes)
+        updater.compact()
+
+
+@instrumented()
+def buildChunkedTrainingMatrix(databaseName, path=CHUNKED_MATRIX_PATH,
+                               memoryBudget=256 * 2 ** 20, progress=None):
+    # buildTrainingMatrix over every complete match of the database without
+    # ever loading a whole table. Matches are streamed from SQLite in date
+    # ordered, season aligned chunks sized by memoryBudget and folded into
+    # an IncrementalFeatureUpdater, which carries the per-team, per-pair,
+    # Elo and player rating state across chunks. Each chunk's rows are
+    # appended to the on-disk matrix at path, in date order. Returns the
+    # number of rows written.
+    database = SqliteHelper()
+    database.connect(databaseName, readOnly=True)
+    writer = ChunkedMatrixWriter(path)
+    try:
+        for matches, features in iterChunkFeatures(database, memoryBudget):
+            writer.append(*getChunkMatrix(matches, features))
+            if progress is not None:
+                progress(matches, writer.rows)
+        writer.commit()
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        database.close()
+    return writer.rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--memory-budget-mb", type=int, default=256)
+    parser.add_argument("--output", default=CHUNKED_MATRIX_PATH)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+
+    def progress(matches, rows):
+        print("{} to {}: {} rows in {:.1f}s, peak RSS {:.0f} MB".format(
+            matches.date.min().date(), matches.date.max().date(), rows,
+            time.perf_counter() - start,
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+    rows = buildChunkedTrainingMatrix(
+        EuropeanSoccerDatabase().databaseName, args.output,
+        args.memory_budget_mb * 2 ** 20, progress)
+    print("Wrote {} rows to {}".format(rows, args.output))
@@ -1,19 +1,75 @@
-import copy
 import os
-import sqlite3
+import threading
 import numpy as np
 import pandas as pd
 
-from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from shared.constants import DATASET_PATH, EUROPEAN_SOCCER_DATABASE
-from utils.db_helper import SqliteHelper
+from utils.db_helper import PooledSqliteHelper
+from utils.instrumentation import instrumented
+
+# Columns each consumer reads from every table and how they are stored once
+# loaded: "int" downcast integers (float32 when the column has nulls),
+# "float" float32, "category", "datetime" and "str" as loaded. A table mapped
+# to None is loaded with all of its columns untouched.
+LINEUP_COLUMNS = ["{}_player_{}".format(teamType, i)
+                  for i in range(1, 12) for teamType in ["home", "away"]]
+RATING_COLUMNS = ["{}_overall_rating".format(player)
+                  for player in LINEUP_COLUMNS]
+
+AGGREGATE_SCHEMA = {
+    "Match": dict({
+        "country_id": "int",
+        "league_id": "int",
+        "home_team_api_id": "int",
+        "away_team_api_id": "int",
+    }, **{column: "float" for column in LINEUP_COLUMNS}),
+    "Country": {"id": "int", "name": "category"},
+    "League": {"id": "int", "country_id": "int", "name": "category"},
+    "Team": {"team_api_id": "int", "team_long_name": "str"},
+    "Player": {"player_api_id": "int", "player_name": "str"},
+}
+
+PREDICT_SCHEMA = {
+    "Match": dict({
+        "country_id": "int",
+        "league_id": "int",
+        "season": "category",
+        "stage": "int",
+        "date": "datetime",
+        "match_api_id": "int",
+        "home_team_api_id": "int",
+        "away_team_api_id": "int",
+        "home_team_goal": "int",
+        "away_team_goal": "int",
+    }, **{column: "float" for column in LINEUP_COLUMNS}),
+    "Player_Attributes": {
+        "player_api_id": "int",
+        "date": "datetime",
+        "overall_rating": "float",
+    },
+}
+
+
+def mergeSchemas(*schemas):
+    merged = dict()
+    for schema in schemas:
+        for table, columns in schema.items():
+            if columns is None or merged.get(table, {}) is None:
+                merged[table] = None
+            else:
+                merged[table] = dict(merged.get(table, {}), **columns)
+    return merged
+
+
+DEFAULT_SCHEMA = mergeSchemas(AGGREGATE_SCHEMA, PREDICT_SCHEMA)
 
 
 class EuropeanSoccerDatabase(object):
 
     def __new__(cls):
         if not hasattr(cls, 'dbHelper'):
-            cls.dbHelper = SqliteHelper()
+            cls.dbHelper = PooledSqliteHelper()
             cls.dbHelper.connect(os.path.join(
                 DATASET_PATH, EUROPEAN_SOCCER_DATABASE))
         return cls.dbHelper
@@ -22,10 +78,22 @@ class EuropeanSoccerDatabase(object):
 class DataHelper(object):
     def __init__(self, data):
         self.data = data
+        self.lookups = dict()
+
+    def getLookup(self, keyColumn, valueColumn):
+        # Hash index from keyColumn to valueColumn, the first row wins like
+        # in the scalar getters below
+        if (keyColumn, valueColumn) not in self.lookups:
+            self.lookups[(keyColumn, valueColumn)] = self.data.drop_duplicates(
+                keyColumn).set_index(keyColumn)[valueColumn]
+        return self.lookups[(keyColumn, valueColumn)]
 
     def getNameById(self, id):
         return self.data.loc[self.data.id == int(id)].name.values[0]
 
+    def getNamesByIds(self, ids):
+        return ids.map(self.getLookup("id", "name"))
+
 
 class CountryDataHelper(DataHelper):
     pass
@@ -37,6 +105,7 @@ class LeagueDataHelper(DataHelper):
 
 class MatchDataHelper(DataHelper):
     @staticmethod
+    @instrumented()
     def filterMatchesBefore(matches, date, limit):
         if (matches.shape[0] < limit):
             limit = matches.shape[0]
@@ -44,35 +113,40 @@ class MatchDataHelper(DataHelper):
             by="date", ascending=False).iloc[:limit, :]
 
     @staticmethod
+    @instrumented()
     def filterMatchesByTeamApiId(matches, teamId):
         return matches[(matches.home_team_api_id == teamId) |
                        (matches.away_team_api_id == teamId)]
 
     @staticmethod
+    @instrumented()
     def filterMatchesByOpponentsTeamIds(matches, team1Id, team2Id):
         team1Matches = matches[
             (matches.home_team_api_id == team1Id) &
-            (matches.away_team_api_id == team1Id)
+            (matches.away_team_api_id == team2Id)
         ]
         team2Matches = matches[
             (matches.home_team_api_id == team2Id) &
-            (matches.away_team_api_id == team2Id)
+            (matches.away_team_api_id == team1Id)
         ]
         return pd.concat([team1Matches, team2Matches])
 
     @staticmethod
+    @instrumented()
     def getGoalsByTeamId(matches, teamId):
         return \
         int(matches.home_team_goal[matches.home_team_api_id == teamId].sum()) + \
         int(matches.away_team_goal[matches.away_team_api_id == teamId].sum())
 
     @staticmethod
+    @instrumented()
     def getGoalsConceidedByTeamId(matches, teamId):
         return \
         int(matches.home_team_goal[matches.away_team_api_id == teamId].sum()) + \
         int(matches.away_team_goal[matches.home_team_api_id == teamId].sum())
 
     @staticmethod
+    @instrumented()
     def getWinsByTeamId(matches, teamId):
         return \
         int(
@@ -89,6 +163,7 @@ class MatchDataHelper(DataHelper):
         )
 
     @staticmethod
+    @instrumented()
     def getMatchResult(match):
         matchResult = pd.DataFrame()
         matchResult.loc[0, "match_api_id"] = match.match_api_id
@@ -100,106 +175,385 @@ class MatchDataHelper(DataHelper):
             matchResult.loc[0, "label"] = "Draw"
         return matchResult.loc[0]
 
+    @staticmethod
+    @instrumented()
+    def getMatchResults(matches):
+        # Column-wise getMatchResult for a whole match frame
+        homeGoals = matches.home_team_goal.to_numpy()
+        awayGoals = matches.away_team_goal.to_numpy()
+        return pd.DataFrame({
+            "match_api_id": matches.match_api_id.to_numpy(dtype=np.float64),
+            "label": np.select(
+                [homeGoals > awayGoals, homeGoals < awayGoals],
+                ["Win", "Defeat"], "Draw"),
+        }, index=matches.index)
+
+
+class HeadToHeadIndex(object):
+    # Matches grouped by unordered team pair and sorted by date inside each
+    # pair, so the last meetings before a date are a binary search away
+    def __init__(self, matches):
+        self.matches = matches
+        homeTeamIds = matches.home_team_api_id.to_numpy(dtype=np.int64)
+        awayTeamIds = matches.away_team_api_id.to_numpy(dtype=np.int64)
+        homeGoals = matches.home_team_goal.to_numpy(dtype=np.int64)
+        awayGoals = matches.away_team_goal.to_numpy(dtype=np.int64)
+        dates = pd.to_datetime(matches.date).to_numpy().astype(np.int64)
+
+        self.pairs, pairCodes = np.unique(
+            self.getPairKeys(homeTeamIds, awayTeamIds), return_inverse=True)
+        self.dates, dateCodes = np.unique(dates, return_inverse=True)
+        # One sorted int64 key per match: pair code, then date rank
+        keys = pairCodes.reshape(-1) * (len(self.dates) + 1) + \
+            dateCodes.reshape(-1)
+        self.order = np.argsort(keys, kind="mergesort")
+        self.keys = keys[self.order]
+        # Running wins of the lower and of the higher team id of each pair
+        lowerIsHome = (homeTeamIds < awayTeamIds)[self.order]
+        homeWins = (homeGoals > awayGoals)[self.order]
+        awayWins = (homeGoals < awayGoals)[self.order]
+        self.lowerWins = np.concatenate([[0], np.cumsum(
+            np.where(lowerIsHome, homeWins, awayWins))])
+        self.higherWins = np.concatenate([[0], np.cumsum(
+            np.where(lowerIsHome, awayWins, homeWins))])
+
+    @staticmethod
+    def getPairKeys(team1Ids, team2Ids):
+        return (np.minimum(team1Ids, team2Ids) << 32) + \
+            np.maximum(team1Ids, team2Ids)
+
+    def getMeetingBounds(self, team1Ids, team2Ids, dates, limit):
+        # [lower, upper) positions of the last limit meetings strictly
+        # before each date, empty for pairs that never met
+        pairKeys = self.getPairKeys(np.asarray(team1Ids, dtype=np.int64),
+                                    np.asarray(team2Ids, dtype=np.int64))
+        codes = np.searchsorted(self.pairs, pairKeys)
+        known = codes < len(self.pairs)
+        known[known] = self.pairs[codes[known]] == pairKeys[known]
+        span = len(self.dates) + 1
+        pairStart = np.searchsorted(self.keys, codes * span)
+        upper = np.searchsorted(
+            self.keys, codes * span + np.searchsorted(self.dates, dates))
+        upper = np.where(known, upper, pairStart)
+        lower = np.maximum(upper - limit, pairStart)
+        return lower, upper
+
+    def getLastMeetings(self, team1Id, team2Id, date, limit):
+        lower, upper = self.getMeetingBounds(
+            [team1Id], [team2Id],
+            pd.to_datetime([date]).to_numpy().astype(np.int64), limit)
+        return self.matches.iloc[self.order[lower[0]:upper[0]][::-1]]
+
+    def getHeadToHeadFeatures(self, matches, limit):
+        # Wins of the home and of the away team over their last limit
+        # meetings before each match
+        homeTeamIds = matches.home_team_api_id.to_numpy(dtype=np.int64)
+        awayTeamIds = matches.away_team_api_id.to_numpy(dtype=np.int64)
+        lower, upper = self.getMeetingBounds(
+            homeTeamIds, awayTeamIds,
+            pd.to_datetime(matches.date).to_numpy().astype(np.int64), limit)
+        lowerWins = self.lowerWins[upper] - self.lowerWins[lower]
+        higherWins = self.higherWins[upper] - self.higherWins[lower]
+        homeIsLower = homeTeamIds < awayTeamIds
+        return (np.where(homeIsLower, lowerWins, higherWins).astype(np.float64),
+                np.where(homeIsLower, higherWins, lowerWins).astype(np.float64))
+
 
 class TeamDataHelper(DataHelper):
     def getLongTeamNameByApiId(self, id):
         return self.data.loc[self.data.team_api_id == id].team_long_name.values[0]
 
+    def getLongTeamNamesByApiIds(self, ids):
+        return ids.map(self.getLookup("team_api_id", "team_long_name"))
+
 
 class PlayerDataHelper(DataHelper):
     def getPlayerNameByApiId(self, id):
         return self.data.loc[self.data.player_api_id == id].player_name.values[0]
 
+    def getPlayerNamesByApiIds(self, ids):
+        return ids.map(self.getLookup("player_api_id", "player_name"))
+
 
 class PlayerAttributeDataHelper(DataHelper):
-    def getPlayerRatings(self, match):
+    def __init__(self, data):
+        super().__init__(data)
+        self.ratingIndex = None
+
+    @staticmethod
+    def getPlayerColumns():
         players = list()
         for i in range(1, 12):
             players.append("home_player_{}".format(i))
             players.append("away_player_{}".format(i))
+        return players
+
+    @staticmethod
+    def toSeconds(dates):
+        return pd.to_datetime(dates).to_numpy().astype(
+            "datetime64[s]").astype(np.int64)
+
+    @instrumented()
+    def buildRatingIndex(self):
+        # Ratings sorted by (player, date) and packed into one int64 key per
+        # row: the dense player code in the high bits and the seconds since
+        # the first rating date in the low 32 bits.
+        playerIds = self.data.player_api_id.to_numpy(dtype=np.int64)
+        seconds = self.toSeconds(self.data.date)
+        players = np.unique(playerIds)
+        epoch = int(seconds.min()) - 1 if len(seconds) else 0
+        keys = (np.searchsorted(players, playerIds).astype(np.int64) << 32) + \
+            (seconds - epoch)
+        order = np.argsort(keys, kind="mergesort")
+        self.ratingIndex = {
+            "players": players,
+            "epoch": epoch,
+            "keys": keys[order],
+            "ratings": self.data.overall_rating.to_numpy(
+                dtype=np.float64)[order],
+        }
+        return self.ratingIndex
+
+    @instrumented()
+    def getLatestRatings(self, playerIds, dates):
+        # Overall rating of each player from the latest attribute row dated
+        # strictly before the given date, NaN when there is none.
+        index = self.ratingIndex or self.buildRatingIndex()
+        players = index["players"]
+        playerIds = np.asarray(playerIds, dtype=np.int64)
+        codes = np.searchsorted(players, playerIds)
+        known = codes < len(players)
+        known[known] = players[codes[known]] == playerIds[known]
+        offsets = np.clip(self.toSeconds(dates) - index["epoch"], 0,
+                          (1 << 32) - 1)
+        positions = np.searchsorted(
+            index["keys"], (codes.astype(np.int64) << 32) + offsets,
+            side="left") - 1
+        known &= positions >= 0
+        known[known] = (index["keys"][positions[known]] >> 32) == \
+            codes[known]
+        ratings = np.full(len(playerIds), np.nan)
+        ratings[known] = index["ratings"][positions[known]]
+        return ratings
+
+    @instrumented()
+    def getPlayerRatingMatrix(self, matches):
+        # Latest rating of every lineup slot, in RATING_COLUMNS order, as a
+        # (matches, 22) array: 0 for an empty slot, NaN when the player has
+        # no rating before the match
+        players = self.getPlayerColumns()
+        playerIds = matches[players].to_numpy(dtype=np.float64)
+        dates = np.repeat(pd.to_datetime(matches.date).to_numpy(),
+                          len(players))
+        missing = np.isnan(playerIds).reshape(-1)
+        ratings = np.zeros(playerIds.size)
+        ratings[~missing] = self.getLatestRatings(
+            playerIds.reshape(-1)[~missing], dates[~missing])
+        return ratings.reshape(playerIds.shape)
+
+    @instrumented()
+    def getPlayerRatingsForMatches(self, matches):
+        playerRatings = pd.DataFrame(
+            self.getPlayerRatingMatrix(matches), index=matches.index,
+            columns=RATING_COLUMNS)
+        playerRatings["match_api_id"] = matches.match_api_id.to_numpy(
+            dtype=np.float64)
+        return playerRatings
+
+    @instrumented()
+    def getPlayerRatings(self, match):
+        return self.getPlayerRatingsForMatches(match.to_frame().T).iloc[0]
 
-        playerRatings = pd.DataFrame()
-        for player in players:
-            playerStats = self.data[self.data.player_api_id == match[player]]
-            playerStats = playerStats[
-                playerStats.date < match["date"]].sort_values(
-                    by="date", ascending=False)[:1]
 
-            if np.isnan(match[player]):
-                overallPlayerRating = pd.Series(0)
-            else:
-                playerStats.reset_index(inplace=True, drop=True)
-                overallPlayerRating = pd.Series(
-                    playerStats.loc[0, "overall_rating"])
+class LazyTable(object):
+    # Loads the table through the aggregator on first access and caches the
+    # frame on the instance, so later reads never go through the descriptor
+    def __init__(self, table):
+        self.table = table
 
-            playerRatings = pd.concat(
-                [playerRatings, overallPlayerRating], axis=1)
+    def __set_name__(self, owner, name):
+        self.name = name
 
-        columnNames = []
-        for i in range(1, 12):
-            columnNames.append("home_player_{}_overall_rating".format(i))
-            columnNames.append("away_player_{}_overall_rating".format(i))
-        playerRatings.columns = columnNames
-        playerRatings["match_api_id"] = match.match_api_id
-        return playerRatings.iloc[0]
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        instance.loadTables([self.table])
+        return instance.__dict__[self.name]
+
+
+class LazyDataHelper(object):
+    def __init__(self, helperClass, dataAttribute):
+        self.helperClass = helperClass
+        self.dataAttribute = dataAttribute
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        helper = self.helperClass(getattr(instance, self.dataAttribute))
+        instance.__dict__[self.name] = helper
+        return helper
 
 
 class MatchResultPredictDataAggregator(object):
-    def __init__(self, database):
+    tableAttributes = {
+        "Match": "matchData",
+        "Country": "countryData",
+        "League": "leagueData",
+        "Team": "teamData",
+        "Player": "playerData",
+        "Player_Attributes": "playerAttributeData",
+    }
+
+    matchData = LazyTable("Match")
+    countryData = LazyTable("Country")
+    leagueData = LazyTable("League")
+    teamData = LazyTable("Team")
+    playerData = LazyTable("Player")
+    playerAttributeData = LazyTable("Player_Attributes")
+
+    countryDataHelper = LazyDataHelper(CountryDataHelper, "countryData")
+    leagueDataHelper = LazyDataHelper(LeagueDataHelper, "leagueData")
+    teamDataHelper = LazyDataHelper(TeamDataHelper, "teamData")
+    playerDataHelper = LazyDataHelper(PlayerDataHelper, "playerData")
+    matchDataHelper = LazyDataHelper(MatchDataHelper, "matchData")
+    playerAttributeDataHelper = LazyDataHelper(
+        PlayerAttributeDataHelper, "playerAttributeData")
+
+    def __init__(self, database, schema=DEFAULT_SCHEMA, maxWorkers=None):
         self.database = database
-        self.matchData = self.database.runQuery("SELECT * FROM Match;")
-        self.countryData = self.database.runQuery("SELECT * FROM Country;")
-        self.leagueData = self.database.runQuery("SELECT * FROM League;")
-        self.teamData = self.database.runQuery("SELECT * FROM Team;")
-        self.playerData = self.database.runQuery("SELECT * FROM Player;")
-        self.playerAttributeData = self.database.runQuery(
-            "SELECT * FROM Player_Attributes")
-        self.countryDataHelper = CountryDataHelper(self.countryData)
-        self.leagueDataHelper = LeagueDataHelper(self.leagueData)
-        self.teamDataHelper = TeamDataHelper(self.teamData)
-        self.playerDataHelper = PlayerDataHelper(self.playerData)
-        self.matchDataHelper = MatchDataHelper(self.matchData)
-        self.playerAttributeDataHelper = PlayerAttributeDataHelper(
-            self.playerAttributeData)
-        self.aggregatedData = copy.deepcopy(self.matchData)
+        self.schema = schema
+        self.maxWorkers = maxWorkers
+        self.loadLock = threading.Lock()
+
+    @property
+    def aggregatedData(self):
+        # Shallow copy instead of a deep copy: the add*ToMatches methods only
+        # ever assign whole columns, which replaces them in the copy and
+        # leaves the arrays shared with matchData untouched
+        if "aggregatedData" not in self.__dict__:
+            self.__dict__["aggregatedData"] = self.matchData.copy(deep=False)
+        return self.__dict__["aggregatedData"]
+
+    @aggregatedData.setter
+    def aggregatedData(self, data):
+        self.__dict__["aggregatedData"] = data
+
+    def isLoaded(self, table):
+        return self.tableAttributes[table] in self.__dict__
+
+    def loadTables(self, tables):
+        # Loads the missing tables, in parallel on a thread pool with one read
+        # only connection per thread when more than one is needed. Pooled
+        # databases hand out per thread connections themselves.
+        with self.loadLock:
+            tables = [table for table in dict.fromkeys(tables)
+                      if not self.isLoaded(table)]
+            if len(tables) <= 1 or not hasattr(self.database, "openReader"):
+                for table in tables:
+                    self.__dict__[self.tableAttributes[table]] = \
+                        self.loadTable(table)
+                return
+            readers = []
+            local = threading.local()
+
+            def loadWithReader(table):
+                if getattr(self.database, "threadSafe", False):
+                    return self.loadTable(table)
+                if not hasattr(local, "reader"):
+                    local.reader = self.database.openReader()
+                    readers.append(local.reader)
+                return self.loadTable(table, local.reader)
+
+            try:
+                with ThreadPoolExecutor(
+                        max_workers=self.maxWorkers or len(tables)) as pool:
+                    loaded = pool.map(loadWithReader, tables)
+                    for table, data in zip(tables, loaded):
+                        self.__dict__[self.tableAttributes[table]] = data
+            finally:
+                for reader in readers:
+                    reader.close()
+
+    @staticmethod
+    def compactColumn(column, kind):
+        if kind == "int":
+            if column.isnull().any():
+                return column.astype(np.float32)
+            return pd.to_numeric(column, downcast="integer")
+        if kind == "float":
+            return column.astype(np.float32)
+        if kind == "category":
+            return column.astype("category")
+        if kind == "datetime":
+            return pd.to_datetime(column)
+        return column
+
+    @instrumented()
+    def loadTable(self, table, database=None, condition=None, params=None):
+        # condition, an SQL expression with ? placeholders for params,
+        # restricts the loaded rows
+        database = database or self.database
+        columns = self.schema.get(table)
+        where = "" if condition is None else " WHERE {}".format(condition)
+        if columns is None:
+            return database.runQuery("SELECT * FROM {}{};".format(
+                table, where), params)
+        data = database.runQuery("SELECT {} FROM {}{};".format(
+            ", ".join('"{}"'.format(column) for column in columns), table,
+            where), params)
+        for column, kind in columns.items():
+            data[column] = self.compactColumn(data[column], kind)
+        return data
+
+    def getMemoryReport(self):
+        # Only covers what has been loaded so far
+        tables = {table: self.__dict__[attribute]
+                  for table, attribute in self.tableAttributes.items()
+                  if attribute in self.__dict__}
+        if "aggregatedData" in self.__dict__:
+            tables["aggregated"] = self.__dict__["aggregatedData"]
+        report = pd.DataFrame([{
+            "table": table,
+            "rows": data.shape[0],
+            "columns": data.shape[1],
+            "bytes": int(data.memory_usage(index=True, deep=True).sum()),
+        } for table, data in tables.items()]).set_index("table")
+        report["megabytes"] = (report.bytes / 2 ** 20).round(2)
+        return report
 
     def addCountryNameToMatches(self):
-        for match in range(len(self.aggregatedData)):
-            self.aggregatedData.loc[match, "country_name"] = self.countryDataHelper.getNameById(
-                self.aggregatedData.country_id.iloc[match]
-            )
+        self.aggregatedData["country_name"] = \
+            self.countryDataHelper.getNamesByIds(
+                self.aggregatedData.country_id)
 
     def addLeagueNameToMatches(self):
-        for match in range(len(self.aggregatedData)):
-            self.aggregatedData.loc[match, "league_name"] = self.leagueDataHelper.getNameById(
-                self.aggregatedData.league_id.iloc[match]
-            )
+        self.aggregatedData["league_name"] = \
+            self.leagueDataHelper.getNamesByIds(self.aggregatedData.league_id)
 
     def addTeamNameToMatches(self, teamType):
-        for match in range(len(self.aggregatedData)):
-            self.aggregatedData.loc[match, "{}_team_name".format(teamType)] = self.teamDataHelper.getLongTeamNameByApiId(
-                self.aggregatedData["{}_team_api_id".format(
-                    teamType)].iloc[match]
-            )
+        self.aggregatedData["{}_team_name".format(teamType)] = \
+            self.teamDataHelper.getLongTeamNamesByApiIds(
+                self.aggregatedData["{}_team_api_id".format(teamType)])
 
     def addPlayerNameToMatches(self, teamType, playerId):
-        for match in range(len(self.aggregatedData)):
-            self.aggregatedData.loc[match, "{}_player_{}".format(teamType, playerId)] = self.playerDataHelper.getPlayerNameByApiId(
-                self.aggregatedData["{}_player_{}".format(
-                    teamType, playerId)].iloc[match]
-            )
+        column = "{}_player_{}".format(teamType, playerId)
+        self.aggregatedData[column] = \
+            self.playerDataHelper.getPlayerNamesByApiIds(
+                self.aggregatedData[column])
 
+    @instrumented()
     def aggregate(self):
-        # import pdb
-        # pdb.set_trace()
-
+        self.loadTables(["Match", "Country", "League", "Team", "Player"])
         self.addCountryNameToMatches()
         self.addLeagueNameToMatches()
         self.addTeamNameToMatches("home")
         self.addTeamNameToMatches("away")
-        # for i in range(1, 12):
-        #     self.addPlayerNameToMatches("home", i)
-        #     self.addPlayerNameToMatches("away", i)
+        for i in range(1, 12):
+            self.addPlayerNameToMatches("home", i)
+            self.addPlayerNameToMatches("away", i)
 
         # rows = ["country_id", "league_id", "season", "stage", "date", "match_api_id", "home_team_api_id",
         #         "away_team_api_id", "home_team_goal", "away_team_goal", "home_player_1", "home_player_2",
@@ -222,3 +576,4 @@ if __name__ == "__main__":
     print("Starting...")
     dataAggregator = MatchResultPredictDataAggregator(EuropeanSoccerDatabase())
     dataAggregator.aggregate()
+    print(dataAggregator.getMemoryReport())
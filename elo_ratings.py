@@ -0,0 +1,192 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_aggregator import (LINEUP_COLUMNS, EuropeanSoccerDatabase,
+                             MatchResultPredictDataAggregator)
+from shared.constants import FEATURE_STORE_PATH
+from utils.instrumentation import instrumented
+
+ELO_INITIAL_RATING = 1500.0
+ELO_K_FACTOR = 20.0
+ELO_HOME_ADVANTAGE = 60.0
+ELO_COLUMNS = ["home_team_elo", "away_team_elo"]
+ELO_AFTER_COLUMNS = ["home_team_elo_after", "away_team_elo_after"]
+ELO_SNAPSHOT_FILE = os.path.join(FEATURE_STORE_PATH, "elo_snapshot.npz")
+
+
+def getGoalDifferenceMultiplier(goalDifference):
+    # World Football Elo weighting of the margin of victory
+    if goalDifference <= 1:
+        return 1.0
+    if goalDifference == 2:
+        return 1.5
+    return (11.0 + goalDifference) / 8.0
+
+
+class EloRatingEngine(object):
+    # Walks matches once in date order keeping one rating per team in a
+    # sorted team id array and a float64 rating array. Every match gets the
+    # pre-match ratings of both teams: the ratings after all matches of
+    # earlier dates, so that same-day matches never see each other like the
+    # other features. New matchdays are folded on top of the current state,
+    # which can be snapshotted to disk and restored.
+
+    def __init__(self, kFactor=ELO_K_FACTOR, homeAdvantage=ELO_HOME_ADVANTAGE,
+                 goalDifferenceWeighting=False,
+                 initialRating=ELO_INITIAL_RATING):
+        self.kFactor = kFactor
+        self.homeAdvantage = homeAdvantage
+        self.goalDifferenceWeighting = goalDifferenceWeighting
+        self.initialRating = initialRating
+        self.teams = np.empty(0, dtype=np.int64)
+        self.ratings = np.empty(0, dtype=np.float64)
+        self.seenMatchIds = np.empty(0, dtype=np.int64)
+        self.lastDate = None
+
+    def getTeamCodes(self, teamIds):
+        # Positions of the teams in the state arrays, unseen teams are added
+        # with the initial rating
+        teamIds = np.asarray(teamIds, dtype=np.int64)
+        newTeams = np.setdiff1d(teamIds, self.teams)
+        if len(newTeams):
+            teams = np.union1d(self.teams, newTeams)
+            ratings = np.full(len(teams), self.initialRating)
+            ratings[np.searchsorted(teams, self.teams)] = self.ratings
+            self.teams, self.ratings = teams, ratings
+        return np.searchsorted(self.teams, teamIds)
+
+    def getRatings(self, teamIds):
+        # Current ratings, the initial rating for teams never seen
+        teamIds = np.asarray(teamIds, dtype=np.int64)
+        codes = np.searchsorted(self.teams, teamIds)
+        known = codes < len(self.teams)
+        known[known] = self.teams[codes[known]] == teamIds[known]
+        ratings = np.full(len(teamIds), self.initialRating)
+        ratings[known] = self.ratings[codes[known]]
+        return ratings
+
+    def getRatingChange(self, homeRating, awayRating, homeGoals, awayGoals):
+        expected = 1.0 / (1.0 + 10.0 ** (
+            (awayRating - homeRating - self.homeAdvantage) / 400.0))
+        score = 1.0 if homeGoals > awayGoals else \
+            0.0 if homeGoals < awayGoals else 0.5
+        change = self.kFactor * (score - expected)
+        if self.goalDifferenceWeighting:
+            change *= getGoalDifferenceMultiplier(abs(homeGoals - awayGoals))
+        return change
+
+    @instrumented()
+    def update(self, matches):
+        # Folds the matches not seen yet and returns their pre-match
+        # (ELO_COLUMNS) and post-match (ELO_AFTER_COLUMNS) ratings, indexed
+        # like the input frame
+        matches = matches[~matches.match_api_id.isin(self.seenMatchIds)]
+        dates = pd.to_datetime(matches.date).to_numpy().astype(np.int64)
+        if len(matches) and self.lastDate is not None and \
+                dates.min() < self.lastDate:
+            raise ValueError(
+                "Matches dated before the last folded matchday need a full "
+                "rebuild")
+        # Both sides in one call, adding a team shifts the codes of others
+        codes = self.getTeamCodes(np.concatenate([
+            matches.home_team_api_id.to_numpy(dtype=np.int64),
+            matches.away_team_api_id.to_numpy(dtype=np.int64)]))
+        homeCodes = codes[:len(matches)].tolist()
+        awayCodes = codes[len(matches):].tolist()
+        homeGoals = matches.home_team_goal.to_numpy(dtype=np.int64).tolist()
+        awayGoals = matches.away_team_goal.to_numpy(dtype=np.int64).tolist()
+
+        order = np.argsort(dates, kind="mergesort")
+        days = np.split(order, np.flatnonzero(np.diff(dates[order])) + 1)
+        ratings = self.ratings.tolist()
+        results = np.empty((len(matches), 4))
+        for day in days:
+            day = day.tolist()
+            for i in day:
+                results[i, 0] = ratings[homeCodes[i]]
+                results[i, 1] = ratings[awayCodes[i]]
+            for i in day:
+                change = self.getRatingChange(
+                    results[i, 0], results[i, 1], homeGoals[i], awayGoals[i])
+                ratings[homeCodes[i]] += change
+                ratings[awayCodes[i]] -= change
+            for i in day:
+                results[i, 2] = ratings[homeCodes[i]]
+                results[i, 3] = ratings[awayCodes[i]]
+
+        self.ratings = np.array(ratings, dtype=np.float64)
+        if len(matches):
+            self.lastDate = int(dates.max())
+            self.seenMatchIds = np.union1d(
+                self.seenMatchIds, matches.match_api_id.to_numpy(
+                    dtype=np.int64))
+        return pd.DataFrame(results, index=matches.index,
+                            columns=ELO_COLUMNS + ELO_AFTER_COLUMNS)
+
+    def getSnapshot(self):
+        return {
+            "parameters": np.array([
+                self.kFactor, self.homeAdvantage,
+                float(self.goalDifferenceWeighting), self.initialRating]),
+            "teams": self.teams,
+            "ratings": self.ratings,
+            "seen_match_ids": self.seenMatchIds,
+            "last_date": np.array(
+                [-1 if self.lastDate is None else self.lastDate],
+                dtype=np.int64),
+        }
+
+    @classmethod
+    def fromSnapshot(cls, snapshot):
+        kFactor, homeAdvantage, goalDifferenceWeighting, initialRating = \
+            snapshot["parameters"].tolist()
+        engine = cls(kFactor, homeAdvantage, bool(goalDifferenceWeighting),
+                     initialRating)
+        engine.teams = np.array(snapshot["teams"], dtype=np.int64)
+        engine.ratings = np.array(snapshot["ratings"], dtype=np.float64)
+        engine.seenMatchIds = np.array(
+            snapshot["seen_match_ids"], dtype=np.int64)
+        lastDate = int(snapshot["last_date"][0])
+        engine.lastDate = None if lastDate < 0 else lastDate
+        return engine
+
+    def save(self, path=ELO_SNAPSHOT_FILE):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temporaryPath = "{}.tmp.npz".format(path)
+        np.savez(temporaryPath, **self.getSnapshot())
+        os.replace(temporaryPath, path)
+
+    @classmethod
+    def load(cls, path=ELO_SNAPSHOT_FILE):
+        if not os.path.exists(path):
+            return cls()
+        with np.load(path, allow_pickle=False) as snapshot:
+            return cls.fromSnapshot(snapshot)
+
+
+def getEloFeatures(matches, **parameters):
+    # Pre-match ratings of both teams of every match, from a single pass
+    # over matches
+    return EloRatingEngine(**parameters).update(matches)[ELO_COLUMNS]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--goal-difference", action="store_true",
+                        help="Weight rating changes by the margin of victory")
+    args = parser.parse_args()
+
+    dataAggregator = MatchResultPredictDataAggregator(EuropeanSoccerDatabase())
+    matches = dataAggregator.matchData.dropna(subset=LINEUP_COLUMNS)
+    engine = EloRatingEngine.load()
+    if engine.goalDifferenceWeighting != args.goal_difference:
+        engine = EloRatingEngine(goalDifferenceWeighting=args.goal_difference)
+    start = time.perf_counter()
+    ratings = engine.update(matches)
+    engine.save()
+    print("Folded {} new matches in {:.2f}s, {} teams rated".format(
+        len(ratings), time.perf_counter() - start, len(engine.teams)))
@@ -0,0 +1,280 @@
+import numpy as np
+import pandas as pd
+
+from data_aggregator import HeadToHeadIndex
+from utils.instrumentation import instrumented
+
+# Bump whenever the meaning of a feature column changes, so persisted
+# feature matrices built with the old definition are invalidated
+FEATURE_VERSION = 4
+FORM_WINDOW = 10
+HEAD_TO_HEAD_WINDOW = 3
+
+FEATURE_COLUMNS = [
+    "match_api_id",
+    "league_id",
+    "home_team_goals_difference",
+    "away_team_goals_difference",
+    "games_won_home_team",
+    "games_won_away_team",
+    "games_against_won",
+    "games_against_lost",
+]
+
+
+class TeamFormFeatureEngine(object):
+    # Vectorized equivalent of predict.getFeaturesFromMatches. The match
+    # frame is exploded once into one timeline row per (match, team) and the
+    # "last N matches strictly before date" windows are computed for every
+    # match at once with prefix sums over the per-team timelines.
+
+    def __init__(self, matches, limit=FORM_WINDOW,
+                 againstLimit=HEAD_TO_HEAD_WINDOW):
+        self.matches = matches
+        self.limit = limit
+        self.againstLimit = againstLimit
+        self.timeline = self.explodeMatches(matches)
+        self.prefixSums = dict()
+        self.opponentIndex = None
+        self.headToHeadIndex = None
+
+    @staticmethod
+    def explodeMatches(matches):
+        numberOfMatches = len(matches)
+        homeTeamIds = matches.home_team_api_id.to_numpy(dtype=np.int64)
+        awayTeamIds = matches.away_team_api_id.to_numpy(dtype=np.int64)
+        homeGoals = matches.home_team_goal.to_numpy(dtype=np.int64)
+        awayGoals = matches.away_team_goal.to_numpy(dtype=np.int64)
+        dates = pd.to_datetime(matches.date).to_numpy().astype(np.int64)
+
+        teamIds = np.concatenate([homeTeamIds, awayTeamIds])
+        opponentIds = np.concatenate([awayTeamIds, homeTeamIds])
+        goalsFor = np.concatenate([homeGoals, awayGoals])
+        goalsAgainst = np.concatenate([awayGoals, homeGoals])
+        rows = np.concatenate([np.arange(numberOfMatches)] * 2)
+        isHome = np.repeat([True, False], numberOfMatches)
+        teamDates = np.concatenate([dates, dates])
+
+        teams, teamCodes = np.unique(teamIds, return_inverse=True)
+        opponentCodes = np.searchsorted(teams, opponentIds)
+        dateCodes = np.unique(teamDates, return_inverse=True)[1].reshape(-1)
+        numberOfDates = int(dateCodes.max()) + 1 if len(dateCodes) else 1
+
+        # Stable sort keeps the original row order for ties within a team
+        order = np.lexsort((rows, dateCodes, teamCodes))
+        timeline = pd.DataFrame({
+            "row": rows[order],
+            "is_home": isHome[order],
+            "team_code": teamCodes[order].astype(np.int64),
+            "opponent_code": opponentCodes[order].astype(np.int64),
+            "team_date": (teamCodes[order].astype(np.int64) * numberOfDates +
+                          dateCodes[order]),
+            "goals_for": goalsFor[order],
+            "goals_against": goalsAgainst[order],
+            "win": (goalsFor[order] > goalsAgainst[order]).astype(np.int64),
+        })
+        timeline.attrs["number_of_dates"] = numberOfDates
+        timeline.attrs["number_of_teams"] = len(teams)
+        timeline.attrs["teams"] = teams
+        timeline.attrs["dates"] = np.unique(teamDates)
+        return timeline
+
+    def getWindowBounds(self, limit):
+        # For every timeline row the window is [lower, upper): upper is the
+        # first row of the team's block on the same date, so other matches
+        # played that day are excluded just like filterMatchesBefore does.
+        teamDate = self.timeline.team_date.to_numpy()
+        teamCodes = self.timeline.team_code.to_numpy()
+        upper = np.searchsorted(teamDate, teamDate, side="left")
+        teamStart = np.searchsorted(
+            teamDate, teamCodes * self.timeline.attrs["number_of_dates"],
+            side="left")
+        lower = np.maximum(upper - limit, teamStart)
+        return lower, upper
+
+    @staticmethod
+    def getWindowSums(values, lower, upper):
+        prefixSums = np.concatenate([[0], np.cumsum(values)])
+        return prefixSums[upper] - prefixSums[lower]
+
+    def getWindowMeans(self, homeValues, awayValues):
+        # Mean of a per-match statistic of each team, given for the home and
+        # the away side of every match, over the team's last limit matches
+        # strictly before each match. Missing values are left out of the
+        # mean, NaN when the window has none.
+        timeline = self.timeline
+        rows = timeline.row.to_numpy()
+        isHome = timeline.is_home.to_numpy()
+        values = np.where(isHome,
+                          np.asarray(homeValues, dtype=np.float64)[rows],
+                          np.asarray(awayValues, dtype=np.float64)[rows])
+        present = ~np.isnan(values)
+        lower, upper = self.getWindowBounds(self.limit)
+        sums = self.getWindowSums(np.where(present, values, 0.0), lower, upper)
+        counts = self.getWindowSums(present.astype(np.int64), lower, upper)
+        means = np.full(len(timeline), np.nan)
+        np.divide(sums, counts, out=means, where=counts > 0)
+        homeMeans = np.empty(len(self.matches))
+        homeMeans[rows[isHome]] = means[isHome]
+        awayMeans = np.empty(len(self.matches))
+        awayMeans[rows[~isHome]] = means[~isHome]
+        return homeMeans, awayMeans
+
+    def getPrefixSums(self, column):
+        if column not in self.prefixSums:
+            self.prefixSums[column] = np.concatenate(
+                [[0], np.cumsum(self.timeline[column].to_numpy())])
+        return self.prefixSums[column]
+
+    def getTimelinePairs(self):
+        timeline = self.timeline
+        return (timeline.team_code.to_numpy() *
+                timeline.attrs["number_of_teams"] +
+                timeline.opponent_code.to_numpy())
+
+    def getOpponentWindowSums(self, values, lower, upper, pairs=None):
+        # Sums values of a team's timeline rows inside [lower, upper) that
+        # were played against a given opponent. pairs holds the
+        # (team, opponent) code of every window, the timeline's own pairs by
+        # default; negative pairs get an empty sum.
+        timeline = self.timeline
+        span = len(timeline) + 1
+        if self.opponentIndex is None:
+            keys = self.getTimelinePairs() * span + np.arange(len(timeline))
+            order = np.argsort(keys, kind="mergesort")
+            self.opponentIndex = (keys[order], order)
+        sortedKeys, order = self.opponentIndex
+        if pairs is None:
+            pairs = self.getTimelinePairs()
+        prefixSums = np.concatenate([[0], np.cumsum(values[order])])
+        sums = (prefixSums[np.searchsorted(sortedKeys, pairs * span + upper)] -
+                prefixSums[np.searchsorted(sortedKeys, pairs * span + lower)])
+        return np.where(pairs >= 0, sums, 0)
+
+    def getHeadToHeadIndex(self):
+        if self.headToHeadIndex is None:
+            self.headToHeadIndex = HeadToHeadIndex(self.matches)
+        return self.headToHeadIndex
+
+    def getHeadToHeadFeatures(self):
+        return self.getHeadToHeadIndex().getHeadToHeadFeatures(
+            self.matches, self.againstLimit)
+
+    def getTeamWindows(self, teamIds, dates, limit):
+        # Team codes and [lower, upper) windows of the last limit timeline
+        # rows of each team strictly before each date. Teams without any
+        # match get an empty window and a code of -1.
+        timeline = self.timeline
+        teams = timeline.attrs["teams"]
+        numberOfDates = timeline.attrs["number_of_dates"]
+        teamIds = np.asarray(teamIds, dtype=np.int64)
+        codes = np.searchsorted(teams, teamIds)
+        known = codes < len(teams)
+        known[known] = teams[codes[known]] == teamIds[known]
+        codes = np.where(known, codes, -1)
+        dateRanks = np.searchsorted(timeline.attrs["dates"], dates)
+        teamDate = timeline.team_date.to_numpy()
+        teamStart = np.searchsorted(teamDate, codes * numberOfDates)
+        upper = np.where(known, np.searchsorted(
+            teamDate, codes * numberOfDates + dateRanks), teamStart)
+        lower = np.maximum(upper - limit, teamStart)
+        return codes, lower, upper
+
+    def getLastMatchRows(self, teamIds, dates):
+        # Position in matches of each team's last match strictly before
+        # date and whether the team played it at home, -1 when there is none
+        codes, lower, upper = self.getTeamWindows(teamIds, dates, 1)
+        hasMatch = upper > lower
+        last = np.maximum(upper - 1, 0)
+        rows = np.where(hasMatch, self.timeline.row.to_numpy()[last], -1)
+        isHome = hasMatch & self.timeline.is_home.to_numpy()[last]
+        return rows, isHome
+
+    def getFixtureFeatures(self, fixtures):
+        # Features of fixtures that are not part of matches, e.g. upcoming
+        # ones, computed against every match in matches dated before them.
+        # fixtures needs home_team_api_id, away_team_api_id and date,
+        # match_api_id and league_id are copied over when present.
+        homeTeamIds = fixtures.home_team_api_id.to_numpy(dtype=np.int64)
+        awayTeamIds = fixtures.away_team_api_id.to_numpy(dtype=np.int64)
+        dates = pd.to_datetime(fixtures.date).to_numpy().astype(np.int64)
+        numberOfTeams = self.timeline.attrs["number_of_teams"]
+        homeCodes, homeLower, homeUpper = self.getTeamWindows(
+            homeTeamIds, dates, self.limit)
+        awayCodes, awayLower, awayUpper = self.getTeamWindows(
+            awayTeamIds, dates, self.limit)
+        goalsFor = self.getPrefixSums("goals_for")
+        goalsAgainst = self.getPrefixSums("goals_against")
+        wins = self.getPrefixSums("win")
+        # Same away team quirk as getFeatures
+        pairs = np.where((awayCodes >= 0) & (homeCodes >= 0),
+                         awayCodes * numberOfTeams + homeCodes, -1)
+        awayGoalsAgainstHome = self.getOpponentWindowSums(
+            self.timeline.goals_for.to_numpy(), awayLower, awayUpper, pairs)
+        gamesAgainstWon, gamesAgainstLost = \
+            self.getHeadToHeadIndex().getHeadToHeadFeatures(
+                fixtures, self.againstLimit)
+
+        missing = np.full(len(fixtures), np.nan)
+        return pd.DataFrame({
+            "match_api_id": fixtures.match_api_id.to_numpy(dtype=np.float64)
+            if "match_api_id" in fixtures else missing,
+            "league_id": fixtures.league_id.to_numpy(dtype=np.float64)
+            if "league_id" in fixtures else missing,
+            "home_team_goals_difference": (
+                goalsFor[homeUpper] - goalsFor[homeLower] -
+                goalsAgainst[homeUpper] + goalsAgainst[homeLower]
+            ).astype(np.float64),
+            "away_team_goals_difference": (
+                goalsFor[awayUpper] - goalsFor[awayLower] -
+                awayGoalsAgainstHome).astype(np.float64),
+            "games_won_home_team": (
+                wins[homeUpper] - wins[homeLower]).astype(np.float64),
+            "games_won_away_team": (
+                wins[awayUpper] - wins[awayLower]).astype(np.float64),
+            "games_against_won": gamesAgainstWon,
+            "games_against_lost": gamesAgainstLost,
+        }, index=fixtures.index, columns=FEATURE_COLUMNS)
+
+    @instrumented()
+    def getFeatures(self):
+        timeline = self.timeline
+        lower, upper = self.getWindowBounds(self.limit)
+        goalsFor = self.getWindowSums(
+            timeline.goals_for.to_numpy(), lower, upper)
+        goalsAgainst = self.getWindowSums(
+            timeline.goals_against.to_numpy(), lower, upper)
+        wins = self.getWindowSums(timeline.win.to_numpy(), lower, upper)
+        # getFeaturesFromMatches counts the away team's conceded goals with
+        # the home team id, i.e. the goals the away team scored against the
+        # home team inside its own window. Kept for parity.
+        goalsScoredAgainstOpponent = self.getOpponentWindowSums(
+            timeline.goals_for.to_numpy(), lower, upper)
+
+        isHome = timeline.is_home.to_numpy()
+        homeRows = timeline.row.to_numpy()[isHome]
+        awayRows = timeline.row.to_numpy()[~isHome]
+        numberOfMatches = len(self.matches)
+
+        homeGoalsDifference = np.empty(numberOfMatches)
+        homeGoalsDifference[homeRows] = (goalsFor - goalsAgainst)[isHome]
+        awayGoalsDifference = np.empty(numberOfMatches)
+        awayGoalsDifference[awayRows] = (
+            goalsFor - goalsScoredAgainstOpponent)[~isHome]
+        homeWins = np.empty(numberOfMatches)
+        homeWins[homeRows] = wins[isHome]
+        awayWins = np.empty(numberOfMatches)
+        awayWins[awayRows] = wins[~isHome]
+        gamesAgainstWon, gamesAgainstLost = self.getHeadToHeadFeatures()
+
+        return pd.DataFrame({
+            "match_api_id": self.matches.match_api_id.to_numpy(
+                dtype=np.float64),
+            "league_id": self.matches.league_id.to_numpy(dtype=np.float64),
+            "home_team_goals_difference": homeGoalsDifference,
+            "away_team_goals_difference": awayGoalsDifference,
+            "games_won_home_team": homeWins,
+            "games_won_away_team": awayWins,
+            "games_against_won": gamesAgainstWon,
+            "games_against_lost": gamesAgainstLost,
+        }, index=self.matches.index, columns=FEATURE_COLUMNS)
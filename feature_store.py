@@ -0,0 +1,115 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from feature_engine import FEATURE_VERSION
+from shared.constants import FEATURE_STORE_PATH
+
+
+class FeatureStore(object):
+    # Persists computed feature arrays as .npy files, one directory per entry
+    # named "<name>-<key>". The key hashes the database file's mtime and size,
+    # the feature definition version and the build parameters. Entries of
+    # other parameters stay valid side by side; a change to the database or
+    # the version makes every entry stale. Hits are memory-mapped, not read.
+
+    def __init__(self, databaseName, storePath=FEATURE_STORE_PATH,
+                 version=FEATURE_VERSION):
+        self.databaseName = databaseName
+        self.storePath = storePath
+        self.version = version
+
+    def getSource(self):
+        # What every entry was built from
+        stat = os.stat(self.databaseName)
+        return {
+            "database_mtime_ns": stat.st_mtime_ns,
+            "database_size": stat.st_size,
+            "feature_version": self.version,
+        }
+
+    def getKey(self, name, parameters):
+        description = json.dumps(dict(
+            self.getSource(), name=name, parameters=parameters),
+            sort_keys=True, default=str)
+        return hashlib.sha256(description.encode("utf-8")).hexdigest()[:20]
+
+    def getEntryPath(self, name, key):
+        return os.path.join(self.storePath, "{}-{}".format(name, key))
+
+    def load(self, name, parameters, mmapMode="r"):
+        entryPath = self.getEntryPath(name, self.getKey(name, parameters))
+        metadataPath = os.path.join(entryPath, "metadata.json")
+        if not os.path.exists(metadataPath):
+            return None
+        with open(metadataPath) as f:
+            metadata = json.load(f)
+        arrays = {
+            arrayName: np.load(
+                os.path.join(entryPath, "{}.npy".format(arrayName)),
+                mmap_mode=mmapMode, allow_pickle=False)
+            for arrayName in metadata["arrays"]
+        }
+        return arrays, metadata["metadata"]
+
+    def save(self, name, parameters, arrays, metadata=None):
+        key = self.getKey(name, parameters)
+        os.makedirs(self.storePath, exist_ok=True)
+        # Written to a temporary directory first and renamed into place, so
+        # readers never see a partially written entry
+        temporaryPath = tempfile.mkdtemp(dir=self.storePath)
+        try:
+            for arrayName, array in arrays.items():
+                np.save(os.path.join(
+                    temporaryPath, "{}.npy".format(arrayName)),
+                    np.ascontiguousarray(array), allow_pickle=False)
+            with open(os.path.join(temporaryPath, "metadata.json"), "w") as f:
+                json.dump({
+                    "source": self.getSource(),
+                    "parameters": parameters,
+                    "arrays": list(arrays),
+                    "metadata": metadata or {},
+                }, f, default=str)
+            entryPath = self.getEntryPath(name, key)
+            if os.path.exists(entryPath):
+                shutil.rmtree(entryPath)
+            os.replace(temporaryPath, entryPath)
+        except Exception:
+            shutil.rmtree(temporaryPath, ignore_errors=True)
+            raise
+        self.evict(name)
+
+    def isStale(self, entryPath):
+        # Built from another database state or feature version, or not
+        # readable at all
+        try:
+            with open(os.path.join(entryPath, "metadata.json")) as f:
+                return json.load(f).get("source") != self.getSource()
+        except (OSError, ValueError):
+            return True
+
+    def evict(self, name):
+        # Removes the entries of name that no longer match the database and
+        # feature version. Entries of other parameters are kept.
+        if not os.path.isdir(self.storePath):
+            return
+        for entry in os.listdir(self.storePath):
+            entryPath = os.path.join(self.storePath, entry)
+            if entry.rsplit("-", 1)[0] == name and self.isStale(entryPath):
+                logging.info("Evicting stale feature store entry {}".format(
+                    entry))
+                shutil.rmtree(entryPath, ignore_errors=True)
+
+    def getOrBuild(self, name, parameters, build):
+        # build() returns (arrays, metadata) and only runs on a miss
+        cached = self.load(name, parameters)
+        if cached is not None:
+            return cached
+        arrays, metadata = build()
+        self.save(name, parameters, arrays, metadata)
+        return self.load(name, parameters)
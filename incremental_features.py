@@ -0,0 +1,226 @@
+import bisect
+import os
+import pickle
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from data_aggregator import (LINEUP_COLUMNS, PREDICT_SCHEMA, RATING_COLUMNS,
+                             EuropeanSoccerDatabase,
+                             MatchResultPredictDataAggregator)
+from elo_ratings import ELO_COLUMNS, EloRatingEngine
+from feature_engine import (FEATURE_COLUMNS, FEATURE_VERSION, FORM_WINDOW,
+                            HEAD_TO_HEAD_WINDOW)
+from shared.constants import FEATURE_STORE_PATH
+
+INCREMENTAL_STATE_FILE = os.path.join(
+    FEATURE_STORE_PATH, "incremental_state.pkl")
+INCREMENTAL_FEATURES_FILE = os.path.join(
+    FEATURE_STORE_PATH, "incremental_features.csv")
+
+
+class IncrementalFeatureUpdater(object):
+    # Keeps the rolling state the team-form, Elo and player-rating features
+    # need: a ring buffer of each team's latest results, the latest meetings
+    # of every team pair, the Elo engine and each player's dated ratings.
+    # New matches are folded in date by date, so every match only sees
+    # results strictly before its date, and the output equals a full
+    # TeamFormFeatureEngine / getEloFeatures / getPlayerRatingsForMatches
+    # recompute over the same matches.
+
+    def __init__(self, limit=FORM_WINDOW, againstLimit=HEAD_TO_HEAD_WINDOW):
+        self.version = FEATURE_VERSION
+        self.limit = limit
+        self.againstLimit = againstLimit
+        self.seenMatchIds = set()
+        self.seenAttributeIds = set()
+        self.lastDate = None
+        self.teamResults = dict()
+        self.headToHead = dict()
+        self.playerRatings = dict()
+        self.eloRatings = EloRatingEngine()
+
+    @classmethod
+    def load(cls, path=INCREMENTAL_STATE_FILE):
+        if not os.path.exists(path):
+            return cls()
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+        if state.version != FEATURE_VERSION:
+            return cls(state.limit, state.againstLimit)
+        return state
+
+    def save(self, path=INCREMENTAL_STATE_FILE):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temporaryPath = "{}.tmp".format(path)
+        with open(temporaryPath, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporaryPath, path)
+
+    def addPlayerAttributes(self, attributes):
+        # Rows folded before are recognised by their id when it is loaded
+        if "id" in attributes:
+            attributes = attributes[
+                ~attributes.id.isin(self.seenAttributeIds)]
+            self.seenAttributeIds.update(attributes.id.tolist())
+        dates = pd.to_datetime(attributes.date).to_numpy().astype(np.int64)
+        for playerId, date, rating in zip(
+                attributes.player_api_id.to_numpy(dtype=np.int64), dates,
+                attributes.overall_rating.to_numpy(dtype=np.float64)):
+            # Ratings of a player stay sorted by date, ties keep their
+            # arrival order like the stable sort in the batch index
+            history = self.playerRatings.setdefault(int(playerId), ([], []))
+            position = bisect.bisect_right(history[0], date)
+            history[0].insert(position, date)
+            history[1].insert(position, rating)
+
+    def getPlayerRating(self, playerId, date):
+        if np.isnan(playerId):
+            return 0.0
+        history = self.playerRatings.get(int(playerId))
+        if history is None:
+            return np.nan
+        position = bisect.bisect_left(history[0], date)
+        return history[1][position - 1] if position else np.nan
+
+    def getTeamForm(self, teamId, opponentId, date):
+        # Goals for, goals against, wins and goals scored against opponentId
+        # over the team's last results strictly before date
+        results = [result for result in self.teamResults.get(teamId, ())
+                   if result[0] < date][-self.limit:]
+        goalsFor = sum(result[2] for result in results)
+        goalsAgainst = sum(result[3] for result in results)
+        wins = sum(result[2] > result[3] for result in results)
+        goalsAgainstOpponent = sum(
+            result[2] for result in results if result[1] == opponentId)
+        return goalsFor, goalsAgainst, wins, goalsAgainstOpponent
+
+    def getHeadToHead(self, homeTeamId, awayTeamId, date):
+        # Wins of the home and of the away team over the pair's last
+        # meetings strictly before date
+        pair = (min(homeTeamId, awayTeamId), max(homeTeamId, awayTeamId))
+        meetings = [meeting for meeting in self.headToHead.get(pair, ())
+                    if meeting[0] < date][-self.againstLimit:]
+        won = lost = 0.0
+        for _, meetingHomeTeamId, homeGoals, awayGoals in meetings:
+            if homeGoals == awayGoals:
+                continue
+            winnerId = meetingHomeTeamId if homeGoals > awayGoals else \
+                pair[0] + pair[1] - meetingHomeTeamId
+            if winnerId == homeTeamId:
+                won += 1
+            else:
+                lost += 1
+        return won, lost
+
+    def getMatchFeatures(self, match, date):
+        homeTeamId = int(match["home_team_api_id"])
+        awayTeamId = int(match["away_team_api_id"])
+        homeForm = self.getTeamForm(homeTeamId, awayTeamId, date)
+        awayForm = self.getTeamForm(awayTeamId, homeTeamId, date)
+        gamesAgainstWon, gamesAgainstLost = self.getHeadToHead(
+            homeTeamId, awayTeamId, date)
+        features = [
+            float(match["match_api_id"]),
+            float(match["league_id"]),
+            float(homeForm[0] - homeForm[1]),
+            float(awayForm[0] - awayForm[3]),
+            float(homeForm[2]),
+            float(awayForm[2]),
+            gamesAgainstWon,
+            gamesAgainstLost,
+        ]
+        features.extend(self.getPlayerRating(float(match[player]), date)
+                        for player in LINEUP_COLUMNS)
+        return features
+
+    def foldMatch(self, match, date):
+        homeTeamId = int(match["home_team_api_id"])
+        awayTeamId = int(match["away_team_api_id"])
+        homeGoals = int(match["home_team_goal"])
+        awayGoals = int(match["away_team_goal"])
+        # Twice the window so that same-day results can be skipped without
+        # running out of earlier ones
+        for teamId, opponentId, goalsFor, goalsAgainst in [
+                (homeTeamId, awayTeamId, homeGoals, awayGoals),
+                (awayTeamId, homeTeamId, awayGoals, homeGoals)]:
+            self.teamResults.setdefault(
+                teamId, deque(maxlen=2 * self.limit)).append(
+                    (date, opponentId, goalsFor, goalsAgainst))
+        pair = (min(homeTeamId, awayTeamId), max(homeTeamId, awayTeamId))
+        self.headToHead.setdefault(
+            pair, deque(maxlen=2 * self.againstLimit)).append(
+                (date, homeTeamId, homeGoals, awayGoals))
+        self.seenMatchIds.add(int(match["match_api_id"]))
+
+    def compact(self):
+        # Drops what later matches, all dated after lastDate, can no longer
+        # reach: every rating older than a player's latest one before
+        # lastDate, and the folded match ids. Without the ids a match folded
+        # again is only rejected when it is dated before lastDate, so this
+        # is for callers feeding disjoint, date ordered chunks.
+        if self.lastDate is None:
+            return
+        for dates, ratings in self.playerRatings.values():
+            position = bisect.bisect_left(dates, self.lastDate) - 1
+            if position > 0:
+                del dates[:position]
+                del ratings[:position]
+        self.seenMatchIds = set()
+        self.seenAttributeIds = set()
+        self.eloRatings.seenMatchIds = np.empty(0, dtype=np.int64)
+
+    def update(self, matches, playerAttributes=None):
+        # Folds the matches that have not been seen yet and returns their
+        # features, indexed like the input frame
+        if playerAttributes is not None:
+            self.addPlayerAttributes(playerAttributes)
+        matches = matches[~matches.match_api_id.isin(self.seenMatchIds)]
+        dates = pd.to_datetime(matches.date).to_numpy().astype(np.int64)
+        if len(matches) and self.lastDate is not None and \
+                dates.min() < self.lastDate:
+            raise ValueError(
+                "Matches dated before the last folded matchday need a full "
+                "rebuild")
+        eloFeatures = self.eloRatings.update(matches)[ELO_COLUMNS]
+        order = np.argsort(dates, kind="mergesort")
+        records = matches.to_dict("records")
+        rows = []
+        start = 0
+        while start < len(order):
+            end = start
+            while end < len(order) and dates[order[end]] == \
+                    dates[order[start]]:
+                end += 1
+            day = [(records[position], dates[position])
+                   for position in order[start:end]]
+            rows.extend(self.getMatchFeatures(match, date)
+                        for match, date in day)
+            for match, date in day:
+                self.foldMatch(match, date)
+            self.lastDate = int(dates[order[start]])
+            start = end
+        features = pd.DataFrame(
+            rows, columns=FEATURE_COLUMNS + RATING_COLUMNS,
+            index=matches.index[order])
+        features = features.loc[matches.index]
+        features[ELO_COLUMNS] = eloFeatures
+        return features[FEATURE_COLUMNS + ELO_COLUMNS + RATING_COLUMNS]
+
+
+if __name__ == "__main__":
+    database = EuropeanSoccerDatabase()
+    dataAggregator = MatchResultPredictDataAggregator(
+        database, schema=dict(PREDICT_SCHEMA, Player_Attributes=dict(
+            PREDICT_SCHEMA["Player_Attributes"], id="int")))
+    updater = IncrementalFeatureUpdater.load()
+    matches = dataAggregator.matchData.dropna(subset=LINEUP_COLUMNS)
+    features = updater.update(matches, dataAggregator.playerAttributeData)
+    if len(features):
+        features.to_csv(
+            INCREMENTAL_FEATURES_FILE, mode="a", index=False,
+            header=not os.path.exists(INCREMENTAL_FEATURES_FILE))
+    updater.save()
+    print("Folded {} new matches, {} seen in total".format(
+        len(features), len(updater.seenMatchIds)))
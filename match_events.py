@@ -0,0 +1,194 @@
+import argparse
+import resource
+import time
+import xml.etree.ElementTree as ElementTree
+
+import numpy as np
+import pandas as pd
+
+from data_aggregator import (EuropeanSoccerDatabase,
+                             MatchResultPredictDataAggregator)
+from feature_engine import FORM_WINDOW, TeamFormFeatureEngine
+from feature_store import FeatureStore
+
+# Event columns of the Match table that are parsed. goal is left out, the
+# score is already in home_team_goal and away_team_goal.
+EVENT_COLUMNS = ["shoton", "shotoff", "foulcommit", "card", "cross",
+                 "corner", "possession"]
+# Events counted per team from their <team> field
+TEAM_EVENT_STATISTICS = {
+    "shoton": "shots_on",
+    "shotoff": "shots_off",
+    "foulcommit": "fouls",
+    "cross": "crosses",
+    "corner": "corners",
+}
+EVENT_STATISTICS = ["shots_on", "shots_off", "fouls", "yellow_cards",
+                    "red_cards", "crosses", "corners", "possession"]
+EVENT_STATISTIC_COLUMNS = [
+    "{}_{}".format(side, statistic)
+    for statistic in EVENT_STATISTICS for side in ["home", "away"]]
+MATCH_EVENT_COLUMNS = ["match_api_id"] + EVENT_STATISTIC_COLUMNS
+RED_CARD_TYPES = {"r", "y2"}
+EVENT_CHUNK_SIZE = 2000
+XML_FEED_SIZE = 4096
+
+
+def iterEventValues(xml, feedSize=XML_FEED_SIZE):
+    # Yields the fields of every top level <value> of an event column as a
+    # {tag: text} dict. The XML is fed to the parser in slices and every
+    # value is cleared once read, so no document tree is ever built.
+    parser = ElementTree.XMLPullParser(events=("start", "end"))
+    depth = 0
+    for start in range(0, len(xml), feedSize):
+        parser.feed(xml[start:start + feedSize])
+        for event, element in parser.read_events():
+            if event == "start":
+                depth += 1
+                continue
+            depth -= 1
+            if depth == 1 and element.tag == "value":
+                yield {child.tag: child.text for child in element}
+                element.clear()
+    parser.close()
+
+
+def getEventTeam(value, homeTeamId, awayTeamId):
+    # 0 for the home team, 1 for the away team, None when unattributed
+    team = value.get("team")
+    if team is None or not team.strip().isdigit():
+        return None
+    team = int(team)
+    return 0 if team == homeTeamId else 1 if team == awayTeamId else None
+
+
+def extractMatchEvents(events, homeTeamId, awayTeamId):
+    # Per-match statistics in EVENT_STATISTIC_COLUMNS order. A NULL or
+    # unparsable column leaves its statistics NaN.
+    statistics = dict()
+    for column in EVENT_COLUMNS:
+        xml = events.get(column)
+        if xml is None:
+            continue
+        try:
+            if column == "possession":
+                possession = [
+                    (float(value["homepos"]), float(value["awaypos"]))
+                    for value in iterEventValues(xml)
+                    if value.get("homepos") and value.get("awaypos")]
+                if possession:
+                    statistics["possession"] = np.mean(possession, axis=0)
+                continue
+            counts = np.zeros((3, 2))
+            for value in iterEventValues(xml):
+                team = getEventTeam(value, homeTeamId, awayTeamId)
+                if team is None:
+                    continue
+                if column != "card":
+                    counts[0, team] += 1
+                elif value.get("card_type") in RED_CARD_TYPES:
+                    counts[2, team] += 1
+                else:
+                    counts[1, team] += 1
+        except (ElementTree.ParseError, ValueError):
+            continue
+        if column == "card":
+            statistics["yellow_cards"] = counts[1]
+            statistics["red_cards"] = counts[2]
+        else:
+            statistics[TEAM_EVENT_STATISTICS[column]] = counts[0]
+    row = []
+    for statistic in EVENT_STATISTICS:
+        row.extend(statistics.get(statistic, (np.nan, np.nan)))
+    return row
+
+
+class MatchEventExtractor(object):
+    # Streams the XML event columns of the Match table in chunks of
+    # chunkSize rows through the aggregator's database, so that only one
+    # chunk of XML strings is alive at a time, and reduces every match to
+    # a row of float32 counts. The match ids are kept in their own int64
+    # array, float32 is only exact up to 2 ** 24. The aggregator's own Match
+    # frame never loads these columns.
+
+    def __init__(self, dataAggregator, chunkSize=EVENT_CHUNK_SIZE):
+        self.dataAggregator = dataAggregator
+        self.chunkSize = chunkSize
+
+    def getQuery(self):
+        return "SELECT match_api_id, home_team_api_id, away_team_api_id, " \
+            "{} FROM Match;".format(", ".join(
+                '"{}"'.format(column) for column in EVENT_COLUMNS))
+
+    def iterChunks(self):
+        database = self.dataAggregator.database
+        for chunk in database.iterQuery(self.getQuery(),
+                                        chunkSize=self.chunkSize):
+            rows = np.empty((len(chunk), len(EVENT_STATISTIC_COLUMNS)),
+                            dtype=np.float32)
+            for i, match in enumerate(chunk.to_dict("records")):
+                rows[i] = extractMatchEvents(
+                    match, match["home_team_api_id"],
+                    match["away_team_api_id"])
+            yield chunk.match_api_id.to_numpy(dtype=np.int64), rows
+
+    def extract(self):
+        # The match ids and their event statistics
+        chunks = list(self.iterChunks())
+        if not chunks:
+            return np.empty(0, dtype=np.int64), np.empty(
+                (0, len(EVENT_STATISTIC_COLUMNS)), dtype=np.float32)
+        return np.concatenate([matchIds for matchIds, _ in chunks]), \
+            np.concatenate([rows for _, rows in chunks])
+
+    def getMatchEvents(self, featureStore=None):
+        # Served from the feature store when given and still fresh
+        if featureStore is None:
+            matchIds, events = self.extract()
+        else:
+            arrays = featureStore.getOrBuild(
+                "match_events", {"columns": EVENT_COLUMNS,
+                                 "match_ids": "int64"},
+                lambda: (dict(zip(["match_ids", "events"], self.extract())),
+                         {}))[0]
+            matchIds, events = arrays["match_ids"], arrays["events"]
+        matchEvents = pd.DataFrame(
+            np.asarray(events), columns=EVENT_STATISTIC_COLUMNS)
+        matchEvents.insert(0, "match_api_id", np.asarray(matchIds))
+        return matchEvents
+
+
+def getEventFormFeatures(matches, matchEvents, limit=FORM_WINDOW):
+    # Each team's average of every event statistic over its last limit
+    # matches before each match, indexed like matches
+    events = matchEvents.set_index("match_api_id").reindex(
+        matches.match_api_id.to_numpy())
+    engine = TeamFormFeatureEngine(matches, limit)
+    features = dict()
+    for statistic in EVENT_STATISTICS:
+        homeMeans, awayMeans = engine.getWindowMeans(
+            events["home_{}".format(statistic)].to_numpy(),
+            events["away_{}".format(statistic)].to_numpy())
+        features["home_team_avg_{}".format(statistic)] = homeMeans
+        features["away_team_avg_{}".format(statistic)] = awayMeans
+    return pd.DataFrame(features, index=matches.index)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunk-size", type=int, default=EVENT_CHUNK_SIZE)
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always parse instead of using the feature store")
+    args = parser.parse_args()
+
+    database = EuropeanSoccerDatabase()
+    dataAggregator = MatchResultPredictDataAggregator(database)
+    extractor = MatchEventExtractor(dataAggregator, args.chunk_size)
+    start = time.perf_counter()
+    matchEvents = extractor.getMatchEvents(
+        None if args.no_cache else FeatureStore(database.databaseName))
+    print("Extracted events of {} matches in {:.1f}s, peak RSS {:.0f} MB"
+          .format(len(matchEvents), time.perf_counter() - start,
+                  resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+    print(matchEvents.drop(columns="match_api_id").describe().T[
+        ["count", "mean", "max"]])
@@ -0,0 +1,101 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.instrumentation import instrumentation, instrumented
+
+# Arrays above this size are handed to the workers as a shared read only
+# memory map instead of being pickled into every task
+SHARED_ARRAY_THRESHOLD = "1K"
+
+
+# scikit-learn and joblib take over a second to import, so they are only
+# imported by the functions that fit or evaluate models
+def getDefaultClassifiers():
+    from sklearn import linear_model
+    from sklearn.ensemble import AdaBoostClassifier
+    from sklearn.naive_bayes import GaussianNB
+    from sklearn.neighbors import KNeighborsClassifier
+
+    return [
+        AdaBoostClassifier(n_estimators=200, random_state=2),
+        GaussianNB(),
+        KNeighborsClassifier(),
+        linear_model.LogisticRegression(
+            multi_class="ovr", solver="sag", class_weight="balanced"),
+    ]
+
+
+def getFolds(labels, folds=None, testSize=None, randomState=None):
+    # A single shuffled train/test split by default, stratified k-fold
+    # cross validation when folds is given
+    from sklearn import model_selection
+
+    indices = np.arange(len(labels))
+    if not folds:
+        return [model_selection.train_test_split(
+            indices, test_size=testSize, random_state=randomState)]
+    splitter = model_selection.StratifiedKFold(
+        n_splits=folds, shuffle=True, random_state=randomState)
+    return list(splitter.split(indices, labels))
+
+
+def fitAndScore(classifier, features, labels, trainIndex, testIndex, fold):
+    from sklearn.base import clone
+    from sklearn.metrics import accuracy_score
+
+    classifier = clone(classifier)
+    xTrain, yTrain = features[trainIndex], labels[trainIndex]
+    xTest, yTest = features[testIndex], labels[testIndex]
+
+    start = time.perf_counter()
+    classifier.fit(xTrain, yTrain)
+    fitSeconds = time.perf_counter() - start
+    start = time.perf_counter()
+    trainPredictions = classifier.predict(xTrain)
+    testPredictions = classifier.predict(xTest)
+    predictSeconds = time.perf_counter() - start
+
+    return {
+        "classifier": classifier.__class__.__name__,
+        "fold": fold,
+        "fit_seconds": fitSeconds,
+        "predict_seconds": predictSeconds,
+        "train_accuracy": accuracy_score(yTrain, trainPredictions),
+        "test_accuracy": accuracy_score(yTest, testPredictions),
+    }
+
+
+@instrumented()
+def evaluateClassifiers(classifiers, features, labels, folds=None,
+                        nJobs=None, testSize=None, randomState=None):
+    # Fits every (classifier, fold) pair concurrently on a process pool and
+    # returns one report row per pair. The feature matrix is shared with the
+    # workers through a memory map rather than copied into each of them.
+    from joblib import Parallel, delayed
+
+    features = np.ascontiguousarray(features, dtype=np.float64)
+    labels = np.asarray(labels)
+    splits = getFolds(labels, folds, testSize, randomState)
+    rows = Parallel(n_jobs=nJobs or -1, max_nbytes=SHARED_ARRAY_THRESHOLD,
+                    mmap_mode="r")(
+        delayed(fitAndScore)(
+            classifier, features, labels, trainIndex, testIndex, fold)
+        for classifier in classifiers
+        for fold, (trainIndex, testIndex) in enumerate(splits)
+    )
+    # The fits ran in worker processes, their timings come with the rows
+    for row in rows:
+        instrumentation.record("{}.fit".format(row["classifier"]),
+                               row["fit_seconds"])
+        instrumentation.record("{}.predict".format(row["classifier"]),
+                               row["predict_seconds"])
+    return pd.DataFrame(rows)
+
+
+def summarizeReport(report):
+    # Mean timings and accuracies per classifier, in evaluation order
+    return report.groupby("classifier", sort=False)[[
+        "fit_seconds", "predict_seconds", "train_accuracy", "test_accuracy"
+    ]].mean()
@@ -1,17 +1,18 @@
-import copy
+import argparse
 
 import pandas as pd
 import numpy as np
 from data_aggregator import (EuropeanSoccerDatabase, MatchDataHelper,
                              MatchResultPredictDataAggregator)
-from sklearn import linear_model, model_selection
-from sklearn.ensemble import AdaBoostClassifier, RandomForestClassifier
-from sklearn.metrics import accuracy_score
-from sklearn.naive_bayes import GaussianNB
-from sklearn.neighbors import KNeighborsClassifier
-import matplotlib.pyplot as plt 
+from feature_engine import FORM_WINDOW, HEAD_TO_HEAD_WINDOW
+from feature_store import FeatureStore
+from model_evaluation import (evaluateClassifiers, getDefaultClassifiers,
+                              summarizeReport)
+from training_matrix import TRAINING_COLUMNS, buildTrainingMatrix
+from utils.instrumentation import PROFILE_MODES, instrumentation, instrumented
 
 
+@instrumented()
 def getFeaturesFromMatches(match, matches):
     matchFeatures = pd.DataFrame()
     homeTeamMatches = MatchDataHelper.filterMatchesByTeamApiId(
@@ -71,10 +72,15 @@ def getFeaturesFromMatches(match, matches):
     return matchFeatures.loc[0]
 
 
-def plotAccuracyComparison(classifiers, trainAccuracies, testAccuracies):
+def plotAccuracyComparison(report):
+    # Only the plotting path pays for importing pyplot
+    import matplotlib.pyplot as plt
+
+    summary = summarizeReport(report)
+    classifiers = list(summary.index)
     xAxis = np.arange(len(classifiers))
-    trainAccuracies = [x * 100 for x in trainAccuracies]
-    testAccuracies = [x * 100 for x in testAccuracies]
+    trainAccuracies = [x * 100 for x in summary.train_accuracy]
+    testAccuracies = [x * 100 for x in summary.test_accuracy]
     plt.figure(figsize=(10, 8))
     plt.bar(xAxis - 0.2, trainAccuracies, 0.4, label="Training Accuracy")
     plt.bar(xAxis + 0.2, testAccuracies, 0.4, label="Test Accuracy")
@@ -87,8 +93,10 @@ def plotAccuracyComparison(classifiers, trainAccuracies, testAccuracies):
     plt.savefig("classifier_accuracy_comaparison.png")
 
 
-if __name__ == "__main__":
-    dataAggregator = MatchResultPredictDataAggregator(EuropeanSoccerDatabase())
+@instrumented()
+def getTrainingMatches(dataAggregator, sampleSize=1500):
+    # The first sampleSize complete matches, or all of them when sampleSize
+    # is None
     columnsOfInterest = [
         "country_id",
         "league_id",
@@ -101,81 +109,108 @@ if __name__ == "__main__":
         "home_team_goal",
         "away_team_goal",
     ]
-    
+
     for i in range(1, 12):
         columnsOfInterest.append("home_player_{}".format(i))
         columnsOfInterest.append("away_player_{}".format(i))
-    trainingMatchData = copy.deepcopy(dataAggregator.matchData)
-    trainingMatchData.dropna(subset=columnsOfInterest, inplace=True)
-    trainingMatchData = trainingMatchData.head(1500)
-    playerRatingsData = trainingMatchData.apply(
-        lambda match: dataAggregator.playerAttributeDataHelper.getPlayerRatings(
-            match
-        ), axis=1
-    )
+    dataAggregator.loadTables(["Match", "Player_Attributes"])
+    trainingMatchData = dataAggregator.matchData.dropna(
+        subset=columnsOfInterest)
+    if sampleSize is not None:
+        trainingMatchData = trainingMatchData.head(sampleSize)
+    return trainingMatchData
+
+
+@instrumented()
+def buildTrainingData(dataAggregator, sampleSize=1500):
+    # float32 features in the fixed TRAINING_COLUMNS layout and int8 label
+    # codes, see LABEL_CLASSES
+    features, labels, _ = buildTrainingMatrix(
+        getTrainingMatches(dataAggregator, sampleSize),
+        dataAggregator.playerAttributeDataHelper)
+    return (pd.DataFrame(features, columns=TRAINING_COLUMNS, copy=False),
+            pd.Series(labels, name="label"))
+
+
+@instrumented()
+def buildMatchDataset(dataAggregator, sampleSize=1500):
+    # Features plus match_api_id and label of every training match
+    features, labels, matchIds = buildTrainingMatrix(
+        getTrainingMatches(dataAggregator, sampleSize),
+        dataAggregator.playerAttributeDataHelper)
+    dataset = pd.DataFrame(features, columns=TRAINING_COLUMNS, copy=False)
+    return dataset.assign(match_api_id=matchIds, label=labels)
+
+
+@instrumented()
+def getTrainingData(dataAggregator, featureStore, sampleSize=1500):
+    # Served from the feature store when the database, the feature
+    # definitions and the parameters are unchanged since the last run
+    def build():
+        features, labels = buildTrainingData(dataAggregator, sampleSize)
+        return {
+            "features": features.to_numpy(dtype=np.float32),
+            "labels": labels.to_numpy(dtype=np.int8),
+        }, {"columns": list(features.columns)}
+
+    arrays, metadata = featureStore.getOrBuild("training_data", {
+        "form_window": FORM_WINDOW,
+        "head_to_head_window": HEAD_TO_HEAD_WINDOW,
+        "sample_size": sampleSize,
+    }, build)
+    features = pd.DataFrame(arrays["features"], columns=metadata["columns"])
+    labels = pd.Series(arrays["labels"], name="label")
+    return features, labels
 
-    matchFeatures = trainingMatchData.apply(lambda match: getFeaturesFromMatches(match, trainingMatchData), axis=1)
-    leagueIdFeatures = pd.get_dummies(matchFeatures['league_id']).rename(
-        columns=lambda leagueId: "League_{}".format(str(leagueId))
-    )
-    matchFeatures = pd.concat([matchFeatures, leagueIdFeatures], axis=1)
-    matchFeatures.drop(["league_id"], inplace=True, axis=1)
-
-    matchResults = trainingMatchData.apply(
-        dataAggregator.matchDataHelper.getMatchResult, axis=1)
-    
-    features = pd.merge(
-        matchFeatures, playerRatingsData,
-        on="match_api_id", how="left"
-    )
-    features = pd.merge(
-        features, matchResults,
-        on="match_api_id", how="left"
-    )
-    features.dropna(inplace=True)
 
-    labels = features.loc[:, "label"]
-    features = features.drop("match_api_id", axis=1)
-    features = features.drop("label", axis=1)
-    xTrain, xTest, yTrain, yTest = model_selection.train_test_split(
-        features, labels
-    )
-
-    adaboostClassifier = AdaBoostClassifier(
-        n_estimators = 200, random_state = 2)
-    gaussianNBClassifier = GaussianNB()
-    kNeighborsClassifier =  KNeighborsClassifier()
-    logisticRegressionClassifier = linear_model.LogisticRegression(
-        multi_class = "ovr", solver = "sag", class_weight = 'balanced')
-
-    classifiers = [
-        adaboostClassifier,
-        gaussianNBClassifier,
-        kNeighborsClassifier,
-        logisticRegressionClassifier
-    ]
-
-    classifierNames = []
-    trainAccuracies = []
-    testAccuracies = []
-    for classifier in classifiers:
-        classifier.fit(xTrain, yTrain)
-        classifierName = classifier.__class__.__name__
-        trainAccuracy = accuracy_score(yTrain, classifier.predict(xTrain))
-        testAccuracy = accuracy_score(yTest, classifier.predict(xTest))
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="Worker processes, all cores by default")
+    parser.add_argument("--folds", type=int, default=None,
+                        help="Cross validation folds instead of one split")
+    parser.add_argument("--instrumentation-report", metavar="PATH",
+                        help="Write per stage timings, rows and memory to "
+                             "PATH and a Chrome trace next to it")
+    parser.add_argument("--profile-stage", metavar="NAME",
+                        help="Also profile every run of this stage, e.g. "
+                             "TeamFormFeatureEngine.getFeatures")
+    parser.add_argument("--profile-mode", choices=PROFILE_MODES,
+                        default="sampling",
+                        help="sampling writes a flame graph, cprofile a "
+                             "pstats file")
+    args = parser.parse_args()
+    if args.instrumentation_report:
+        instrumentation.enable(args.profile_stage, args.profile_mode)
+
+    database = EuropeanSoccerDatabase()
+    dataAggregator = MatchResultPredictDataAggregator(database)
+    features, labels = getTrainingData(
+        dataAggregator, FeatureStore(database.databaseName))
+
+    report = evaluateClassifiers(
+        getDefaultClassifiers(), features, labels,
+        folds=args.folds, nJobs=args.jobs)
+    summary = summarizeReport(report)
+    for classifierName, scores in summary.iterrows():
         print(
             "Accuracy of {} for training set: {:.4f}.".format(
-                classifierName, trainAccuracy
+                classifierName, scores.train_accuracy
             )
         )
         print(
             "Accuracy of {} for test set: {:.4f}.".format(
-                classifierName, testAccuracy
+                classifierName, scores.test_accuracy
+            )
+        )
+        print(
+            "Fit {:.3f}s, predict {:.3f}s per fold.".format(
+                scores.fit_seconds, scores.predict_seconds
             )
         )
 
-        classifierNames.append(classifierName)
-        trainAccuracies.append(trainAccuracy)
-        testAccuracies.append(testAccuracy)
-    
-    plotAccuracyComparison(classifierNames, trainAccuracies, testAccuracies)
+    plotAccuracyComparison(report)
+    if args.instrumentation_report:
+        instrumentation.disable()
+        for path in instrumentation.writeReport(args.instrumentation_report):
+            print("Wrote {}".format(path))
@@ -0,0 +1,382 @@
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from data_aggregator import (LINEUP_COLUMNS, EuropeanSoccerDatabase,
+                             MatchResultPredictDataAggregator)
+from elo_ratings import ELO_AFTER_COLUMNS, ELO_COLUMNS, EloRatingEngine
+from feature_engine import TeamFormFeatureEngine
+from scoring import loadModel
+from training_matrix import buildFeatureMatrix
+
+HOME_PLAYER_COLUMNS = ["home_player_{}".format(i) for i in range(1, 12)]
+AWAY_PLAYER_COLUMNS = ["away_player_{}".format(i) for i in range(1, 12)]
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found",
+                500: "Internal Server Error"}
+
+
+class MatchPredictor(object):
+    # Keeps the model, the team-form timeline and the player-rating index in
+    # memory. A fixture is scored like a played match: team form and head to
+    # head over the matches before its date, and each team fielding the
+    # lineup and carrying the Elo rating of its last match before that date.
+
+    def __init__(self, dataAggregator, classifier, schema):
+        self.classifier = classifier
+        self.schema = schema
+        dataAggregator.loadTables(["Match", "Player_Attributes"])
+        self.history = dataAggregator.matchData.dropna(subset=LINEUP_COLUMNS)
+        self.engine = TeamFormFeatureEngine(self.history)
+        self.ratingHelper = dataAggregator.playerAttributeDataHelper
+        self.ratingHelper.buildRatingIndex()
+        self.homeLineups = self.history[HOME_PLAYER_COLUMNS].to_numpy(
+            dtype=np.float64)
+        self.awayLineups = self.history[AWAY_PLAYER_COLUMNS].to_numpy(
+            dtype=np.float64)
+        self.leagueIds = self.history.league_id.to_numpy(dtype=np.float64)
+        self.eloRatings = EloRatingEngine().update(self.history)[
+            ELO_AFTER_COLUMNS].to_numpy()
+
+    def getLatestLineups(self, teamIds, dates):
+        # Lineup and post-match Elo rating of each team's last match
+        rows, isHome = self.engine.getLastMatchRows(teamIds, dates)
+        lineups = np.where(isHome[:, None], self.homeLineups[rows],
+                           self.awayLineups[rows])
+        eloRatings = np.where(isHome, self.eloRatings[rows, 0],
+                              self.eloRatings[rows, 1])
+        return rows, lineups, eloRatings
+
+    def predictFixtures(self, fixtures):
+        # fixtures is a list of (home team id, away team id, date). Returns
+        # the class probabilities of every fixture, or the error message of
+        # the ones that cannot be scored.
+        frame = pd.DataFrame(fixtures, columns=[
+            "home_team_api_id", "away_team_api_id", "date"])
+        dates = pd.to_datetime(frame.date).to_numpy().astype(np.int64)
+        homeRows, homeLineups, homeElo = self.getLatestLineups(
+            frame.home_team_api_id, dates)
+        awayRows, awayLineups, awayElo = self.getLatestLineups(
+            frame.away_team_api_id, dates)
+        known = (homeRows >= 0) & (awayRows >= 0)
+
+        frame["match_api_id"] = 0
+        frame["league_id"] = self.leagueIds[homeRows]
+        frame[HOME_PLAYER_COLUMNS] = homeLineups
+        frame[AWAY_PLAYER_COLUMNS] = awayLineups
+        frame[ELO_COLUMNS] = np.column_stack([homeElo, awayElo])
+        frame = frame[known]
+        probabilities = np.empty((0, len(self.schema["classes"])))
+        if len(frame):
+            features = buildFeatureMatrix(
+                frame, self.engine.getFixtureFeatures(frame), frame,
+                self.ratingHelper)
+            # Players without a rating before the fixture count as 0
+            probabilities = self.classifier.predict_proba(
+                np.nan_to_num(features, copy=False))
+
+        results = []
+        scored = iter(probabilities)
+        for (homeTeamId, awayTeamId, _), homeRow, awayRow in zip(
+                fixtures, homeRows, awayRows):
+            if homeRow < 0 or awayRow < 0:
+                results.append(ValueError(
+                    "No match of team {} before the fixture date".format(
+                        homeTeamId if homeRow < 0 else awayTeamId)))
+            else:
+                results.append(dict(zip(
+                    self.schema["classes"], next(scored).tolist())))
+        return results
+
+
+class MicroBatcher(object):
+    # Collects concurrent requests for up to maxDelay seconds or maxBatchSize
+    # items and scores them with a single batch call. Batches run one at a
+    # time on a worker thread, so the event loop keeps accepting requests
+    # (and filling the next batch) while the model is busy.
+
+    def __init__(self, predictBatch, maxBatchSize=64, maxDelay=0.002):
+        self.predictBatch = predictBatch
+        self.maxBatchSize = maxBatchSize
+        self.maxDelay = maxDelay
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.queue = None
+        self.task = None
+        self.batchSizes = []
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self.task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.executor.shutdown(wait=True)
+
+    async def submit(self, item):
+        future = asyncio.get_event_loop().create_future()
+        await self.queue.put((item, future))
+        return await future
+
+    async def getBatch(self):
+        loop = asyncio.get_event_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.maxDelay
+        while len(batch) < self.maxBatchSize:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = await self.getBatch()
+            self.batchSizes.append(len(batch))
+            try:
+                results = await loop.run_in_executor(
+                    self.executor, self.predictBatch,
+                    [item for item, _ in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+
+class PredictionServer(object):
+    # Minimal HTTP/1.1 server with keep-alive on top of asyncio streams:
+    #   GET /predict?home=<team_api_id>&away=<team_api_id>[&date=YYYY-MM-DD]
+    #   GET /health
+
+    def __init__(self, predictor, maxBatchSize=64, maxDelay=0.002):
+        self.batcher = MicroBatcher(
+            predictor.predictFixtures, maxBatchSize, maxDelay)
+        self.server = None
+
+    async def start(self, host="127.0.0.1", port=8000):
+        await self.batcher.start()
+        self.server = await asyncio.start_server(
+            self.handleConnection, host, port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        await self.batcher.stop()
+
+    async def serveForever(self, host, port):
+        host, port = await self.start(host, port)
+        print("Serving predictions on http://{}:{}".format(host, port))
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def handleConnection(self, reader, writer):
+        try:
+            while True:
+                requestLine = await reader.readline()
+                if not requestLine:
+                    break
+                headers = dict()
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                contentLength = int(headers.get("content-length", 0))
+                if contentLength:
+                    await reader.readexactly(contentLength)
+
+                parts = requestLine.decode("latin-1").split()
+                status, body = await self.handleRequest(
+                    parts[0] if parts else "", parts[1] if len(parts) > 1
+                    else "")
+                keepAlive = headers.get("connection", "").lower() != "close"
+                payload = json.dumps(body).encode("utf-8")
+                writer.write(
+                    "HTTP/1.1 {} {}\r\nContent-Type: application/json\r\n"
+                    "Content-Length: {}\r\nConnection: {}\r\n\r\n".format(
+                        status, HTTP_REASONS[status], len(payload),
+                        "keep-alive" if keepAlive else "close")
+                    .encode("latin-1") + payload)
+                await writer.drain()
+                if not keepAlive:
+                    break
+        except (ConnectionResetError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def handleRequest(self, method, target):
+        url = urlsplit(target)
+        if method != "GET":
+            return 400, {"error": "Only GET is supported"}
+        if url.path == "/health":
+            return 200, {"status": "ok"}
+        if url.path != "/predict":
+            return 404, {"error": "Unknown path {}".format(url.path)}
+
+        query = parse_qs(url.query)
+        try:
+            homeTeamId = int(query["home"][0])
+            awayTeamId = int(query["away"][0])
+            date = pd.Timestamp(query.get("date", [None])[0] or
+                                pd.Timestamp.now().normalize())
+        except (KeyError, ValueError) as e:
+            return 400, {"error": "Bad query: {}".format(e)}
+        try:
+            probabilities = await self.batcher.submit(
+                (homeTeamId, awayTeamId, date))
+        except ValueError as e:
+            return 404, {"error": str(e)}
+        except Exception as e:
+            return 500, {"error": str(e)}
+        return 200, {
+            "home_team_api_id": homeTeamId,
+            "away_team_api_id": awayTeamId,
+            "date": date.strftime("%Y-%m-%d"),
+            "probabilities": probabilities,
+        }
+
+
+def getBenchmarkFixtures(history, count, seed=0):
+    # Random pairings of teams from the history, dated a week after its
+    # last match
+    random = np.random.RandomState(seed)
+    rows = random.randint(0, len(history), count)
+    date = pd.to_datetime(history.date).max() + pd.Timedelta(days=7)
+    return [(int(home), int(away), date.strftime("%Y-%m-%d"))
+            for home, away in zip(
+                history.home_team_api_id.to_numpy()[rows],
+                history.away_team_api_id.to_numpy()[
+                    random.permutation(rows)])]
+
+
+async def runClient(host, port, fixtures, latencies):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for homeTeamId, awayTeamId, date in fixtures:
+            start = time.perf_counter()
+            writer.write(
+                "GET /predict?home={}&away={}&date={} HTTP/1.1\r\n"
+                "Host: {}\r\n\r\n".format(
+                    homeTeamId, awayTeamId, date, host).encode("latin-1"))
+            await writer.drain()
+            contentLength = 0
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                if line.lower().startswith(b"content-length:"):
+                    contentLength = int(line.split(b":")[1])
+            await reader.readexactly(contentLength)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+
+async def runBenchmark(host, port, fixtures, concurrency):
+    # Closed loop load: concurrency keep-alive clients, each sending its
+    # share of the fixtures one request after the other
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        runClient(host, port, fixtures[client::concurrency], latencies)
+        for client in range(concurrency)])
+    seconds = time.perf_counter() - start
+    latencies = np.array(latencies) * 1000
+    return {
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "seconds": seconds,
+        "throughput_rps": len(latencies) / seconds,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+    }
+
+
+async def benchmarkInProcess(predictor, fixtures, concurrency, maxBatchSize,
+                             maxDelay):
+    server = PredictionServer(predictor, maxBatchSize, maxDelay)
+    host, port = await server.start("127.0.0.1", 0)
+    try:
+        report = await runBenchmark(host, port, fixtures, concurrency)
+    finally:
+        await server.stop()
+    report["max_batch_size"] = maxBatchSize
+    report["mean_batch_size"] = float(np.mean(server.batcher.batchSizes))
+    return report
+
+
+def loadPredictor():
+    classifier, schema = loadModel()
+    dataAggregator = MatchResultPredictDataAggregator(EuropeanSoccerDatabase())
+    return MatchPredictor(dataAggregator, classifier, schema)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    serveParser = commands.add_parser(
+        "serve", help="Serve predictions over HTTP")
+    serveParser.add_argument("--host", default="127.0.0.1")
+    serveParser.add_argument("--port", type=int, default=8000)
+    benchmarkParser = commands.add_parser(
+        "benchmark", help="Measure latency and throughput under load")
+    benchmarkParser.add_argument(
+        "--host", default=None,
+        help="Benchmark a running server, an in-process one by default")
+    benchmarkParser.add_argument("--port", type=int, default=8000)
+    benchmarkParser.add_argument("--concurrency", type=int, default=32)
+    benchmarkParser.add_argument("--requests", type=int, default=2000)
+    for commandParser in [serveParser, benchmarkParser]:
+        commandParser.add_argument("--max-batch-size", type=int, default=64)
+        commandParser.add_argument("--max-delay-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    predictor = loadPredictor()
+    print("Loaded model and {} matches in {:.1f}s".format(
+        len(predictor.history), time.perf_counter() - start))
+    maxDelay = args.max_delay_ms / 1000
+    if args.command == "serve":
+        server = PredictionServer(predictor, args.max_batch_size, maxDelay)
+        try:
+            asyncio.run(server.serveForever(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+    else:
+        fixtures = getBenchmarkFixtures(predictor.history, args.requests)
+        if args.host is not None:
+            reports = [asyncio.run(runBenchmark(
+                args.host, args.port, fixtures, args.concurrency))]
+        else:
+            # Unbatched baseline first, then with micro-batching
+            reports = [asyncio.run(benchmarkInProcess(
+                predictor, fixtures, args.concurrency, maxBatchSize, maxDelay))
+                for maxBatchSize in sorted({1, args.max_batch_size})]
+        print(pd.DataFrame(reports).to_string(index=False))
@@ -0,0 +1,152 @@
+import argparse
+import csv
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from chunked_features import getChunkMatrix, iterChunkFeatures
+from data_aggregator import (EuropeanSoccerDatabase,
+                             MatchResultPredictDataAggregator)
+from feature_engine import FEATURE_VERSION
+from model_evaluation import getDefaultClassifiers
+from predict import buildTrainingData
+from sharded_features import buildShardedTrainingMatrix
+from shared.constants import MODEL_PATH, RESOURCES_DIR
+from training_matrix import LABEL_CLASSES, TRAINING_COLUMNS
+from utils.db_helper import SqliteHelper
+
+MODEL_FILE = os.path.join(MODEL_PATH, "match_result_model.joblib")
+SCHEMA_FILE = os.path.join(MODEL_PATH, "match_result_schema.json")
+PREDICTION_FILE = os.path.join(RESOURCES_DIR, "prediction.csv")
+
+
+def trainModel(dataAggregator, classifierName="LogisticRegression",
+               sampleSize=None, modelFile=MODEL_FILE, schemaFile=SCHEMA_FILE,
+               featureJobs=None):
+    # With featureJobs, the features of a full run are built by league
+    # shards on that many processes
+    import joblib
+    from sklearn.base import clone
+
+    classifiers = {classifier.__class__.__name__: classifier
+                   for classifier in getDefaultClassifiers()}
+    if featureJobs and sampleSize is None:
+        features, labels, _ = buildShardedTrainingMatrix(
+            dataAggregator.database.databaseName, featureJobs)
+        features = pd.DataFrame(features, columns=TRAINING_COLUMNS,
+                                copy=False)
+        labels = pd.Series(labels, name="label")
+    else:
+        features, labels = buildTrainingData(dataAggregator, sampleSize)
+    classifier = clone(classifiers[classifierName])
+    classifier.fit(features.to_numpy(), labels.to_numpy())
+
+    os.makedirs(os.path.dirname(modelFile), exist_ok=True)
+    joblib.dump(classifier, modelFile)
+    schema = {
+        "classifier": classifierName,
+        "feature_version": FEATURE_VERSION,
+        "columns": list(features.columns),
+        "classes": [LABEL_CLASSES[code] for code in classifier.classes_],
+        "training_rows": int(len(features)),
+    }
+    with open(schemaFile, "w") as f:
+        json.dump(schema, f, indent=2)
+    return classifier, schema
+
+
+def loadModel(modelFile=MODEL_FILE, schemaFile=SCHEMA_FILE):
+    import joblib
+
+    with open(schemaFile) as f:
+        schema = json.load(f)
+    if schema["feature_version"] != FEATURE_VERSION:
+        raise ValueError(
+            "Model was trained with feature version {}, current is {}. "
+            "Run the train step again.".format(
+                schema["feature_version"], FEATURE_VERSION))
+    if schema["columns"] != TRAINING_COLUMNS:
+        raise ValueError("Model columns do not match TRAINING_COLUMNS. "
+                         "Run the train step again.")
+    return joblib.load(modelFile), schema
+
+
+def scoreMatches(dataAggregator, classifier, schema, matchIds=None,
+                 predictionFile=PREDICTION_FILE, memoryBudget=256 * 2 ** 20):
+    # Writes one prediction row per scored match in the 12 column layout
+    # read by visualization/dashboard.py, in date order. The probabilities
+    # follow the order of schema["classes"]. The history is streamed from
+    # the database in chunks sized by memoryBudget, so memory stays flat
+    # whatever the size of the database. The stream gets its own plain
+    # connection, the pooled readers sort in memory.
+    leagueDataHelper = dataAggregator.leagueDataHelper
+    teamDataHelper = dataAggregator.teamDataHelper
+    temporaryFile = "{}.tmp".format(predictionFile)
+    scored = 0
+    database = SqliteHelper()
+    database.connect(dataAggregator.database.databaseName, readOnly=True)
+    try:
+        with open(temporaryFile, "w", newline="") as f:
+            writer = csv.writer(f, lineterminator="\n")
+            for matches, features in iterChunkFeatures(database, memoryBudget):
+                chunk, labels, chunkIds = getChunkMatrix(matches, features)
+                keep = np.ones(len(chunkIds), dtype=bool) if matchIds is None \
+                    else np.isin(chunkIds, matchIds)
+                if not keep.any():
+                    continue
+                probabilities = classifier.predict_proba(chunk[keep])
+                matches = matches[matches.match_api_id.isin(chunkIds[keep])]
+                writer.writerows(zip(
+                    chunkIds[keep].astype(np.float64),
+                    np.array(LABEL_CLASSES)[labels[keep]], *probabilities.T,
+                    leagueDataHelper.getNamesByIds(matches.league_id),
+                    teamDataHelper.getLongTeamNamesByApiIds(
+                        matches.home_team_api_id),
+                    teamDataHelper.getLongTeamNamesByApiIds(
+                        matches.away_team_api_id),
+                    matches.home_team_goal, matches.away_team_goal,
+                    matches.season.astype(str), matches.stage))
+                scored += int(keep.sum())
+    finally:
+        database.close()
+    os.replace(temporaryFile, predictionFile)
+    return scored
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    trainParser = commands.add_parser(
+        "train", help="Fit a classifier and persist it with its schema")
+    trainParser.add_argument("--classifier", default="LogisticRegression")
+    trainParser.add_argument("--sample-size", type=int, default=None)
+    trainParser.add_argument("--feature-jobs", type=int, default=None,
+                             help="Build the features on this many "
+                                  "processes, one league at a time")
+    scoreParser = commands.add_parser(
+        "score", help="Write predictions for fixtures with the saved model")
+    scoreParser.add_argument("--match-ids", type=int, nargs="*", default=None,
+                             help="Fixtures to score, all matches by default")
+    scoreParser.add_argument("--output", default=PREDICTION_FILE)
+    scoreParser.add_argument("--memory-budget-mb", type=int, default=256,
+                             help="Rough peak memory of the scored chunks "
+                                  "and the history streamed for them")
+    args = parser.parse_args()
+
+    dataAggregator = MatchResultPredictDataAggregator(EuropeanSoccerDatabase())
+    start = time.perf_counter()
+    if args.command == "train":
+        _, schema = trainModel(dataAggregator, args.classifier,
+                               args.sample_size, featureJobs=args.feature_jobs)
+        print("Trained {} on {} matches".format(
+            schema["classifier"], schema["training_rows"]))
+    else:
+        classifier, schema = loadModel()
+        scored = scoreMatches(
+            dataAggregator, classifier, schema, args.match_ids, args.output,
+            args.memory_budget_mb * 2 ** 20)
+        print("Scored {} matches into {}".format(scored, args.output))
+    print("Took {:.1f}s".format(time.perf_counter() - start))
@@ -0,0 +1,178 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from data_aggregator import (LINEUP_COLUMNS, PREDICT_SCHEMA,
+                             EuropeanSoccerDatabase,
+                             MatchResultPredictDataAggregator,
+                             PlayerAttributeDataHelper)
+from training_matrix import TRAINING_COLUMNS, buildTrainingMatrix
+from utils.db_helper import PooledSqliteHelper
+from utils.instrumentation import instrumentation, instrumented
+
+
+def getLeagueGroups(database):
+    # Leagues that share a team have to be computed together, the form and
+    # Elo features of a team follow it across leagues. In the European
+    # Soccer Database every league is its own group.
+    leagueTeams = database.runQuery(
+        "SELECT DISTINCT league_id, home_team_api_id AS team_api_id "
+        "FROM Match UNION SELECT DISTINCT league_id, away_team_api_id "
+        "FROM Match;").dropna()
+    parents = dict()
+
+    def find(node):
+        while parents.setdefault(node, node) != node:
+            parents[node] = parents[parents[node]]
+            node = parents[node]
+        return node
+
+    for leagueId, teamId in zip(leagueTeams.league_id.astype(int),
+                                leagueTeams.team_api_id.astype(int)):
+        parents[find(("team", teamId))] = find(("league", leagueId))
+    groups = dict()
+    for node in list(parents):
+        if node[0] == "league":
+            groups.setdefault(find(node), []).append(node[1])
+    return sorted(sorted(leagueIds) for leagueIds in groups.values())
+
+
+def getShards(database, bySeason=False):
+    # One shard per league group, or per league group and season. A season
+    # shard replays the group's earlier matches as history, so its features
+    # equal those of a full run, and only keeps its own season's rows.
+    seasons = database.runQuery(
+        "SELECT league_id, season, COUNT(*) AS matches, "
+        "MAX(date) AS last_date FROM Match GROUP BY league_id, season;")
+    shards = []
+    for leagueIds in getLeagueGroups(database):
+        groupSeasons = seasons[seasons.league_id.isin(leagueIds)]
+        name = "leagues_{}".format("_".join(map(str, leagueIds)))
+        if not bySeason:
+            shards.append({"name": name, "league_ids": leagueIds,
+                           "season": None, "last_date": None,
+                           "matches": int(groupSeasons.matches.sum())})
+            continue
+        lastDates = groupSeasons.groupby("season").last_date.max()
+        for season, lastDate in lastDates.items():
+            shards.append({
+                "name": "{}_{}".format(name, season.replace("/", "-")),
+                "league_ids": leagueIds, "season": season,
+                "last_date": lastDate,
+                # Rows read, the cost of the shard
+                "matches": int(groupSeasons.matches[
+                    groupSeasons.last_date <= lastDate].sum()),
+            })
+    # Largest first, so that no big shard is left for the end
+    return sorted(shards, key=lambda shard: -shard["matches"])
+
+
+def buildShard(databaseName, shard, shardPath):
+    # Runs in a worker process with its own read only connection and writes
+    # the shard's feature matrix, labels and match ids as .npy files
+    start = time.perf_counter()
+    database = PooledSqliteHelper()
+    database.connect(databaseName)
+    dataAggregator = MatchResultPredictDataAggregator(database, PREDICT_SCHEMA)
+    condition = "league_id IN ({})".format(
+        ", ".join("?" * len(shard["league_ids"])))
+    params = list(shard["league_ids"])
+    if shard["last_date"] is not None:
+        condition += " AND date <= ?"
+        params.append(shard["last_date"])
+    matches = dataAggregator.loadTable(
+        "Match", condition=condition, params=params).dropna(
+            subset=LINEUP_COLUMNS)
+    # Ratings of the shard's players only, their ids passed as one JSON
+    # array parameter
+    playerIds = np.unique(matches[LINEUP_COLUMNS].to_numpy(dtype=np.int64))
+    playerAttributes = dataAggregator.loadTable(
+        "Player_Attributes",
+        condition="player_api_id IN (SELECT value FROM json_each(?))",
+        params=[json.dumps(playerIds.tolist())])
+    features, labels, matchIds = buildTrainingMatrix(
+        matches, PlayerAttributeDataHelper(playerAttributes))
+    if shard["season"] is not None:
+        keep = np.isin(matchIds, matches.match_api_id[
+            matches.season == shard["season"]].to_numpy(dtype=np.int64))
+        features, labels, matchIds = \
+            features[keep], labels[keep], matchIds[keep]
+    database.closeAll()
+
+    prefix = os.path.join(shardPath, shard["name"])
+    np.save("{}.features.npy".format(prefix), features)
+    np.save("{}.labels.npy".format(prefix), labels)
+    np.save("{}.match_ids.npy".format(prefix), matchIds)
+    return {"name": shard["name"], "prefix": prefix, "rows": len(matchIds),
+            "seconds": time.perf_counter() - start}
+
+
+def mergeShards(results, outputFile=None):
+    # Gathers the shards in match_api_id order, one memory-mapped shard at a
+    # time. The features go to a .npy memory map when outputFile is given.
+    matchIds = np.concatenate([
+        np.load("{}.match_ids.npy".format(result["prefix"]))
+        for result in results]) if results else np.empty(0, dtype=np.int64)
+    order = np.argsort(matchIds, kind="mergesort")
+    positions = np.empty(len(order), dtype=np.int64)
+    positions[order] = np.arange(len(order))
+    shape = (len(matchIds), len(TRAINING_COLUMNS))
+    if outputFile is None:
+        features = np.empty(shape, dtype=np.float32)
+    else:
+        features = np.lib.format.open_memmap(
+            outputFile, mode="w+", dtype=np.float32, shape=shape)
+    labels = np.empty(len(matchIds), dtype=np.int8)
+    offset = 0
+    for result in results:
+        rows = positions[offset:offset + result["rows"]]
+        features[rows] = np.load("{}.features.npy".format(result["prefix"]),
+                                 mmap_mode="r")
+        labels[rows] = np.load("{}.labels.npy".format(result["prefix"]))
+        offset += result["rows"]
+    return features, labels, matchIds[order]
+
+
+@instrumented()
+def buildShardedTrainingMatrix(databaseName, jobs=None, bySeason=False,
+                               outputFile=None):
+    # buildTrainingMatrix over every complete match of the database, one
+    # worker process per shard, in match_api_id order
+    from joblib import Parallel, delayed
+
+    database = PooledSqliteHelper()
+    database.connect(databaseName)
+    shards = getShards(database, bySeason)
+    database.closeAll()
+    with tempfile.TemporaryDirectory() as shardPath:
+        results = Parallel(n_jobs=jobs or -1)(
+            delayed(buildShard)(databaseName, shard, shardPath)
+            for shard in shards)
+        # The shards ran in worker processes, their timings come back here
+        for result in results:
+            instrumentation.record("buildShard", result["seconds"],
+                                   result["rows"])
+        return mergeShards(results, outputFile)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="Worker processes, all cores by default")
+    parser.add_argument("--by-season", action="store_true",
+                        help="One shard per league and season instead of "
+                             "per league, for more cores than leagues")
+    parser.add_argument("--output", default=None,
+                        help="Write the feature matrix to this .npy file")
+    args = parser.parse_args()
+
+    databaseName = EuropeanSoccerDatabase().databaseName
+    start = time.perf_counter()
+    features, labels, matchIds = buildShardedTrainingMatrix(
+        databaseName, args.jobs, args.by_season, args.output)
+    print("Built {} x {} features in {:.2f}s".format(
+        features.shape[0], features.shape[1], time.perf_counter() - start))
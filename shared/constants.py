@@ -2,6 +2,9 @@ import os
 
 DATASET_PATH = "datasets"
 EUROPEAN_SOCCER_DATABASE = "database.sqlite"
+FEATURE_STORE_PATH = os.path.join(DATASET_PATH, "feature_store")
+MODEL_PATH = os.path.join(DATASET_PATH, "models")
+ASSET_CACHE_PATH = os.path.join(DATASET_PATH, "asset_cache")
 
 # You might want to change this constants if you are changing project structure
 ROOT_DIR = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
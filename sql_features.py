@@ -0,0 +1,176 @@
+import argparse
+import logging
+import sqlite3
+import sys
+
+import numpy as np
+import pandas as pd
+
+from data_aggregator import (LINEUP_COLUMNS, EuropeanSoccerDatabase,
+                             MatchResultPredictDataAggregator)
+from feature_engine import (FEATURE_COLUMNS, FORM_WINDOW, HEAD_TO_HEAD_WINDOW,
+                            TeamFormFeatureEngine)
+
+# Supporting indexes for the per-team timeline, see createMatchIndexes
+MATCH_INDEXES = {
+    "idx_match_home_team_date": ["home_team_api_id", "date"],
+    "idx_match_away_team_date": ["away_team_api_id", "date"],
+    "idx_match_match_api_id": ["match_api_id"],
+}
+
+TEAM_FORM_QUERY = """
+WITH team_timeline AS (
+    SELECT match_api_id, date, home_team_api_id AS team_api_id,
+           away_team_api_id AS opponent_api_id, home_team_goal AS goals_for,
+           away_team_goal AS goals_against, 1 AS is_home
+    FROM Match {where}
+    UNION ALL
+    SELECT match_api_id, date, away_team_api_id, home_team_api_id,
+           away_team_goal, home_team_goal, 0
+    FROM Match {where}
+), numbered AS (
+    SELECT *, ROW_NUMBER() OVER (
+        PARTITION BY team_api_id ORDER BY date, match_api_id) AS position
+    FROM team_timeline
+), windowed AS (
+    SELECT match_api_id, is_home,
+           SUM(goals_for) OVER last_matches AS goals_for,
+           SUM(goals_against) OVER last_matches AS goals_against,
+           SUM(goals_for > goals_against) OVER last_matches AS wins,
+           SUM(goals_for) OVER (
+               PARTITION BY team_api_id, opponent_api_id ORDER BY position
+               RANGE BETWEEN {limit} PRECEDING AND 1 PRECEDING
+           ) AS goals_for_against_opponent
+    FROM numbered
+    WINDOW last_matches AS (
+        PARTITION BY team_api_id ORDER BY position
+        ROWS BETWEEN {limit} PRECEDING AND 1 PRECEDING)
+), meetings AS (
+    SELECT match_api_id,
+           MIN(home_team_api_id, away_team_api_id) AS lower_team_api_id,
+           MAX(home_team_api_id, away_team_api_id) AS higher_team_api_id,
+           CASE WHEN home_team_goal > away_team_goal THEN home_team_api_id
+                WHEN home_team_goal < away_team_goal THEN away_team_api_id
+           END AS winner_api_id,
+           date
+    FROM Match {where}
+), head_to_head AS (
+    SELECT match_api_id,
+           SUM(winner_api_id = lower_team_api_id) OVER last_meetings
+               AS lower_team_wins,
+           SUM(winner_api_id = higher_team_api_id) OVER last_meetings
+               AS higher_team_wins
+    FROM meetings
+    WINDOW last_meetings AS (
+        PARTITION BY lower_team_api_id, higher_team_api_id
+        ORDER BY date, match_api_id
+        ROWS BETWEEN {againstLimit} PRECEDING AND 1 PRECEDING)
+)
+SELECT m.match_api_id, m.league_id,
+       COALESCE(MAX(CASE WHEN w.is_home THEN w.goals_for END), 0) -
+       COALESCE(MAX(CASE WHEN w.is_home THEN w.goals_against END), 0)
+           AS home_team_goals_difference,
+       COALESCE(MAX(CASE WHEN NOT w.is_home THEN w.goals_for END), 0) -
+       COALESCE(MAX(CASE WHEN NOT w.is_home
+                         THEN w.goals_for_against_opponent END), 0)
+           AS away_team_goals_difference,
+       COALESCE(MAX(CASE WHEN w.is_home THEN w.wins END), 0)
+           AS games_won_home_team,
+       COALESCE(MAX(CASE WHEN NOT w.is_home THEN w.wins END), 0)
+           AS games_won_away_team,
+       COALESCE(MAX(CASE WHEN m.home_team_api_id < m.away_team_api_id
+                         THEN h.lower_team_wins
+                         ELSE h.higher_team_wins END), 0)
+           AS games_against_won,
+       COALESCE(MAX(CASE WHEN m.home_team_api_id < m.away_team_api_id
+                         THEN h.higher_team_wins
+                         ELSE h.lower_team_wins END), 0)
+           AS games_against_lost
+FROM Match m
+JOIN windowed w ON w.match_api_id = m.match_api_id
+JOIN head_to_head h ON h.match_api_id = m.match_api_id
+{where}
+GROUP BY m.match_api_id
+ORDER BY m.match_api_id
+"""
+
+
+class SqliteTeamFormFeatureBackend(object):
+    # Computes the TeamFormFeatureEngine features inside SQLite with window
+    # functions over a per-team UNION of the Match table, so only the result
+    # rows ever reach Python. The windows are row based, which matches the
+    # pandas path as long as a team plays at most once per date.
+
+    def __init__(self, database, limit=FORM_WINDOW,
+                 againstLimit=HEAD_TO_HEAD_WINDOW, requireLineups=True):
+        self.database = database
+        self.limit = int(limit)
+        self.againstLimit = int(againstLimit)
+        self.requireLineups = requireLineups
+
+    def getQuery(self):
+        where = ""
+        if self.requireLineups:
+            where = "WHERE " + " AND ".join(
+                "{} IS NOT NULL".format(column) for column in LINEUP_COLUMNS)
+        return TEAM_FORM_QUERY.format(
+            where=where, limit=self.limit, againstLimit=self.againstLimit)
+
+    def iterFeatures(self, chunkSize=50000):
+        for chunk in self.database.iterQuery(
+                self.getQuery(), chunkSize=chunkSize):
+            yield chunk.astype(np.float64)[FEATURE_COLUMNS]
+
+    def getFeatures(self, chunkSize=50000):
+        chunks = list(self.iterFeatures(chunkSize))
+        if not chunks:
+            return pd.DataFrame(columns=FEATURE_COLUMNS, dtype=np.float64)
+        return pd.concat(chunks, ignore_index=True)
+
+
+def createMatchIndexes(databaseName):
+    # Adds MATCH_INDEXES to the database file through its own writable
+    # connection. Only ever run on request: it changes the file, and so the
+    # key of every feature store entry built from it.
+    connection = sqlite3.connect(databaseName)
+    try:
+        for name, columns in MATCH_INDEXES.items():
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS {} ON Match ({});".format(
+                    name, ", ".join(columns)))
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def checkParity(database, matches, limit=FORM_WINDOW,
+                againstLimit=HEAD_TO_HEAD_WINDOW):
+    # Compares the SQLite backend with the pandas engine on the same matches,
+    # returns the number of mismatching feature values
+    matches = matches.dropna(subset=LINEUP_COLUMNS)
+    expected = TeamFormFeatureEngine(
+        matches, limit=limit, againstLimit=againstLimit).getFeatures()
+    expected = expected.sort_values("match_api_id").reset_index(drop=True)
+    actual = SqliteTeamFormFeatureBackend(
+        database, limit=limit, againstLimit=againstLimit).getFeatures()
+    if expected.shape != actual.shape:
+        logging.error("Shape mismatch: pandas {} vs sqlite {}".format(
+            expected.shape, actual.shape))
+        return max(expected.size, actual.size)
+    return int((expected.to_numpy() != actual.to_numpy()).sum())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--create-indexes", action="store_true",
+                        help="Add the Match indexes the window queries use "
+                             "to the database file first")
+    args = parser.parse_args()
+
+    database = EuropeanSoccerDatabase()
+    if args.create_indexes:
+        createMatchIndexes(database.databaseName)
+    dataAggregator = MatchResultPredictDataAggregator(database)
+    mismatches = checkParity(database, dataAggregator.matchData)
+    print("Mismatching feature values: {}".format(mismatches))
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,81 @@
+import numpy as np
+
+from data_aggregator import RATING_COLUMNS
+from elo_ratings import ELO_COLUMNS, getEloFeatures
+from feature_engine import FEATURE_COLUMNS, TeamFormFeatureEngine
+from utils.instrumentation import instrumented
+
+# Leagues of the European Soccer Database. The one-hot columns always cover
+# all of them in this order, whichever leagues a dataset contains, so a
+# persisted model's columns never depend on the sample it was trained on.
+KNOWN_LEAGUE_IDS = np.array([1, 1729, 4769, 7809, 10257, 13274, 15722,
+                             17642, 19694, 21518, 24558], dtype=np.int64)
+LEAGUE_COLUMNS = ["League_{}".format(leagueId)
+                  for leagueId in KNOWN_LEAGUE_IDS]
+FORM_COLUMNS = [column for column in FEATURE_COLUMNS
+                if column not in ("match_api_id", "league_id")]
+TRAINING_COLUMNS = FORM_COLUMNS + ELO_COLUMNS + LEAGUE_COLUMNS + \
+    RATING_COLUMNS
+# Class of every int8 label code
+LABEL_CLASSES = ["Defeat", "Draw", "Win"]
+
+
+def getColumnSlice(columns):
+    start = TRAINING_COLUMNS.index(columns[0])
+    return slice(start, start + len(columns))
+
+
+@instrumented()
+def getLabelCodes(matches):
+    homeGoals = matches.home_team_goal.to_numpy()
+    awayGoals = matches.away_team_goal.to_numpy()
+    return np.select([homeGoals > awayGoals, homeGoals < awayGoals],
+                     [2, 0], 1).astype(np.int8)
+
+
+def writeLeagueColumns(out, leagueIds):
+    # One-hot LEAGUE_COLUMNS block of out, zero for unknown leagues
+    leagues = out[:, getColumnSlice(LEAGUE_COLUMNS)]
+    leagues[:] = 0
+    leagueIds = np.asarray(leagueIds, dtype=np.int64)
+    codes = np.minimum(np.searchsorted(KNOWN_LEAGUE_IDS, leagueIds),
+                       len(KNOWN_LEAGUE_IDS) - 1)
+    known = KNOWN_LEAGUE_IDS[codes] == leagueIds
+    leagues[np.flatnonzero(known), codes[known]] = 1
+    return out
+
+
+@instrumented()
+def writeFeatureMatrix(out, matches, formFeatures, eloFeatures, ratingHelper):
+    # Fills out, a (matches, TRAINING_COLUMNS) float32 array, block by block
+    # from the feature sources without building intermediate frames
+    out[:, getColumnSlice(FORM_COLUMNS)] = \
+        formFeatures[FORM_COLUMNS].to_numpy()
+    out[:, getColumnSlice(ELO_COLUMNS)] = eloFeatures[ELO_COLUMNS].to_numpy()
+    writeLeagueColumns(out, matches.league_id)
+    out[:, getColumnSlice(RATING_COLUMNS)] = \
+        ratingHelper.getPlayerRatingMatrix(matches)
+    return out
+
+
+def buildFeatureMatrix(matches, formFeatures, eloFeatures, ratingHelper):
+    return writeFeatureMatrix(
+        np.empty((len(matches), len(TRAINING_COLUMNS)), dtype=np.float32),
+        matches, formFeatures, eloFeatures, ratingHelper)
+
+
+@instrumented()
+def buildTrainingMatrix(matches, ratingHelper):
+    # Feature matrix, int8 labels and match ids of matches. Rows with a
+    # missing value, i.e. a player without any earlier rating, are dropped.
+    features = buildFeatureMatrix(
+        matches, TeamFormFeatureEngine(matches).getFeatures(),
+        getEloFeatures(matches), ratingHelper)
+    labels = getLabelCodes(matches)
+    matchIds = matches.match_api_id.to_numpy(dtype=np.int64)
+    complete = ~np.isnan(features).any(axis=1)
+    if not complete.all():
+        features = features[complete]
+        labels = labels[complete]
+        matchIds = matchIds[complete]
+    return features, labels, matchIds
@@ -1,10 +1,24 @@
 import logging
+import os
 import sqlite3
+import threading
 import traceback
 from abc import abstractmethod
+from urllib.request import pathname2url
 
+import numpy as np
 import pandas as pd
 
+from utils.instrumentation import instrumented
+
+# Applied to every pooled reader connection
+SQLITE_READER_PRAGMAS = {
+    "mmap_size": 256 * 2 ** 20,
+    "cache_size": -64 * 2 ** 10,
+    "temp_store": "MEMORY",
+    "query_only": "ON",
+}
+
 
 class DatabaseHelper(object):
 
@@ -16,21 +30,171 @@ class DatabaseHelper(object):
         pass
 
     @abstractmethod
-    def runQuery(self, query):
+    def runQuery(self, query, params=None):
         pass
 
 
 class SqliteHelper(DatabaseHelper):
 
-    def connect(self, database_name):
+    def __init__(self):
+        super().__init__()
+        self.databaseName = None
+        self.readOnly = False
+
+    def connect(self, database_name, readOnly=False, lazy=False):
+        # A lazy helper only remembers the database and opens the connection
+        # on its first query
+        self.databaseName = database_name
+        self.readOnly = readOnly
+        if lazy:
+            return True
         try:
-            self.connection = sqlite3.connect(database_name)
+            if readOnly:
+                # Readers may be closed by the thread that handed them out
+                self.connection = sqlite3.connect("file:{}?mode=ro".format(
+                    pathname2url(os.path.abspath(database_name))), uri=True,
+                    check_same_thread=False)
+            else:
+                self.connection = sqlite3.connect(database_name)
         except Exception:
             logging.error(traceback.format_exc())
             return False
         return True
 
-    def runQuery(self, query):
+    def openReader(self):
+        # Separate read only connection, e.g. for a loader thread
+        reader = SqliteHelper()
+        reader.connect(self.databaseName, readOnly=True)
+        return reader
+
+    def close(self):
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+
+    def getActiveConnection(self):
+        if not self.connection and self.databaseName:
+            self.connect(self.databaseName, self.readOnly)
         if not self.connection:
             logging.error("Database connection is not active")
-        return pd.read_sql(query, self.connection)
+        return self.connection
+
+    @instrumented()
+    def runQuery(self, query, params=None):
+        return pd.read_sql(query, self.getActiveConnection(), params=params)
+
+    def iterQuery(self, query, params=None, chunkSize=50000, asRecords=False):
+        # Streams the result as DataFrames, or NumPy record arrays, of at
+        # most chunkSize rows
+        cursor = self.getActiveConnection().execute(query, params or ())
+        try:
+            columns = [description[0] for description in cursor.description]
+            while True:
+                rows = cursor.fetchmany(chunkSize)
+                if not rows:
+                    break
+                if asRecords:
+                    yield np.rec.fromrecords(rows, names=columns)
+                else:
+                    yield pd.DataFrame.from_records(rows, columns=columns)
+        finally:
+            cursor.close()
+
+
+class PooledSqliteHelper(SqliteHelper):
+    # One read only connection per thread, opened on the thread's first
+    # query. Statements are prepared once per connection and reused from the
+    # sqlite3 statement cache, so parameterized point lookups stay cheap.
+    threadSafe = True
+
+    def __init__(self, pragmas=None, cachedStatements=256):
+        self.local = threading.local()
+        # Bumped by closeAll, a thread's connection from an earlier
+        # generation has been closed under it
+        self.generation = 0
+        self.connections = []
+        self.lock = threading.Lock()
+        self.pragmas = dict(SQLITE_READER_PRAGMAS, **(pragmas or {}))
+        self.cachedStatements = cachedStatements
+        super().__init__()
+
+    @property
+    def connection(self):
+        if getattr(self.local, "generation", None) != self.generation:
+            return None
+        return getattr(self.local, "connection", None)
+
+    @connection.setter
+    def connection(self, connection):
+        self.local.connection = connection
+        self.local.generation = self.generation
+
+    def connect(self, database_name, readOnly=True, lazy=True):
+        self.databaseName = database_name
+        self.readOnly = readOnly
+        if lazy:
+            return True
+        return self.getActiveConnection() is not None
+
+    def openConnection(self):
+        if self.readOnly:
+            connection = sqlite3.connect(
+                "file:{}?mode=ro".format(
+                    pathname2url(os.path.abspath(self.databaseName))),
+                uri=True, check_same_thread=False,
+                cached_statements=self.cachedStatements)
+        else:
+            connection = sqlite3.connect(
+                self.databaseName, check_same_thread=False,
+                cached_statements=self.cachedStatements)
+        for pragma, value in self.pragmas.items():
+            if pragma == "query_only" and not self.readOnly:
+                continue
+            connection.execute("PRAGMA {} = {};".format(pragma, value))
+        return connection
+
+    def getActiveConnection(self):
+        if self.connection is None and self.databaseName:
+            try:
+                self.connection = self.openConnection()
+            except Exception:
+                logging.error(traceback.format_exc())
+                return None
+            with self.lock:
+                self.closeFinishedThreads()
+                self.connections.append(
+                    (threading.current_thread(), self.connection))
+        return self.connection
+
+    def closeFinishedThreads(self):
+        # Connections were opened with check_same_thread=False only so that
+        # the ones left behind by finished threads can be closed here
+        alive = []
+        for thread, connection in self.connections:
+            if thread.is_alive():
+                alive.append((thread, connection))
+            else:
+                connection.close()
+        self.connections = alive
+
+    def openReader(self):
+        return self
+
+    def close(self):
+        # Closes the calling thread's connection only
+        connection = self.connection
+        if connection is not None:
+            with self.lock:
+                self.connections = [
+                    (thread, other) for thread, other in self.connections
+                    if other is not connection]
+            connection.close()
+            self.connection = None
+
+    def closeAll(self):
+        # Other threads open a new connection on their next query
+        with self.lock:
+            for _, connection in self.connections:
+                connection.close()
+            self.connections = []
+            self.generation += 1
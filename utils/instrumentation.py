@@ -0,0 +1,412 @@
+import atexit
+import cProfile
+import functools
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+
+# Setting PIPELINE_INSTRUMENTATION to a report path turns instrumentation on
+# for any entry point and writes the report when the process exits
+INSTRUMENTATION_ENV = "PIPELINE_INSTRUMENTATION"
+PROFILE_STAGE_ENV = "PIPELINE_PROFILE_STAGE"
+PROFILE_MODE_ENV = "PIPELINE_PROFILE_MODE"
+PROFILE_MODES = ["sampling", "cprofile"]
+SAMPLING_INTERVAL = 0.005
+MAX_TRACE_EVENTS = 200000
+FLAME_GRAPH_WIDTH = 1200
+FLAME_GRAPH_ROW_HEIGHT = 16
+
+
+def getCurrentMemory():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxRss if sys.platform == "darwin" else maxRss * 1024
+
+
+def getRowCount(value):
+    # Rows of a frame, array or sequence, the first element's rows for a
+    # tuple of arrays and None for scalars
+    if isinstance(value, tuple) and value:
+        value = value[0]
+    shape = getattr(value, "shape", None)
+    if shape is not None:
+        return int(shape[0]) if len(shape) else None
+    if isinstance(value, list):
+        return len(value)
+    return None
+
+
+def getFrameLabel(frame):
+    code = frame.f_code
+    return "{} ({}:{})".format(code.co_name, os.path.basename(
+        code.co_filename), code.co_firstlineno).replace(";", ",")
+
+
+class StackSampler(object):
+    # Samples the Python stack of the threads inside the profiled stage
+    # every interval seconds and counts them as folded stacks
+    # ("outer;...;inner"), the input of flame graph tools
+
+    def __init__(self, interval=SAMPLING_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.threadIds = Counter()
+        self.lock = threading.Lock()
+        self.stopEvent = threading.Event()
+        self.thread = None
+
+    def enter(self):
+        with self.lock:
+            self.threadIds[threading.get_ident()] += 1
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name="StackSampler", daemon=True)
+                self.thread.start()
+
+    def exit(self):
+        with self.lock:
+            self.threadIds[threading.get_ident()] -= 1
+            self.threadIds += Counter()
+
+    def run(self):
+        while not self.stopEvent.wait(self.interval):
+            with self.lock:
+                threadIds = list(self.threadIds)
+            frames = sys._current_frames()
+            for threadId in threadIds:
+                frame = frames.get(threadId)
+                labels = []
+                while frame is not None:
+                    labels.append(getFrameLabel(frame))
+                    frame = frame.f_back
+                if labels:
+                    self.stacks[";".join(reversed(labels))] += 1
+
+    def stop(self):
+        self.stopEvent.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def writeFolded(self, path):
+        with open(path, "w") as f:
+            f.writelines("{} {}\n".format(stack, count)
+                         for stack, count in sorted(self.stacks.items()))
+
+
+def writeFlameGraph(stacks, path, title="", width=FLAME_GRAPH_WIDTH,
+                    rowHeight=FLAME_GRAPH_ROW_HEIGHT):
+    # Self-contained SVG flame graph of folded stack counts, roots at the
+    # bottom, hover a frame for its full name and sample count
+    root = {"count": 0, "children": dict()}
+    for stack, count in stacks.items():
+        node = root
+        node["count"] += count
+        for label in stack.split(";"):
+            node = node["children"].setdefault(
+                label, {"count": 0, "children": dict()})
+            node["count"] += count
+
+    frames = []
+
+    def layout(node, x, depth):
+        for label, child in sorted(node["children"].items()):
+            frames.append((label, child["count"], x, depth))
+            layout(child, x, depth + 1)
+            x += child["count"]
+    layout(root, 0, 0)
+
+    total = max(root["count"], 1)
+    depth = max([frame[3] for frame in frames] + [0]) + 1
+    height = (depth + 2) * rowHeight
+    lines = [
+        '<svg xmlns="http://www.w3.org/2000/svg" width="{}" height="{}" '
+        'font-family="monospace" font-size="11">'.format(width, height),
+        '<text x="4" y="{}">{} ({} samples)</text>'.format(
+            rowHeight - 4, escapeXml(title), root["count"]),
+    ]
+    for label, count, x, level in frames:
+        frameWidth = width * count / total
+        if frameWidth < 0.5:
+            continue
+        y = height - (level + 1) * rowHeight
+        hue = zlib.crc32(label.encode("utf-8")) % 40
+        lines.append(
+            '<g><title>{} ({} samples, {:.1f}%)</title>'
+            '<rect x="{:.1f}" y="{}" width="{:.1f}" height="{}" '
+            'fill="hsl({},80%,60%)" stroke="white"/>'.format(
+                escapeXml(label), count, 100.0 * count / total,
+                width * x / total, y, frameWidth, rowHeight - 1, hue))
+        if frameWidth > 40:
+            lines.append('<text x="{:.1f}" y="{}">{}</text>'.format(
+                width * x / total + 3, y + rowHeight - 4,
+                escapeXml(label[:int(frameWidth / 7)])))
+        lines.append("</g>")
+    lines.append("</svg>")
+    with open(path, "w") as f:
+        f.write("\n".join(lines))
+
+
+def escapeXml(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(
+        ">", "&gt;")
+
+
+class Stage(object):
+    # One timed run of a stage, a context manager. rows may be set inside
+    # the block.
+
+    __slots__ = ("instrumentation", "name", "rows", "start", "memory",
+                 "childSeconds", "profiled")
+
+    def __init__(self, instrumentation, name, rows=None):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.rows = rows
+
+    def __enter__(self):
+        self.childSeconds = 0.0
+        self.profiled = self.instrumentation.startProfile(self.name)
+        self.instrumentation.getStack().append(self)
+        self.memory = getCurrentMemory() \
+            if self.instrumentation.trackMemory else 0
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        seconds = time.perf_counter() - self.start
+        memory = getCurrentMemory() - self.memory \
+            if self.instrumentation.trackMemory else 0
+        stack = self.instrumentation.getStack()
+        stack.pop()
+        if stack:
+            stack[-1].childSeconds += seconds
+        if self.profiled:
+            self.instrumentation.stopProfile()
+        self.instrumentation.record(
+            self.name, seconds, self.rows, memory,
+            seconds - self.childSeconds, self.start)
+        return False
+
+
+class NullStage(object):
+    # Stand-in while instrumentation is disabled
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        return False
+
+
+NULL_STAGE = NullStage()
+
+
+class PipelineInstrumentation(object):
+    # Aggregates wall time, self time, calls, rows and RSS delta per stage
+    # name and keeps a Chrome trace event per call (chrome://tracing,
+    # Perfetto). Optionally profiles every run of one stage, either with
+    # cProfile or by sampling stacks into a flame graph. Disabled, every
+    # hook costs one attribute check.
+
+    def __init__(self):
+        self.enabled = False
+        self.trackMemory = True
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.statistics = dict()
+        self.traceEvents = []
+        self.droppedTraceEvents = 0
+        self.startTime = time.perf_counter()
+        self.startMemory = getCurrentMemory()
+        self.profileStage = None
+        self.profileMode = None
+        self.profiler = None
+        self.sampler = None
+
+    def enable(self, profileStage=None, profileMode="sampling",
+               trackMemory=True):
+        if profileMode not in PROFILE_MODES:
+            raise ValueError("Unknown profile mode {}, expected one of {}"
+                             .format(profileMode, PROFILE_MODES))
+        self.reset()
+        self.trackMemory = trackMemory
+        self.profileStage = profileStage
+        self.profileMode = profileMode
+        if profileStage is not None and profileMode == "cprofile":
+            self.profiler = cProfile.Profile()
+        elif profileStage is not None:
+            self.sampler = StackSampler()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        if self.sampler is not None:
+            self.sampler.stop()
+
+    def getStack(self):
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def stage(self, name, rows=None):
+        if not self.enabled:
+            return NULL_STAGE
+        return Stage(self, name, rows)
+
+    def startProfile(self, name):
+        # Only the outermost run of the profiled stage on a thread is
+        # profiled, recursive and nested runs are already covered
+        if name != self.profileStage or any(
+                stage.name == name for stage in self.getStack()):
+            return False
+        if self.sampler is not None:
+            self.sampler.enter()
+            return True
+        if threading.current_thread() is not threading.main_thread():
+            # cProfile can only follow the thread that enabled it
+            return False
+        self.profiler.enable()
+        return True
+
+    def stopProfile(self):
+        if self.sampler is not None:
+            self.sampler.exit()
+        else:
+            self.profiler.disable()
+
+    def record(self, name, seconds, rows=None, memory=0, selfSeconds=None,
+               start=None):
+        # Also used for work timed elsewhere, e.g. in worker processes;
+        # those come without a start and are left out of the trace
+        if not self.enabled:
+            return
+        with self.lock:
+            statistics = self.statistics.get(name)
+            if statistics is None:
+                statistics = self.statistics[name] = {
+                    "calls": 0, "seconds": 0.0, "self_seconds": 0.0,
+                    "max_seconds": 0.0, "rows": 0, "rss_delta_bytes": 0}
+            statistics["calls"] += 1
+            statistics["seconds"] += seconds
+            statistics["self_seconds"] += \
+                seconds if selfSeconds is None else selfSeconds
+            statistics["max_seconds"] = max(statistics["max_seconds"],
+                                            seconds)
+            statistics["rows"] += rows or 0
+            statistics["rss_delta_bytes"] += memory
+            if start is None:
+                return
+            if len(self.traceEvents) >= MAX_TRACE_EVENTS:
+                self.droppedTraceEvents += 1
+                return
+            self.traceEvents.append({
+                "name": name, "ph": "X", "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "ts": round((start - self.startTime) * 1e6, 1),
+                "dur": round(seconds * 1e6, 1),
+                "args": {"rows": rows, "rss_delta_bytes": memory},
+            })
+
+    def getReport(self):
+        stages = dict()
+        with self.lock:
+            for name, statistics in self.statistics.items():
+                stage = dict(statistics)
+                for key in ["seconds", "self_seconds", "max_seconds"]:
+                    stage[key] = round(stage[key], 6)
+                stage["rss_delta_mb"] = round(
+                    stage.pop("rss_delta_bytes") / 2 ** 20, 2)
+                stages[name] = stage
+        return {
+            "wall_seconds": round(time.perf_counter() - self.startTime, 6),
+            "rss_delta_mb": round(
+                (getCurrentMemory() - self.startMemory) / 2 ** 20, 2),
+            "stages": dict(sorted(stages.items(),
+                                  key=lambda item: -item[1]["seconds"])),
+            "dropped_trace_events": self.droppedTraceEvents,
+        }
+
+    def writeReport(self, path):
+        # Writes the report to path and next to it the trace
+        # (<name>.trace.json) and the profile of the profiled stage:
+        # <name>.<stage>.prof for cProfile, <name>.<stage>.folded and .svg
+        # for sampling. Returns the written paths.
+        base = os.path.splitext(path)[0]
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.getReport(), f, indent=2)
+        tracePath = "{}.trace.json".format(base)
+        with self.lock:
+            traceEvents = list(self.traceEvents)
+        with open(tracePath, "w") as f:
+            json.dump({"traceEvents": traceEvents,
+                       "displayTimeUnit": "ms"}, f)
+        paths = [path, tracePath]
+        if self.profiler is not None:
+            profilePath = "{}.{}.prof".format(base, self.profileStage)
+            self.profiler.dump_stats(profilePath)
+            paths.append(profilePath)
+        if self.sampler is not None:
+            stacksPath = "{}.{}.folded".format(base, self.profileStage)
+            self.sampler.writeFolded(stacksPath)
+            flameGraphPath = "{}.{}.svg".format(base, self.profileStage)
+            writeFlameGraph(self.sampler.stacks, flameGraphPath,
+                            self.profileStage)
+            paths.extend([stacksPath, flameGraphPath])
+        return paths
+
+
+instrumentation = PipelineInstrumentation()
+
+
+def instrumented(name=None):
+    # Times every call of the decorated function as a stage named after
+    # its qualified name. Rows are those of the result, or of the first
+    # frame or array argument when the result is a scalar.
+    def decorate(function):
+        stageName = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not instrumentation.enabled:
+                return function(*args, **kwargs)
+            with Stage(instrumentation, stageName) as stage:
+                result = function(*args, **kwargs)
+                stage.rows = getRowCount(result)
+                for arg in args:
+                    if stage.rows is not None:
+                        break
+                    stage.rows = getRowCount(arg)
+            return result
+        return wrapper
+    return decorate
+
+
+def configureFromEnvironment():
+    path = os.environ.get(INSTRUMENTATION_ENV)
+    if not path:
+        return
+    instrumentation.enable(
+        os.environ.get(PROFILE_STAGE_ENV) or None,
+        os.environ.get(PROFILE_MODE_ENV) or "sampling")
+
+    def writeAtExit():
+        instrumentation.disable()
+        instrumentation.writeReport(path)
+    atexit.register(writeAtExit)
+
+
+configureFromEnvironment()
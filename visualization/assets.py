@@ -0,0 +1,150 @@
+import hashlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+sys.path.append(os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+from shared.constants import ASSET_CACHE_PATH, RESOURCES_DIR
+
+# Width of the dashboard's main column, wider images are only scaled down
+# by the browser
+DISPLAY_WIDTH = 700
+IMAGE_CACHE_BYTES = 64 * 2 ** 20
+TEAM_FORMATIONS_DIR = os.path.join(RESOURCES_DIR, "team_formations")
+HOME_FORMATION_SUFFIX = "_home.png"
+AWAY_FORMATION_SUFFIX = "_away.png"
+
+
+def getClubNames(formationsDir=TEAM_FORMATIONS_DIR):
+    # Clubs with both a home and an away formation image
+    fileNames = set(os.listdir(formationsDir))
+    return sorted(
+        fileName[:-len(HOME_FORMATION_SUFFIX)] for fileName in fileNames
+        if fileName.endswith(HOME_FORMATION_SUFFIX) and
+        fileName[:-len(HOME_FORMATION_SUFFIX)] + AWAY_FORMATION_SUFFIX
+        in fileNames)
+
+
+def getFormationPaths(clubName, formationsDir=TEAM_FORMATIONS_DIR):
+    return (os.path.join(formationsDir, clubName + HOME_FORMATION_SUFFIX),
+            os.path.join(formationsDir, clubName + AWAY_FORMATION_SUFFIX))
+
+
+class ImageAssetStore(object):
+    # Serves images at display size. Each source image is resized once to
+    # at most width pixels and saved as an optimized PNG under cachePath,
+    # named after the source path, mtime and width so an edited source gets
+    # a new variant. Variants are kept in memory in an LRU bounded by
+    # maxBytes, both as encoded bytes (what the browser is sent) and as
+    # decoded images, each accounted at its real size.
+
+    def __init__(self, cachePath=ASSET_CACHE_PATH, maxBytes=IMAGE_CACHE_BYTES,
+                 width=DISPLAY_WIDTH):
+        self.cachePath = cachePath
+        self.maxBytes = maxBytes
+        self.width = width
+        self.entries = OrderedDict()
+        self.cachedBytes = 0
+        self.lock = threading.Lock()
+
+    def getVariantPath(self, path, width):
+        stat = os.stat(path)
+        digest = hashlib.sha1("{}:{}:{}".format(
+            os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+            .encode("utf-8")).hexdigest()[:16]
+        name = os.path.splitext(os.path.basename(path))[0]
+        return os.path.join(self.cachePath, "{}-{}-{}.png".format(
+            name, width, digest))
+
+    def buildVariant(self, path, width):
+        variantPath = self.getVariantPath(path, width)
+        if os.path.exists(variantPath):
+            return variantPath
+        # Deferred, serving variants that exist only reads bytes
+        from PIL import Image
+
+        with Image.open(path) as image:
+            image.load()
+            if image.width > width:
+                image = image.resize(
+                    (width, max(1, round(image.height * width / image.width))),
+                    Image.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG", optimize=True)
+        os.makedirs(self.cachePath, exist_ok=True)
+        # Renamed into place so concurrent sessions never read a partial file
+        handle, temporaryPath = tempfile.mkstemp(dir=self.cachePath)
+        with os.fdopen(handle, "wb") as f:
+            f.write(buffer.getvalue())
+        os.replace(temporaryPath, variantPath)
+        return variantPath
+
+    def getCached(self, key, load, getSize):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key][0]
+        value = load()
+        size = getSize(value)
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = (value, size)
+                self.cachedBytes += size
+            while self.cachedBytes > self.maxBytes and len(self.entries) > 1:
+                _, (_, evictedSize) = self.entries.popitem(last=False)
+                self.cachedBytes -= evictedSize
+        return value
+
+    def getImageBytes(self, path, width=None):
+        width = width or self.width
+        variantPath = self.getVariantPath(path, width)
+
+        def load():
+            with open(self.buildVariant(path, width), "rb") as f:
+                return f.read()
+        return self.getCached(("bytes", variantPath), load, len)
+
+    def getImage(self, path, width=None):
+        width = width or self.width
+        variantPath = self.getVariantPath(path, width)
+
+        def load():
+            from PIL import Image
+
+            image = Image.open(self.buildVariant(path, width))
+            image.load()
+            return image
+        return self.getCached(
+            ("image", variantPath), load,
+            lambda image: image.width * image.height * len(image.getbands()))
+
+    def getFormationImages(self, clubName, formationsDir=TEAM_FORMATIONS_DIR):
+        return [self.getImageBytes(path)
+                for path in getFormationPaths(clubName, formationsDir)]
+
+    def prebuild(self, paths, width=None):
+        # Builds the display variants without loading them into memory
+        for path in paths:
+            self.buildVariant(path, width or self.width)
+
+
+if __name__ == "__main__":
+    assetStore = ImageAssetStore()
+    paths = [os.path.join(RESOURCES_DIR, fileName)
+             for fileName in sorted(os.listdir(RESOURCES_DIR))
+             if fileName.endswith(".png")]
+    for clubName in getClubNames():
+        paths.extend(getFormationPaths(clubName))
+    start = time.perf_counter()
+    assetStore.prebuild(paths)
+    print("Built {} display variants in {:.1f}s".format(
+        len(paths), time.perf_counter() - start))
+    for path in paths:
+        print("{:>10} -> {:>9} bytes  {}".format(
+            os.path.getsize(path), len(assetStore.getImageBytes(path)),
+            os.path.relpath(path, RESOURCES_DIR)))
@@ -0,0 +1,175 @@
+import io
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from math import pi
+
+sys.path.append(os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+from shared.constants import RESOURCES_DIR
+
+DONUT_LABELS = {
+    "Win": ["Win", "Draw", "Loss"],
+    "Defeat": ["Defeat", "Draw", "Win"],
+    "Draw": ["Draw", "Win", "Defeat"],
+}
+DONUT_COLORS = {
+    "Win": ["g", "b", "r"],
+    "Defeat": ["r", "b", "g"],
+    "Draw": ["b", "g", "r"],
+}
+
+
+def getDonutProbabilities(prob1, prob2):
+    # Percentages shown on the donuts, largest first
+    first = round(float(prob1) * 100 * 1.5, 2)
+    second = round(float(prob2) * 100, 2)
+    return tuple(sorted([first, second, round(100.0 - (first + second), 2)])
+                 [::-1])
+
+
+class DonutChartRenderer(object):
+    # Draws on a standalone Figure rather than through pyplot, so nothing
+    # is registered globally. Building the three polar axes dominates the
+    # cost of a chart, so they are built once and only the bars, labels and
+    # titles change between charts.
+
+    def __init__(self):
+        # Deferred, a dashboard serving cached charts never imports
+        # matplotlib
+        from matplotlib.figure import Figure
+
+        self.figure = Figure(figsize=(6, 6))
+        self.axes = self.figure.subplots(
+            1, 3, subplot_kw={"projection": "polar"})
+        self.bars = []
+        self.texts = []
+        startangle = 90
+        left = (startangle * pi * 2) / 360
+        for ax in self.axes:
+            ax.set_xticks([])
+            ax.set_yticks([])
+            ax.spines.clear()
+            self.bars.append(ax.barh(1, 0, left=left, height=1)[0])
+            ax.set_ylim(-3, 3)
+            self.texts.append(ax.text(0, -3, "", ha="center", va="center",
+                                      fontsize=10))
+            ax.set(ylabel="")
+
+    def render(self, probabilities, result):
+        labels = DONUT_LABELS.get(result, [])
+        colors = DONUT_COLORS.get(result, DONUT_COLORS["Draw"])
+        for i, (ax, bar, text) in enumerate(zip(
+                self.axes, self.bars, self.texts)):
+            shown = i < min(len(probabilities), len(labels))
+            bar.set_visible(shown)
+            text.set_visible(shown)
+            ax.set_title(labels[i] if shown else "")
+            if shown:
+                bar.set_width((probabilities[i] * pi * 2) / 100)
+                bar.set_color(colors[i])
+                text.set_text("{}".format(probabilities[i]))
+        buffer = io.BytesIO()
+        self.figure.savefig(buffer, format="png", bbox_inches="tight")
+        return buffer.getvalue()
+
+    def close(self):
+        self.figure.clear()
+
+
+def renderDonutChart(probabilities, result):
+    renderer = DonutChartRenderer()
+    try:
+        return renderer.render(probabilities, result)
+    finally:
+        renderer.close()
+
+
+class DonutChartCache(object):
+    # LRU of rendered donut PNGs keyed by (probabilities, result). Matches
+    # with the same rounded probabilities and result share one entry. Shared
+    # by every dashboard session, hence the locks; misses are rendered one at
+    # a time on a single reused figure.
+
+    def __init__(self, maxEntries=256):
+        self.maxEntries = maxEntries
+        self.charts = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.renderLock = threading.Lock()
+        self.renderer = None
+
+    def __len__(self):
+        return len(self.charts)
+
+    def getChart(self, probabilities, result):
+        key = (tuple(probabilities), result)
+        with self.lock:
+            chart = self.charts.get(key)
+            if chart is not None:
+                self.hits += 1
+                self.charts.move_to_end(key)
+                return chart
+            self.misses += 1
+        with self.renderLock:
+            if self.renderer is None:
+                self.renderer = DonutChartRenderer()
+            chart = self.renderer.render(key[0], result)
+        with self.lock:
+            self.charts[key] = chart
+            while len(self.charts) > self.maxEntries:
+                self.charts.popitem(last=False)
+        return chart
+
+    def close(self):
+        with self.renderLock:
+            if self.renderer is not None:
+                self.renderer.close()
+                self.renderer = None
+
+    def addCharts(self, charts):
+        # Seeds the cache with charts rendered elsewhere, e.g. restored from
+        # a dashboard snapshot, growing it so that none of them is evicted
+        with self.lock:
+            self.charts.update(charts)
+            self.maxEntries = max(self.maxEntries, len(self.charts))
+
+    def getPredictionChart(self, prediction):
+        return self.getChart(getDonutProbabilities(
+            prediction["probability_1"], prediction["probability_2"]),
+            prediction["result"])
+
+    def prerender(self, predictionIndex):
+        # Renders every match of the index up front, growing the cache so
+        # that none of them is evicted
+        predictions = predictionIndex.predictions
+        keys = {(getDonutProbabilities(prob1, prob2), result)
+                for prob1, prob2, result in zip(
+                    predictions.probability_1, predictions.probability_2,
+                    predictions.result.astype(str))}
+        self.maxEntries = max(self.maxEntries, len(keys))
+        for probabilities, result in keys:
+            self.getChart(probabilities, result)
+        self.close()
+        return len(keys)
+
+
+if __name__ == "__main__":
+    from visualization.predictions import PredictionIndex
+
+    predictionIndex = PredictionIndex.fromCsv(
+        os.path.join(RESOURCES_DIR, "prediction.csv"))
+    donutCharts = DonutChartCache()
+    start = time.perf_counter()
+    rendered = donutCharts.prerender(predictionIndex)
+    seconds = time.perf_counter() - start
+    print("Rendered {} charts for {} matches in {:.1f}s ({:.1f}ms each)".format(
+        rendered, len(predictionIndex), seconds, 1000 * seconds / rendered))
+    prediction = predictionIndex.predictions.iloc[0]
+    start = time.perf_counter()
+    donutCharts.getPredictionChart(prediction)
+    print("Cached lookup took {:.3f}ms".format(
+        1000 * (time.perf_counter() - start)))
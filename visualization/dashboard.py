@@ -1,46 +1,81 @@
 import streamlit as st
 import streamlit.components.v1 as components
-from PIL import Image
-from math import pi
 import os
-import matplotlib.pyplot as plt
 import sys
 sys.path.append(os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
 
 from shared.constants import RESOURCES_DIR
+from visualization.assets import (TEAM_FORMATIONS_DIR, ImageAssetStore,
+                                   getClubNames)
+from visualization.charts import DonutChartCache
+from visualization.predictions import PredictionIndex
+from visualization.snapshot import loadDashboardSnapshot
+
+
+def getModifiedTime(path):
+    # Passed to the cached loaders so that editing a file invalidates them
+    return os.stat(path).st_mtime_ns
+
+
+@st.experimental_memo(max_entries=32)
+def loadText(path, modifiedTime):
+    with open(path) as f:
+        return f.read().strip()
+
+
+@st.experimental_singleton
+def loadSnapshot(path, modifiedTime):
+    # Written by visualization/snapshot.py, None when there is none for
+    # this prediction file
+    return loadDashboardSnapshot(path)
+
+
+@st.experimental_singleton
+def loadPredictionIndex(path, modifiedTime):
+    snapshot = loadSnapshot(path, modifiedTime)
+    if snapshot is not None:
+        return snapshot["prediction_index"]
+    return PredictionIndex.fromCsv(path)
+
+
+@st.experimental_singleton
+def loadAssetStore():
+    return ImageAssetStore()
+
+
+@st.experimental_memo
+def loadClubNames(formationsDir, modifiedTime):
+    return getClubNames(formationsDir)
+
+
+@st.experimental_singleton
+def loadDonutCharts(path, modifiedTime, prerender=False):
+    donutCharts = DonutChartCache()
+    snapshot = loadSnapshot(path, modifiedTime)
+    if snapshot is not None:
+        donutCharts.addCharts(snapshot["donut_charts"])
+    if prerender and (snapshot is None or not snapshot["donut_charts"]):
+        donutCharts.prerender(loadPredictionIndex(path, modifiedTime))
+    return donutCharts
 
 
 def readImage(imgName, imgDir=RESOURCES_DIR):
-    return Image.open(os.path.join(imgDir, imgName))
+    # Display sized PNG bytes, served to the browser without re-encoding
+    return loadAssetStore().getImageBytes(os.path.join(imgDir, imgName))
 
 
 def readHtmlAsPlainText(fileName, fileDir=RESOURCES_DIR):
-    with open(os.path.join(fileDir, fileName)) as f:
-        text = f.read().strip()
-    return text
-
-
-with open(os.path.join(RESOURCES_DIR, "prediction.csv"), "r") as f:
-    predictionData = f.read()
-
-
-predictionDict = dict()
-for predictedResult in predictionData.splitlines():
-    matchId, actualResult, prob1, prob2, prob3, \
-        league, homeTeam, awayTeam, homeGoals, awayGoals, \
-        season, stage = predictedResult.split(",")
-    if league not in predictionDict:
-        predictionDict[league] = dict()
-    if season not in predictionDict[league]:
-        predictionDict[league][season] = dict()
-    if stage not in predictionDict[league][season]:
-        predictionDict[league][season][stage] = dict()
-    # predictionDict[league]
-    #     predictionDict[league]
-    #     predictionDict[league][season] = dict()
-    # predictionDict[league][season][stage] = dict()
-    predictionDict[league][season][stage]["{} VS {}".format(homeTeam, awayTeam)] \
-        = [actualResult, homeGoals, awayGoals, prob1, prob2, prob3]
+    path = os.path.join(fileDir, fileName)
+    return loadText(path, getModifiedTime(path))
+
+
+PREDICTION_FILE = os.path.join(RESOURCES_DIR, "prediction.csv")
+# Set PRERENDER_DONUT_CHARTS=1 to render every match's chart at startup
+PRERENDER_DONUT_CHARTS = os.environ.get("PRERENDER_DONUT_CHARTS") == "1"
+predictionIndex = loadPredictionIndex(
+    PREDICTION_FILE, getModifiedTime(PREDICTION_FILE))
+donutCharts = loadDonutCharts(
+    PREDICTION_FILE, getModifiedTime(PREDICTION_FILE), PRERENDER_DONUT_CHARTS)
 
 
 NUMBER_OF_PLAYERS_BY_NATIONALITY_IMG = "visualization_1.png"
@@ -51,27 +86,10 @@ SOCCER_SKILL_CORRELATION_IMG = "soccer_correlation_skills.png"
 WORD_CLOUD_IMG = "word_cloud.png"
 STAGE_REACHED_HTML = "stage_reached_frequency.html"
 COUNTRY_PERF_DASHBOARD_HTML = "country_perf_dashboard.html"
-TEAM_FORMATIONS_DIR = os.path.join(RESOURCES_DIR, "team_formations")
 COUNTRY_HOME_AWAY_GOALS = "home_away_goals.html"
 
-clubNames = [
-    "select",
-    "Athletic Club de Bilbao",
-    "Bayer 04 Leverkusen",
-    "Chelsea",
-    "FC Ingolstadt 04",
-    "Getafe CF",
-    "Granada CF",
-    "Hertha BSC Berlin",
-    "Leicester City",
-    "Manchester City",
-    "SV Darmstadt 98",
-    "Sevilla FC",
-    "Southampton",
-    "Sunderland",
-    "TSG 1899 Hoffenheim",
-    "UD Las Palmas"
-]
+clubNames = ["select"] + loadClubNames(
+    TEAM_FORMATIONS_DIR, getModifiedTime(TEAM_FORMATIONS_DIR))
 
 st.title("CMSC 691 Introduction to Data Science")
 
@@ -85,29 +103,28 @@ buttonClicked = False
 
 st.sidebar.header("Predictions")
 leagueName = st.sidebar.selectbox(
-    'League', ["select", "England Premier League", "Belgium Jupiler League"], 0)
+    'League', ["select"] + predictionIndex.getLeagues(), 0)
 if (leagueName != "select"):
     seasonOptions = ["select"]
-    seasonOptions.extend(predictionDict[leagueName].keys())
+    seasonOptions.extend(predictionIndex.getSeasons(leagueName))
     seasonName = st.sidebar.selectbox("Season", seasonOptions, 0)
     if (seasonName != "select"):
         stageOptions = ["select"]
-        stageOptions.extend(predictionDict[leagueName][seasonName].keys())
+        stageOptions.extend(predictionIndex.getStages(leagueName, seasonName))
         stageName = st.sidebar.selectbox("Stage", stageOptions, 0)
         if (stageName != "select"):
             matchOptions = ["select"]
-            matchOptions.extend(
-                predictionDict[leagueName][seasonName][stageName].keys())
+            matchOptions.extend(predictionIndex.getMatches(
+                leagueName, seasonName, stageName))
             matchName = st.sidebar.selectbox("Match", matchOptions, 0)
             if (matchName != "select"):
-                homeTeamName, awayTeamName = matchName.split(" VS ")
-                actualResult, homeGoals, awayGoals, prob1, prob2, prob3 = predictionDict[
-                    leagueName][seasonName][stageName][matchName]
-                probs = sorted([round(float(prob1) * 100 * 1.5, 2),
-                                round(float(prob2) * 100, 2),
-                                round(100.0 - (round(float(prob1) * 100 * 1.5, 2) + round(float(prob2) * 100, 2)), 2)])[
-                        ::-1]
-
+                prediction = predictionIndex.getPrediction(
+                    leagueName, seasonName, stageName, matchName)
+                homeTeamName = prediction["home_team"]
+                awayTeamName = prediction["away_team"]
+                actualResult = prediction["result"]
+                homeGoals = prediction["home_goals"]
+                awayGoals = prediction["away_goals"]
                 resultColor = ""
                 if (actualResult == "Win"):
                     resultColor = "color:Green"
@@ -131,44 +148,8 @@ if (leagueName != "select"):
                 with col4:
                     st.subheader(awayTeamName)
 
-                labels = []
-                if actualResult == "Win":
-                    labels = ["Win", "Draw", "Loss"]
-                if actualResult == "Defeat":
-                    labels = ["Defeat", "Draw", "Win"]
-                if actualResult == "Draw":
-                    labels = ["Draw", "Win", "Defeat"]
-
                 st.header("Prediction")
-                donutDict = dict()
-                id = 0
-                fig, ax = plt.subplots(1, 3, figsize=(
-                    6, 6), subplot_kw={'projection': 'polar'})
-                if (actualResult == "Win"):
-                    colorLabels = ["g", "b", "r"]
-                elif (actualResult == "Defeat"):
-                    colorLabels = ["r", "b", "g"]
-                else:
-                    colorLabels = ["b", "g", "r"]
-                for prob, label, colorname in zip(probs, labels, colorLabels):
-                    # generate donut chart
-                    data = prob
-                    startangle = 90
-                    x = (data * pi * 2) / 100
-                    left = (startangle * pi * 2) / 360
-                    ax[id].set_xticks([])
-                    ax[id].set_yticks([])
-                    # ax[id].xticks([])
-                    # ax[id].yticks([])
-                    ax[id].spines.clear()
-                    ax[id].barh(1, x, left=left, height=1, color=colorname)
-                    ax[id].set_ylim(-3, 3)
-                    # ax[id].ylim(-3, 3)
-                    ax[id].text(0, -3, "{}".format(data),
-                                ha='center', va='center', fontsize=10)
-                    ax[id].set(ylabel='', title=label)
-                    id += 1
-                st.pyplot(plt)
+                st.image(donutCharts.getPredictionChart(prediction))
 
 
 
@@ -192,10 +173,13 @@ st.sidebar.subheader("Team Formations")
 clubName = st.sidebar.selectbox(
     'Clubs', clubNames, 0)
 if (clubName != "select"):
+    # Only the selected club's formations are loaded
+    homeFormation, awayFormation = loadAssetStore().getFormationImages(
+        clubName)
     st.header("Home Team Formations of {}".format(clubName))
-    st.image(readImage("{}_home.png".format(clubName), TEAM_FORMATIONS_DIR))
+    st.image(homeFormation)
     st.header("Away Team Formations of {}".format(clubName))
-    st.image(readImage("{}_away.png".format(clubName), TEAM_FORMATIONS_DIR))
+    st.image(awayFormation)
 clubNamesTicked = False
 homeVsAwayGoalsTicked = st.sidebar.checkbox("Home vs Away Goals")
 if (homeVsAwayGoalsTicked):
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+
+# Layout of resources/prediction.csv as written by scoring.scoreMatches
+PREDICTION_COLUMNS = [
+    "match_api_id",
+    "result",
+    "probability_1",
+    "probability_2",
+    "probability_3",
+    "league",
+    "home_team",
+    "away_team",
+    "home_goals",
+    "away_goals",
+    "season",
+    "stage",
+]
+PREDICTION_DTYPES = {
+    "match_api_id": np.float64,
+    "result": "category",
+    "probability_1": np.float64,
+    "probability_2": np.float64,
+    "probability_3": np.float64,
+    "league": "category",
+    "home_team": "category",
+    "away_team": "category",
+    "home_goals": np.int16,
+    "away_goals": np.int16,
+    "season": "category",
+    "stage": np.int16,
+}
+LEVELS = ["league", "season", "stage"]
+
+
+class PredictionIndex(object):
+    # Predictions kept as one columnar frame sorted by league, season, stage
+    # and match name. The options of every dropdown level are computed once,
+    # and the matches of a stage are a contiguous slice of the frame.
+
+    def __init__(self, predictions):
+        predictions = predictions.assign(match=(
+            predictions.home_team.astype(str) + " VS " +
+            predictions.away_team.astype(str)))
+        self.predictions = predictions.sort_values(
+            LEVELS + ["match"], kind="mergesort").reset_index(drop=True)
+        self.options = dict()
+        self.stageSlices = dict()
+        keys = self.predictions[LEVELS].astype(str)
+        starts = np.flatnonzero(
+            (keys != keys.shift()).any(axis=1).to_numpy())
+        ends = np.append(starts[1:], len(keys))
+        levels = [self.predictions[level].iloc[starts].tolist()
+                  for level in LEVELS]
+        for start, end, league, season, stage in zip(
+                starts, ends, *levels):
+            self.options.setdefault((), []).append(league)
+            self.options.setdefault((league,), []).append(season)
+            self.options.setdefault((league, season), []).append(stage)
+            self.stageSlices[(league, season, stage)] = slice(start, end)
+        for key, values in self.options.items():
+            self.options[key] = list(dict.fromkeys(values))
+
+    @classmethod
+    def fromCsv(cls, path):
+        return cls(pd.read_csv(path, header=None, names=PREDICTION_COLUMNS,
+                               dtype=PREDICTION_DTYPES))
+
+    def __len__(self):
+        return len(self.predictions)
+
+    def getLeagues(self):
+        return self.options.get((), [])
+
+    def getSeasons(self, league):
+        return self.options.get((league,), [])
+
+    def getStages(self, league, season):
+        return self.options.get((league, season), [])
+
+    def getStageMatches(self, league, season, stage):
+        return self.predictions.iloc[
+            self.stageSlices.get((league, season, stage), slice(0, 0))]
+
+    def getMatches(self, league, season, stage):
+        return self.getStageMatches(league, season, stage).match.tolist()
+
+    def getPrediction(self, league, season, stage, match):
+        matches = self.getStageMatches(league, season, stage)
+        position = np.searchsorted(matches.match.to_numpy(), match)
+        if position == len(matches) or \
+                matches.match.iloc[position] != match:
+            raise KeyError(match)
+        return matches.iloc[position].to_dict()
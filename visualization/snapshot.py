@@ -0,0 +1,90 @@
+import argparse
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+from shared.constants import ASSET_CACHE_PATH, RESOURCES_DIR
+from visualization.charts import DonutChartCache
+from visualization.predictions import PredictionIndex
+
+# Bump whenever PredictionIndex or the chart cache change shape
+SNAPSHOT_VERSION = 1
+DASHBOARD_SNAPSHOT_FILE = os.path.join(
+    ASSET_CACHE_PATH, "dashboard_snapshot.pkl")
+PREDICTION_FILE = os.path.join(RESOURCES_DIR, "prediction.csv")
+
+
+def getSourceDigest(path):
+    # Content hash rather than mtime, a snapshot built into an image stays
+    # valid wherever the image's files land
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def saveDashboardSnapshot(predictionFile=PREDICTION_FILE,
+                          path=DASHBOARD_SNAPSHOT_FILE, prerender=True):
+    # Pickles the parsed prediction index and, with prerender, the donut
+    # chart of every match, so that a new dashboard worker neither parses
+    # the CSV nor imports matplotlib
+    predictionIndex = PredictionIndex.fromCsv(predictionFile)
+    charts = dict()
+    if prerender:
+        donutCharts = DonutChartCache()
+        donutCharts.prerender(predictionIndex)
+        charts = dict(donutCharts.charts)
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "source": getSourceDigest(predictionFile),
+        "prediction_index": predictionIndex,
+        "donut_charts": charts,
+    }
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    handle, temporaryPath = tempfile.mkstemp(dir=os.path.dirname(path) or ".")
+    with os.fdopen(handle, "wb") as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporaryPath, path)
+    return snapshot
+
+
+def loadDashboardSnapshot(predictionFile=PREDICTION_FILE,
+                          path=DASHBOARD_SNAPSHOT_FILE):
+    # None when there is no usable snapshot of this prediction file
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            snapshot = pickle.load(f)
+    except (OSError, EOFError, AttributeError, ImportError,
+            pickle.UnpicklingError):
+        return None
+    if not isinstance(snapshot, dict) or \
+            snapshot.get("version") != SNAPSHOT_VERSION or \
+            snapshot.get("source") != getSourceDigest(predictionFile):
+        return None
+    return snapshot
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--predictions", default=PREDICTION_FILE)
+    parser.add_argument("--output", default=DASHBOARD_SNAPSHOT_FILE)
+    parser.add_argument("--no-charts", action="store_true",
+                        help="Only snapshot the prediction index")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    snapshot = saveDashboardSnapshot(args.predictions, args.output,
+                                     not args.no_charts)
+    print("Snapshot of {} matches and {} charts written to {} in {:.1f}s"
+          .format(len(snapshot["prediction_index"]),
+                  len(snapshot["donut_charts"]), args.output,
+                  time.perf_counter() - start))
+    start = time.perf_counter()
+    loadDashboardSnapshot(args.predictions, args.output)
+    print("Loading it takes {:.1f}ms".format(
+        1000 * (time.perf_counter() - start)))